@@ -0,0 +1,73 @@
+import copy
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.authentication import TokenAuthentication
+
+from recipes.cache import shared_cache_configured
+
+# Счётчики меняются запросами UPDATE в обход экземпляра пользователя;
+# в кэше они отложены, чтобы save() не перезаписал их старыми значениями.
+UNCACHED_USER_FIELDS = ('recipes_count', 'subscribers_count')
+
+
+def _token_cache_key(key):
+    digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+    return f'auth:token:{digest}'
+
+
+def _user_cache_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def invalidate_token(key):
+    cache.delete(_token_cache_key(key))
+
+
+def invalidate_user(user_id):
+    """Удаляет из кэша токен пользователя, например после смены пароля."""
+    user_key = _user_cache_key(user_id)
+    token_key = cache.get(user_key)
+    cache.delete_many([user_key, token_key] if token_key else [user_key])
+
+
+def invalidate_user_on_commit(user_id):
+    transaction.on_commit(lambda: invalidate_user(user_id))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Аутентификация по токену с кэшированием пользователя.
+
+    Заменяет TokenAuthentication без изменений на клиенте: пара токен -
+    пользователь хранится в кэше AUTH_TOKEN_CACHE_TIMEOUT секунд, и
+    повторные запросы с тем же токеном не обращаются к БД. Запись
+    удаляется при выходе (удалении токена), а также при любом изменении
+    пользователя: смене пароля, блокировке и т. п.
+
+    Кэш используется, только если он общий для всех процессов: иначе
+    отозванный токен продолжал бы работать в других воркерах.
+    """
+
+    def authenticate_credentials(self, key):
+        if not shared_cache_configured():
+            return super().authenticate_credentials(key)
+        token_key = _token_cache_key(key)
+        user = cache.get(token_key)
+        if user is None:
+            user, token = super().authenticate_credentials(key)
+            cached_user = copy.copy(user)
+            for field in UNCACHED_USER_FIELDS:
+                cached_user.__dict__.pop(field, None)
+            cache.set_many(
+                {
+                    token_key: cached_user,
+                    _user_cache_key(user.pk): token_key,
+                },
+                settings.AUTH_TOKEN_CACHE_TIMEOUT,
+            )
+            return user, token
+        token = self.get_model()(key=key, user=user)
+        token._state.adding = False
+        return user, token
@@ -0,0 +1,536 @@
+"""Утилиты нагрузочного тестирования API.
+
+Наполняют базу синтетическими данными и замеряют количество
+SQL-запросов, задержку и пиковое потребление памяти эндпоинтов.
+"""
+import asyncio
+import random
+import statistics
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import (close_old_connections, connection, connections,
+                       transaction)
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient, APIRequestFactory
+
+from api.authentication import CachedTokenAuthentication
+from recipes import counters
+from recipes.cache import RECIPES_VERSION_KEY, bump_cart_versions
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            RecipeTag, ShoppingCart, Tag, Unit)
+from users.models import Subscription
+
+User = get_user_model()
+
+BENCH_EMAIL_DOMAIN = '@bench.local'
+BENCH_TAG_SLUGS = ('bench-breakfast', 'bench-lunch', 'bench-dinner')
+BENCH_IMAGE = 'recipes/images/bench.png'
+BATCH_SIZE = 5000
+INGREDIENTS_PER_RECIPE = 5
+RECIPES_PER_AUTHOR = 20
+SUBSCRIPTIONS = 50
+SHOPPING_CART_SIZE = 20
+
+
+@dataclass
+class Endpoint:
+    """Эндпоинт с бюджетом SQL-запросов на один вызов."""
+    name: str
+    url: str
+    query_budget: int
+    anonymous: bool = False
+    # Замерять ответ из кэша (кэша ответов для анонимных эндпоинтов),
+    # а не его сборку по базе.
+    response_cache: bool = False
+
+
+@dataclass
+class Result:
+    """Результат замера одного эндпоинта."""
+    endpoint: Endpoint
+    status_code: int
+    queries: int
+    p50: float
+    p99: float
+    peak_memory: int
+
+    @property
+    def over_budget(self):
+        return self.queries > self.endpoint.query_budget
+
+
+ENDPOINTS = (
+    Endpoint('recipes-list', '/api/recipes/', 4),
+    Endpoint('recipes-list-limit-50', '/api/recipes/?limit=50', 4),
+    Endpoint('recipes-list-cursor', '/api/recipes/?cursor=&limit=50', 3),
+    Endpoint('recipes-list-anon', '/api/recipes/', 4, anonymous=True),
+    Endpoint(
+        'recipes-list-anon-hit', '/api/recipes/', 0, anonymous=True,
+        response_cache=True,
+    ),
+    Endpoint(
+        'recipes-filtered-anon',
+        f'/api/recipes/?tags={BENCH_TAG_SLUGS[0]}&limit=50',
+        4,
+        anonymous=True,
+    ),
+    Endpoint(
+        'recipes-filtered-anon-hit',
+        f'/api/recipes/?tags={BENCH_TAG_SLUGS[0]}&limit=50',
+        0,
+        anonymous=True,
+        response_cache=True,
+    ),
+    Endpoint('recipes-list-popular', '/api/recipes/?ordering=popular', 4),
+    Endpoint(
+        'recipes-list-attributes',
+        f'/api/recipes/?tags={BENCH_TAG_SLUGS[0]}&tags={BENCH_TAG_SLUGS[1]}'
+        '&cooking_time_max=60&exclude_ingredients=1,2',
+        4,
+    ),
+    Endpoint('recipes-search', '/api/recipes/?search=бенч рецепт', 4),
+    Endpoint(
+        'recipes-list-filtered',
+        f'/api/recipes/?tags={BENCH_TAG_SLUGS[0]}&is_in_shopping_cart=1',
+        5,
+    ),
+    Endpoint(
+        'users-subscriptions',
+        '/api/users/subscriptions/?recipes_limit=3',
+        3,
+    ),
+    Endpoint('ingredients-search', '/api/ingredients/?name=бенч', 0),
+    Endpoint(
+        'ingredients-fuzzy-search', '/api/ingredients/?search=бенч-ингр 7', 1
+    ),
+    Endpoint('tags-list', '/api/tags/', 0),
+    Endpoint(
+        'download_shopping_cart', '/api/recipes/download_shopping_cart/', 1
+    ),
+)
+
+
+def bench_users():
+    return User.objects.filter(email__endswith=BENCH_EMAIL_DOMAIN)
+
+
+def bench_recipes():
+    return Recipe.objects.filter(author__email__endswith=BENCH_EMAIL_DOMAIN)
+
+
+def clean():
+    """Удаляет все данные, созданные seed()."""
+    bench_users().delete()
+    Tag.objects.filter(slug__in=BENCH_TAG_SLUGS).delete()
+    Ingredient.objects.filter(name__startswith='бенч').delete()
+
+
+def _bulk_create(model, objects):
+    model.objects.bulk_create(objects, batch_size=BATCH_SIZE)
+
+
+def _seed_recipes(rng, start, stop, author_ids, tag_ids, ingredient_ids):
+    recipes = Recipe.objects.bulk_create(
+        [
+            Recipe(
+                author_id=rng.choice(author_ids),
+                name=f'Бенч-рецепт {i}',
+                text='Описание тестового рецепта.',
+                image=BENCH_IMAGE,
+                cooking_time=rng.randint(1, 180),
+            )
+            for i in range(start, stop)
+        ]
+    )
+    if recipes[0].pk is None:
+        # Не все СУБД возвращают первичные ключи из bulk_create.
+        recipes = list(bench_recipes().order_by('-id')[: stop - start])
+    _bulk_create(
+        RecipeTag,
+        [
+            RecipeTag(recipe=recipe, tag_id=tag_id)
+            for recipe in recipes
+            for tag_id in rng.sample(tag_ids, 2)
+        ],
+    )
+    _bulk_create(
+        RecipeIngredient,
+        [
+            RecipeIngredient(
+                recipe=recipe,
+                ingredient_id=ingredient_id,
+                amount=rng.randint(1, 500),
+            )
+            for recipe in recipes
+            for ingredient_id in rng.sample(
+                ingredient_ids, INGREDIENTS_PER_RECIPE
+            )
+        ],
+    )
+
+
+def seed(recipes_total, ingredients_total=2000, stdout=None):
+    """Доводит количество тестовых рецептов до recipes_total.
+
+    Повторный запуск с тем же размером ничего не создаёт, поэтому
+    большие наборы данных можно наполнить один раз и переиспользовать.
+    """
+    rng = random.Random(recipes_total)
+    authors_total = max(SUBSCRIPTIONS + 1, recipes_total // RECIPES_PER_AUTHOR)
+    existing_users = bench_users().count()
+    _bulk_create(
+        User,
+        [
+            User(
+                email=f'bench{i}{BENCH_EMAIL_DOMAIN}',
+                username=f'bench{i}',
+                first_name='Бенч',
+                last_name=f'Автор {i}',
+                password='!',
+            )
+            for i in range(existing_users, authors_total)
+        ],
+    )
+    author_ids = list(
+        bench_users().order_by('id').values_list('id', flat=True)
+    )
+
+    Tag.objects.bulk_create(
+        [
+            Tag(name=slug, color=f'#BE0C0{i}', slug=slug)
+            for i, slug in enumerate(BENCH_TAG_SLUGS)
+        ],
+        ignore_conflicts=True,
+    )
+    tag_ids = list(
+        Tag.objects.filter(slug__in=BENCH_TAG_SLUGS).values_list(
+            'id', flat=True
+        )
+    )
+
+    unit, _ = Unit.objects.get_or_create(name='г')
+    existing_ingredients = Ingredient.objects.filter(
+        name__startswith='бенч'
+    ).count()
+    _bulk_create(
+        Ingredient,
+        [
+            Ingredient(name=f'бенч-ингредиент {i}', measurement_unit=unit)
+            for i in range(existing_ingredients, ingredients_total)
+        ],
+    )
+    ingredient_ids = list(
+        Ingredient.objects.filter(name__startswith='бенч').values_list(
+            'id', flat=True
+        )
+    )
+
+    existing_recipes = bench_recipes().count()
+    for start in range(existing_recipes, recipes_total, BATCH_SIZE):
+        stop = min(start + BATCH_SIZE, recipes_total)
+        with transaction.atomic():
+            _seed_recipes(
+                rng, start, stop, author_ids, tag_ids, ingredient_ids
+            )
+        if stdout:
+            stdout.write(f'Создано рецептов: {stop}/{recipes_total}')
+
+    user_id = author_ids[0]
+    Subscription.objects.bulk_create(
+        [
+            Subscription(user_id=user_id, author_id=author_id)
+            for author_id in author_ids[1: SUBSCRIPTIONS + 1]
+        ],
+        ignore_conflicts=True,
+    )
+    recipe_ids = list(
+        bench_recipes().values_list('id', flat=True)[:SHOPPING_CART_SIZE]
+    )
+    for model in (Favorite, ShoppingCart):
+        model.objects.bulk_create(
+            [model(user_id=user_id, recipe_id=pk) for pk in recipe_ids],
+            ignore_conflicts=True,
+        )
+    # bulk_create не отправляет сигналы, поэтому счётчики пересчитываются.
+    counters.reconcile()
+    return User.objects.get(pk=user_id)
+
+
+def percentile(timings, percent):
+    ordered = sorted(timings)
+    index = round(percent / 100 * (len(ordered) - 1))
+    return ordered[index]
+
+
+def _get(client, url):
+    response = client.get(url)
+    if response.streaming:
+        b''.join(response.streaming_content)
+    return response
+
+
+def _prepare(endpoint, user):
+    # Новые версии рецептов и корзины: ответа нет ни в кэше ответов,
+    # ни в кэше списков покупок, и замер видит запросы и сериализацию,
+    # как без кэша.
+    if endpoint.response_cache:
+        return
+    if endpoint.anonymous:
+        cache.delete(RECIPES_VERSION_KEY)
+    else:
+        bump_cart_versions([user.id])
+
+
+def measure(endpoint, user, iterations):
+    """Замеряет эндпоинт от имени user; первый вызов прогревает кэши."""
+    client = APIClient()
+    if not endpoint.anonymous:
+        client.force_authenticate(user)
+    _get(client, endpoint.url)
+    _prepare(endpoint, user)
+    with CaptureQueriesContext(connection) as context:
+        _get(client, endpoint.url)
+    queries = len(context)
+    timings = []
+    for _ in range(iterations):
+        _prepare(endpoint, user)
+        started = time.perf_counter()
+        _get(client, endpoint.url)
+        timings.append(time.perf_counter() - started)
+    _prepare(endpoint, user)
+    tracemalloc.start()
+    try:
+        response = _get(client, endpoint.url)
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return Result(
+        endpoint=endpoint,
+        status_code=response.status_code,
+        queries=queries,
+        p50=statistics.median(timings),
+        p99=percentile(timings, 99),
+        peak_memory=peak_memory,
+    )
+
+
+@dataclass
+class AuthenticationResult:
+    """Результат замера одного класса аутентификации."""
+    name: str
+    queries: int
+    p50: float
+    p99: float
+
+
+AUTHENTICATION_CLASSES = (TokenAuthentication, CachedTokenAuthentication)
+
+
+def measure_authentication(user, iterations):
+    """Замеряет аутентификацию запроса по токену user каждым классом.
+
+    Сравнивается только сама аутентификация, которую DRF выполняет
+    перед любым представлением; первый вызов прогревает кэш.
+    """
+    token, _ = Token.objects.get_or_create(user=user)
+    request = APIRequestFactory().get(
+        '/api/users/me/', HTTP_AUTHORIZATION=f'Token {token.key}'
+    )
+    results = []
+    for authentication_class in AUTHENTICATION_CLASSES:
+        authentication = authentication_class()
+        authentication.authenticate(request)
+        with CaptureQueriesContext(connection) as context:
+            authentication.authenticate(request)
+        timings = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            authentication.authenticate(request)
+            timings.append(time.perf_counter() - started)
+        results.append(
+            AuthenticationResult(
+                name=authentication_class.__name__,
+                queries=len(context),
+                p50=statistics.median(timings),
+                p99=percentile(timings, 99),
+            )
+        )
+    return results
+
+
+@dataclass
+class LoadResult:
+    """Результат нагрузочного прогона одного режима."""
+    mode: str
+    url: str
+    requests: int
+    errors: int
+    rps: float
+    p50: float
+    p99: float
+
+
+LOAD_URLS = (
+    '/api/recipes/?limit=6',
+    '/api/recipes/?limit=50',
+    '/api/ingredients/?name=бенч',
+    '/api/tags/',
+)
+
+
+def _load_result(mode, url, statuses, timings, elapsed):
+    return LoadResult(
+        mode=mode,
+        url=url,
+        requests=len(timings),
+        errors=sum(status != 200 for status in statuses),
+        rps=len(timings) / elapsed,
+        p50=statistics.median(timings),
+        p99=percentile(timings, 99),
+    )
+
+
+def load_wsgi(url, authorization, concurrency, total):
+    """Нагрузка через WSGI: concurrency потоков, как у gunicorn gthread."""
+    def worker(count):
+        client = Client(HTTP_AUTHORIZATION=authorization)
+        results = []
+        try:
+            for _ in range(count):
+                started = time.perf_counter()
+                # Тестовый клиент не закрывает соединения между
+                # запросами, как это делает обработчик WSGI по сигналам
+                # request_started и request_finished.
+                close_old_connections()
+                response = client.get(url)
+                close_old_connections()
+                results.append(
+                    (response.status_code, time.perf_counter() - started)
+                )
+        finally:
+            connections.close_all()
+        return results
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        chunks = pool.map(worker, [total // concurrency] * concurrency)
+        results = [result for chunk in chunks for result in chunk]
+    return _load_result(
+        'wsgi', url, [status for status, _ in results],
+        [timing for _, timing in results], time.perf_counter() - started,
+    )
+
+
+async def _load_asgi(url, authorization, concurrency, total):
+    async def worker(count):
+        client = AsyncClient()
+        results = []
+        for _ in range(count):
+            started = time.perf_counter()
+            # AsyncClient в Django 3.2 передаёт именованные аргументы
+            # как заголовки ASGI, без префикса HTTP_.
+            response = await client.get(url, authorization=authorization)
+            results.append(
+                (response.status_code, time.perf_counter() - started)
+            )
+        return results
+
+    started = time.perf_counter()
+    chunks = await asyncio.gather(
+        *[worker(total // concurrency) for _ in range(concurrency)]
+    )
+    results = [result for chunk in chunks for result in chunk]
+    return _load_result(
+        'asgi', url, [status for status, _ in results],
+        [timing for _, timing in results], time.perf_counter() - started,
+    )
+
+
+def load_asgi(url, authorization, concurrency, total):
+    """Нагрузка через ASGI: concurrency одновременных запросов."""
+    return asyncio.run(_load_asgi(url, authorization, concurrency, total))
+
+
+def compare_wsgi_asgi(user, concurrency, total):
+    """Сравнивает обработку тех же запросов через WSGI и через ASGI.
+
+    Под ASGI синхронные представления Django 3.2 выполняются в одном
+    общем потоке процесса.
+    """
+    token, _ = Token.objects.get_or_create(user=user)
+    authorization = f'Token {token.key}'
+    results = []
+    for url in LOAD_URLS:
+        for run, mode in ((load_wsgi, 'wsgi'), (load_asgi, 'asgi')):
+            run(url, authorization, concurrency, concurrency)
+            result = run(url, authorization, concurrency, total)
+            result.mode = mode
+            results.append(result)
+    return results
+
+
+# Дешёвые запросы к БД: на них заметнее цена установки соединения.
+CONNECTION_URLS = (
+    '/api/recipes/?limit=6',
+    '/api/users/subscriptions/?limit=6',
+)
+
+
+def connection_modes(concurrency):
+    """Настройки соединений PostgreSQL для сравнения режимов."""
+    return (
+        ('per-request', {}),
+        ('persistent', {'CONN_MAX_AGE': 60, 'CONN_HEALTH_CHECKS': True}),
+        ('pool', {
+            'CONN_HEALTH_CHECKS': True,
+            'POOL': {
+                'min_size': concurrency // 2,
+                'max_size': concurrency,
+                'timeout': 5,
+            },
+        }),
+    )
+
+
+def compare_connection_modes(user, concurrency, total):
+    """Сравнивает режимы соединений с PostgreSQL под нагрузкой WSGI.
+
+    Настройки меняются на время прогона: потоки каждого прогона
+    создают свои соединения уже с новыми настройками.
+    """
+    token, _ = Token.objects.get_or_create(user=user)
+    authorization = f'Token {token.key}'
+    original = {
+        alias: dict(connections.settings[alias]) for alias in connections
+    }
+    results = []
+    try:
+        for mode, options in connection_modes(concurrency):
+            for alias, settings_dict in original.items():
+                connections[alias].close()
+                connections.settings[alias] = {
+                    **settings_dict,
+                    'ENGINE': 'foodgram.postgresql',
+                    'CONN_MAX_AGE': 0,
+                    'CONN_HEALTH_CHECKS': False,
+                    'POOL': None,
+                    **options,
+                }
+            for url in CONNECTION_URLS:
+                load_wsgi(url, authorization, concurrency, concurrency)
+                result = load_wsgi(url, authorization, concurrency, total)
+                result.mode = mode
+                results.append(result)
+    finally:
+        for alias, settings_dict in original.items():
+            connections[alias].close()
+            connections.settings[alias] = settings_dict
+    return results
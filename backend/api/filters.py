@@ -1,6 +1,9 @@
 from django_filters import rest_framework as filters
 
-from recipes.models import Ingredient, Recipe, Tag
+from recipes.cache import favorites_cache, shopping_cart_cache, tags_cache
+from recipes.constants import RecipesOrdering
+from recipes.models import Ingredient, Recipe, RecipeIngredient, RecipeTag
+from recipes.search import search_recipes
 
 
 class IngredientFilter(filters.FilterSet):
@@ -12,28 +15,99 @@ class IngredientFilter(filters.FilterSet):
         fields = ('name',)
 
 
+def tag_choices():
+    return [(tag['slug'], tag['name']) for tag in tags_cache.get()['tags']]
+
+
+class NumberInFilter(filters.BaseInFilter, filters.NumberFilter):
+    """Список чисел через запятую."""
+
+
 class RecipesFilter(filters.FilterSet):
-    """Фильтр рецептов."""
-    tags = filters.ModelMultipleChoiceFilter(
-        field_name='tags__slug',
-        to_field_name='slug',
-        queryset=Tag.objects.all(),
+    """Фильтр рецептов.
+
+    Теги и ингредиенты проверяются подзапросами pk IN (...), которые
+    читают только индексы (tag, recipe) и (ingredient, recipe);
+    рецепты в выдаче не дублируются и DISTINCT не нужен.
+    """
+    tags = filters.MultipleChoiceFilter(
+        choices=tag_choices, method='filter_tags'
+    )
+    cooking_time_min = filters.NumberFilter(
+        field_name='cooking_time', lookup_expr='gte'
+    )
+    cooking_time_max = filters.NumberFilter(
+        field_name='cooking_time', lookup_expr='lte'
+    )
+    ingredients = NumberInFilter(method='filter_ingredients')
+    exclude_ingredients = NumberInFilter(
+        method='filter_exclude_ingredients'
     )
     is_favorited = filters.BooleanFilter(method='filter_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart'
     )
+    search = filters.CharFilter(method='filter_search')
+    ordering = filters.ChoiceFilter(
+        choices=(('popular', 'По популярности'),),
+        method='filter_ordering',
+    )
 
     class Meta:
         model = Recipe
-        fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart')
+        fields = (
+            'author', 'tags', 'cooking_time_min', 'cooking_time_max',
+            'ingredients', 'exclude_ingredients', 'is_favorited',
+            'is_in_shopping_cart', 'search', 'ordering',
+        )
 
-    def filter_is_favorited(self, queryset, name, value):
-        if value:
-            return queryset.filter(favorite__user__id=self.request.user.id)
+    def filter_tags(self, queryset, name, value):
+        if not value:
+            return queryset
+        tags = {tag['slug']: tag['id'] for tag in tags_cache.get()['tags']}
+        return queryset.filter(
+            pk__in=RecipeTag.objects.filter(
+                tag_id__in=[tags[slug] for slug in value]
+            ).values('recipe_id')
+        )
+
+    def filter_ingredients(self, queryset, name, value):
+        """Рецепты, в которых есть все перечисленные ингредиенты."""
+        for ingredient_id in set(value):
+            queryset = queryset.filter(
+                pk__in=RecipeIngredient.objects.filter(
+                    ingredient_id=ingredient_id
+                ).values('recipe_id')
+            )
         return queryset
 
+    def filter_exclude_ingredients(self, queryset, name, value):
+        """Рецепты без перечисленных ингредиентов."""
+        if not value:
+            return queryset
+        return queryset.exclude(
+            pk__in=RecipeIngredient.objects.filter(
+                ingredient_id__in=value
+            ).values('recipe_id')
+        )
+
+    def _filter_membership(self, queryset, membership, value):
+        if not value:
+            return queryset
+        if self.request.user.is_anonymous:
+            return queryset.none()
+        return membership.filter(queryset, self.request.user.id)
+
+    def filter_is_favorited(self, queryset, name, value):
+        return self._filter_membership(queryset, favorites_cache, value)
+
     def filter_is_in_shopping_cart(self, queryset, name, value):
-        if value:
-            return queryset.filter(shoppingcart__user__id=self.request.user.id)
-        return queryset
+        return self._filter_membership(queryset, shopping_cart_cache, value)
+
+    def filter_search(self, queryset, name, value):
+        if not value.strip():
+            return queryset
+        return search_recipes(queryset, value)
+
+    def filter_ordering(self, queryset, name, value):
+        return queryset.order_by(*RecipesOrdering[value.upper()].value)
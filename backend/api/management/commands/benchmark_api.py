@@ -0,0 +1,103 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import (setup_test_environment,
+                               teardown_test_environment)
+
+from api import benchmark, response_cache
+
+SIZES = {'1k': 1_000, '100k': 100_000, '1m': 1_000_000}
+
+
+class Command(BaseCommand):
+    help = (
+        "Замер количества SQL-запросов, задержки и памяти эндпоинтов API. "
+        "Завершается с ошибкой, если превышен бюджет запросов."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-s",
+            "--size",
+            choices=SIZES,
+            default="1k",
+            help="Размер набора тестовых рецептов",
+        )
+        parser.add_argument(
+            "-n",
+            "--iterations",
+            type=int,
+            default=20,
+            help="Количество замеров на эндпоинт",
+        )
+        parser.add_argument(
+            "-e",
+            "--endpoint",
+            action="append",
+            choices=[endpoint.name for endpoint in benchmark.ENDPOINTS],
+            help="Замерить только указанные эндпоинты",
+        )
+        parser.add_argument(
+            "--skip-seed",
+            action="store_true",
+            help="Не наполнять базу тестовыми данными",
+        )
+        parser.add_argument(
+            "--clean",
+            action="store_true",
+            help="Удалить тестовые данные и выйти",
+        )
+
+    def handle(self, *args, **options):
+        if options["clean"]:
+            benchmark.clean()
+            self.stdout.write(self.style.SUCCESS("Тестовые данные удалены."))
+            return
+        if options["skip_seed"]:
+            user = benchmark.bench_users().order_by("id").first()
+            if user is None:
+                raise CommandError("Тестовые данные не найдены.")
+        else:
+            user = benchmark.seed(
+                SIZES[options["size"]], stdout=self.stdout
+            )
+        endpoints = [
+            endpoint
+            for endpoint in benchmark.ENDPOINTS
+            if not options["endpoint"] or endpoint.name in options["endpoint"]
+        ]
+        setup_test_environment()
+        try:
+            results = [
+                benchmark.measure(endpoint, user, options["iterations"])
+                for endpoint in endpoints
+            ]
+        finally:
+            teardown_test_environment()
+
+        self.stdout.write(
+            f'{"endpoint":<26}{"status":>7}{"queries":>9}{"budget":>8}'
+            f'{"p50, ms":>10}{"p99, ms":>10}{"peak, KiB":>11}'
+        )
+        for result in results:
+            line = (
+                f"{result.endpoint.name:<26}{result.status_code:>7}"
+                f"{result.queries:>9}{result.endpoint.query_budget:>8}"
+                f"{result.p50 * 1000:>10.2f}{result.p99 * 1000:>10.2f}"
+                f"{result.peak_memory / 1024:>11.1f}"
+            )
+            style = self.style.ERROR if result.over_budget else str
+            self.stdout.write(style(line))
+
+        cache_stats = response_cache.stats
+        self.stdout.write(
+            f"Кэш анонимных ответов: попаданий {cache_stats.hits}, "
+            f"промахов {cache_stats.misses}, "
+            f"доля попаданий {cache_stats.hit_rate:.1%}"
+        )
+
+        failed = [result.endpoint.name for result in results
+                  if result.over_budget or result.status_code != 200]
+        if failed:
+            raise CommandError(
+                f"Превышен бюджет запросов или ошибка: {', '.join(failed)}"
+            )
+        self.stdout.write(self.style.SUCCESS("Бюджеты запросов соблюдены."))
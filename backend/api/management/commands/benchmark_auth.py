@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api import benchmark
+from recipes.cache import shared_cache_configured
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнение SQL-запросов и задержки аутентификации по токену "
+        "с кэшем и без него."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-n",
+            "--iterations",
+            type=int,
+            default=1000,
+            help="Количество замеров на класс аутентификации",
+        )
+
+    def handle(self, *args, **options):
+        user = benchmark.bench_users().order_by("id").first()
+        if user is None:
+            raise CommandError(
+                "Тестовые данные не найдены, запустите benchmark_api."
+            )
+        if not shared_cache_configured():
+            self.stderr.write(self.style.WARNING(
+                "Кэш по умолчанию хранится в памяти процесса, поэтому "
+                "CachedTokenAuthentication не кэширует токены."
+            ))
+        results = benchmark.measure_authentication(
+            user, options["iterations"]
+        )
+        self.stdout.write(
+            f'{"authentication":<28}{"queries":>9}'
+            f'{"p50, ms":>10}{"p99, ms":>10}'
+        )
+        for result in results:
+            self.stdout.write(
+                f"{result.name:<28}{result.queries:>9}"
+                f"{result.p50 * 1000:>10.3f}{result.p99 * 1000:>10.3f}"
+            )
+        baseline, cached = results
+        self.stdout.write(self.style.SUCCESS(
+            f"Экономия на запрос: {baseline.queries - cached.queries} "
+            f"SQL-запросов, "
+            f"{(baseline.p50 - cached.p50) * 1000:.3f} мс (p50)."
+        ))
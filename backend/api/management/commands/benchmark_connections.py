@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (setup_test_environment,
+                               teardown_test_environment)
+
+from api import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнение задержки и запросов в секунду при новом соединении "
+        "с PostgreSQL на каждый запрос, постоянных соединениях и пуле."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-c",
+            "--concurrency",
+            type=int,
+            default=16,
+            help="Количество одновременных клиентов",
+        )
+        parser.add_argument(
+            "-n",
+            "--requests",
+            type=int,
+            default=400,
+            help="Количество запросов на эндпоинт и режим",
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Режимы соединений сравниваются на PostgreSQL.")
+        user = benchmark.bench_users().order_by("id").first()
+        if user is None:
+            raise CommandError(
+                "Тестовые данные не найдены, запустите benchmark_api."
+            )
+        # Клиент Django обращается к хосту testserver.
+        setup_test_environment()
+        try:
+            results = benchmark.compare_connection_modes(
+                user, options["concurrency"], options["requests"]
+            )
+        finally:
+            teardown_test_environment()
+        self.stdout.write(
+            f'{"mode":<14}{"url":<38}{"errors":>7}{"rps":>9}'
+            f'{"p50, ms":>10}{"p99, ms":>10}'
+        )
+        for result in results:
+            line = (
+                f"{result.mode:<14}{result.url:<38}{result.errors:>7}"
+                f"{result.rps:>9.1f}{result.p50 * 1000:>10.2f}"
+                f"{result.p99 * 1000:>10.2f}"
+            )
+            style = self.style.ERROR if result.errors else str
+            self.stdout.write(style(line))
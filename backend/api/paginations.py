@@ -1,9 +1,148 @@
-from rest_framework.pagination import PageNumberPagination
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (Cursor, CursorPagination,
+                                       PageNumberPagination)
 
 from recipes.constants import Pagination
 
 
+class CustomCursorPagination(CursorPagination):
+    """Пагинация по курсору без подсчёта общего количества объектов.
+
+    Позиция курсора хранит значения всех полей сортировки, а не только
+    первого, как в CursorPagination: при сортировке по неуникальному
+    полю (ordering=popular) следующая страница отбирается условием
+    по всему ключу, например favorites_count < N или
+    favorites_count = N и id < M, без смещений внутри равных значений.
+    """
+    ordering = "-id"
+    page_size_query_param = "limit"
+    page_size = Pagination.PAGE_SIZE.value
+    position_separator = ","
+
+    def get_ordering(self, request, queryset, view):
+        # Сортировка, заданная фильтрами (например, ordering=popular),
+        # сохраняется; иначе используется сортировка по умолчанию.
+        if queryset.query.order_by:
+            return tuple(queryset.query.order_by)
+        return super().get_ordering(request, queryset, view)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse = bool(self.cursor and self.cursor.reverse)
+        position = self.cursor.position if self.cursor else None
+
+        ordering = self.ordering
+        if reverse:
+            ordering = tuple(
+                order[1:] if order.startswith("-") else f"-{order}"
+                for order in ordering
+            )
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(
+                self._following(queryset.model, ordering, position)
+            )
+
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_following = len(results) > len(self.page)
+        if reverse:
+            self.page.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_following
+        else:
+            self.has_next = has_following
+            self.has_previous = position is not None
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def _following(self, model, ordering, position):
+        """Условие «после позиции» для сортировки ordering."""
+        values = position.split(self.position_separator)
+        if len(values) != len(ordering):
+            raise NotFound(self.invalid_cursor_message)
+        condition = Q()
+        equal = Q()
+        for order, value in zip(ordering, values):
+            name = order.lstrip("-")
+            try:
+                value = model._meta.get_field(name).to_python(value)
+            except FieldDoesNotExist:
+                # Аннотация (например, rank поиска) приводит значение сама.
+                pass
+            except ValidationError:
+                raise NotFound(self.invalid_cursor_message)
+            lookup = "lt" if order.startswith("-") else "gt"
+            condition |= equal & Q(**{f"{name}__{lookup}": value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def _get_position_from_instance(self, instance, ordering):
+        return self.position_separator.join(
+            str(getattr(instance, order.lstrip("-"))) for order in ordering
+        )
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        # Пустая страница при движении назад означает, что раньше
+        # позиции ничего нет: следующей будет первая страница.
+        position = (
+            self._get_position_from_instance(self.page[-1], self.ordering)
+            if self.page else None
+        )
+        return self.encode_cursor(
+            Cursor(offset=0, reverse=False, position=position)
+        )
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        position = (
+            self._get_position_from_instance(self.page[0], self.ordering)
+            if self.page else None
+        )
+        return self.encode_cursor(
+            Cursor(offset=0, reverse=True, position=position)
+        )
+
+
 class CustomPageNumberPagination(PageNumberPagination):
-    """Кастомный класс пагинатора."""
+    """Кастомный класс пагинатора.
+
+    При наличии параметра cursor (в том числе пустого, для первой
+    страницы) переключается на пагинацию по курсору: без COUNT(*)
+    и OFFSET, поэтому глубокие страницы отдаются так же быстро,
+    как первая.
+    """
     page_size_query_param = "limit"
     page_size = Pagination.PAGE_SIZE.value
+    cursor_paginator = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if CustomCursorPagination.cursor_query_param in request.query_params:
+            self.cursor_paginator = CustomCursorPagination()
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view
+            )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response_schema(schema)
+        return super().get_paginated_response_schema(schema)
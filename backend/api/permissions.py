@@ -1,3 +1,5 @@
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
 from rest_framework.permissions import SAFE_METHODS, BasePermission
 
 
@@ -8,3 +10,17 @@ class IsAuthenticatedAuthorOrReadOnly(BasePermission):
 
     def has_object_permission(self, request, view, obj):
         return request.method in SAFE_METHODS or request.user == obj.author
+
+
+class IsStaffOrMetricsToken(BasePermission):
+    """Доступ для персонала или по заголовку Authorization: Bearer <токен>.
+
+    Токен задаётся METRICS_TOKEN и предназначен для сборщика метрик.
+    """
+    def has_permission(self, request, view):
+        if request.user.is_staff:
+            return True
+        token = settings.METRICS_TOKEN
+        return bool(token) and constant_time_compare(
+            request.headers.get('Authorization', ''), f'Bearer {token}'
+        )
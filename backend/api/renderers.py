@@ -0,0 +1,117 @@
+import csv
+import io
+
+from django.conf import settings
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+from rest_framework.renderers import BaseRenderer
+
+SHOPPING_LIST_TITLE = 'Список покупок'
+
+
+class ShoppingListRenderer(BaseRenderer):
+    """Базовый рендерер списка покупок.
+
+    Наследники реализуют stream(): он принимает итератор строк
+    агрегированного списка покупок и отдаёт файл по частям.
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            # Ответы с ошибками приходят словарём с описанием ошибки.
+            return str(data.get('detail', data)).encode('utf-8')
+        return b''.join(self.stream(data))
+
+
+class TxtShoppingListRenderer(ShoppingListRenderer):
+    """Список покупок в текстовом формате."""
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, ingredients):
+        yield f'{SHOPPING_LIST_TITLE}\n\n'.encode(self.charset)
+        for ingredient in ingredients:
+            yield (
+                f'- {ingredient["ingredient__name"]} '
+                f'({ingredient["ingredient__measurement_unit__name"]})'
+                f' - {ingredient["amount"]}\n'
+            ).encode(self.charset)
+
+
+class CsvShoppingListRenderer(ShoppingListRenderer):
+    """Список покупок в формате CSV."""
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, ingredients):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in self._rows(ingredients):
+            writer.writerow(row)
+            yield buffer.getvalue().encode(self.charset)
+            buffer.seek(0)
+            buffer.truncate()
+
+    def _rows(self, ingredients):
+        yield ('Ингредиент', 'Единица измерения', 'Количество')
+        for ingredient in ingredients:
+            yield (
+                ingredient['ingredient__name'],
+                ingredient['ingredient__measurement_unit__name'],
+                ingredient['amount'],
+            )
+
+
+class PdfShoppingListRenderer(ShoppingListRenderer):
+    """Список покупок в формате PDF.
+
+    В отличие от TXT и CSV, документ собирается в памяти и отдаётся
+    одной частью: reportlab записывает PDF только в save(), так как
+    таблица ссылок на объекты идёт в конце файла.
+    """
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+    font_name = 'Typeface'
+    font_size = 12
+    margin = 50
+    line_height = 20
+
+    def stream(self, ingredients):
+        if self.font_name not in pdfmetrics.getRegisteredFontNames():
+            font_path = settings.BASE_DIR / 'fonts' / 'typeface.ttf'
+            pdfmetrics.registerFont(TTFont(self.font_name, font_path))
+        buffer = io.BytesIO()
+        document = canvas.Canvas(buffer, pagesize=A4)
+        _, height = A4
+        document.setFont(self.font_name, self.font_size + 4)
+        document.drawString(
+            self.margin, height - self.margin, SHOPPING_LIST_TITLE
+        )
+        document.setFont(self.font_name, self.font_size)
+        y = height - self.margin - 2 * self.line_height
+        for ingredient in ingredients:
+            if y < self.margin:
+                document.showPage()
+                document.setFont(self.font_name, self.font_size)
+                y = height - self.margin
+            document.drawString(
+                self.margin,
+                y,
+                f'• {ingredient["ingredient__name"]} '
+                f'({ingredient["ingredient__measurement_unit__name"]})'
+                f' - {ingredient["amount"]}',
+            )
+            y -= self.line_height
+        document.save()
+        yield buffer.getvalue()
+
+
+SHOPPING_LIST_RENDERERS = (
+    TxtShoppingListRenderer,
+    CsvShoppingListRenderer,
+    PdfShoppingListRenderer,
+)
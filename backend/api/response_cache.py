@@ -0,0 +1,115 @@
+"""Общий кэш ответов API для анонимных пользователей.
+
+Для анонимного пользователя признаки избранного, корзины и подписки
+всегда ложны, поэтому ответ зависит только от адреса запроса и данных.
+Ответы хранятся в общем кэше под ключом из версий данных
+(recipes.cache.get_recipes_versions): запись рецепта меняет версию,
+и старые ответы перестают находиться, а затем вытесняются по TIMEOUT.
+Ответ, который будет сохранён, собирается по основной БД: отстающая
+реплика записала бы под новую версию старые данные.
+"""
+import hashlib
+import threading
+from functools import partial
+
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+from foodgram.db_routers import primary_reads
+from recipes.cache import get_recipes_versions
+from recipes.constants import ResponseCache
+
+CACHE_HEADER = 'X-Cache'
+
+
+class CacheStats:
+    """Счётчики попаданий и промахов кэша в текущем процессе."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def as_dict(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate,
+        }
+
+
+stats = CacheStats()
+
+
+def _author_id(request):
+    author = request.query_params.get('author', '')
+    return int(author) if author.isdigit() else None
+
+
+def cache_key(request, action, pk=None):
+    """Ключ ответа: действие, хост, нормализованные параметры и версии.
+
+    Параметры сортируются вместе со значениями, поэтому ?tags=a&tags=b
+    и ?tags=b&tags=a попадают в одну запись. Хост входит в ключ, так как
+    ссылки пагинации в ответе абсолютные.
+    """
+    params = sorted(
+        (key, sorted(request.query_params.getlist(key)))
+        for key in request.query_params
+    )
+    digest = hashlib.md5(
+        repr((request.get_host(), pk, params)).encode('utf-8')
+    ).hexdigest()
+    author_id = _author_id(request) if pk is None else None
+    versions = ':'.join(get_recipes_versions(author_id))
+    return f'responses:recipes:{action}:{digest}:{versions}'
+
+
+class AnonymousResponseCacheMixin:
+    """Отдаёт list и retrieve анонимным пользователям из общего кэша.
+
+    Повторный запрос обслуживается без обращения к ORM и сериализаторам;
+    в заголовке X-Cache указывается HIT или MISS.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self._cached_response(
+            request, 'list', None,
+            partial(super().list, request, *args, **kwargs),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._cached_response(
+            request, 'retrieve', kwargs.get(self.lookup_field),
+            partial(super().retrieve, request, *args, **kwargs),
+        )
+
+    def _cached_response(self, request, action, pk, view):
+        if not request.user.is_anonymous:
+            return view()
+        key = cache_key(request, action, pk)
+        data = cache.get(key)
+        stats.record(hit=data is not None)
+        if data is not None:
+            response = Response(data)
+            response[CACHE_HEADER] = 'HIT'
+            return response
+        with primary_reads():
+            response = view()
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(key, response.data, ResponseCache.TIMEOUT.value)
+        response[CACHE_HEADER] = 'MISS'
+        return response
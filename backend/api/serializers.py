@@ -1,17 +1,53 @@
 import base64
+import binascii
+import re
+from tempfile import SpooledTemporaryFile
 
 from django.contrib.auth import get_user_model
-from django.core.files.base import ContentFile
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
 from djoser.serializers import UserSerializer
+from PIL import Image
 from rest_framework import serializers
-from recipes.constants import RecipesModels
 
-from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
-                            RecipeTag, ShoppingCart, Tag, Unit)
-from users.models import Subscription
+from recipes.cache import (favorites_cache, memberships_shared,
+                           shopping_cart_cache, subscriptions_cache,
+                           units_cache)
+from recipes.constants import Images, RecipesModels
+from recipes.models import (Ingredient, Recipe, RecipeIngredient, RecipeTag,
+                            Tag, Unit)
 
 User = get_user_model()
 
+NON_BASE64 = re.compile(r'[^A-Za-z0-9+/=]')
+
+
+def get_membership(serializer, membership):
+    """Возвращает множество id из membership для текущего пользователя.
+
+    Множество запоминается в контексте сериализатора, поэтому список
+    из многих объектов обращается к кэшу один раз за запрос.
+    """
+    request = serializer.context.get('request')
+    if request is None or request.user.is_anonymous:
+        return frozenset()
+    memberships = serializer.context.setdefault('memberships', {})
+    if membership.name not in memberships:
+        memberships[membership.name] = membership.get(request.user.id)
+    return memberships[membership.name]
+
+
+def flags_user(request):
+    """Пользователь для Recipe.objects.for_read().
+
+    Без общего кэша принадлежности флаги рецептов вычисляются в
+    запросе к БД, с общим кэшем - берутся из него (None).
+    """
+    if memberships_shared():
+        return None
+    return request.user
+
 
 class CustomUserSerializer(UserSerializer):
     """Сериализатор пользователя."""
@@ -30,10 +66,23 @@ class CustomUserSerializer(UserSerializer):
         read_only_fields = fields
 
     def get_is_subscribed(self, author):
-        user = self.context['request'].user
-        if user.is_anonymous:
-            return False
-        return user.subscriptions.filter(author=author).exists()
+        if hasattr(author, 'is_subscribed'):
+            return author.is_subscribed
+        return author.id in get_membership(self, subscriptions_cache)
+
+
+def get_recipes_limit(request):
+    """Значение ?recipes_limit= или None, если параметр не задан.
+
+    Некорректное значение приводит к ответу 400.
+    """
+    value = request.query_params.get('recipes_limit')
+    if not value:
+        return None
+    try:
+        return serializers.IntegerField(min_value=0).run_validation(value)
+    except serializers.ValidationError as error:
+        raise serializers.ValidationError({'recipes_limit': error.detail})
 
 
 class SubscriptionsSerializer(CustomUserSerializer):
@@ -49,41 +98,20 @@ class SubscriptionsSerializer(CustomUserSerializer):
         )
         read_only_fields = ('username', 'email', 'first_name', 'last_name')
 
-    def validate(self, data):
-        request = self.context['request']
-        user = request.user
-        if request.method == 'POST':
-            author = self.context['author']
-            if author == user:
-                raise serializers.ValidationError(
-                    detail='Нельзя подписаться на самого себя.'
-                )
-            if author.subscriptions.filter(user=user).exists():
-                raise serializers.ValidationError(
-                    detail='Вы уже подписаны на этого пользователя.'
-                )
-        if request.method == 'DELETE':
-            author = self.instance
-            if not author.subscriptions.filter(user=user).exists():
-                raise serializers.ValidationError(
-                    detail='Вы не подписаны на этого пользователя.'
-                )
-        return data
-
-    def create(self, validated_data):
-        return Subscription.objects.create(**validated_data).author
-
     def get_recipes(self, author):
-        request = self.context.get('request')
-        recipes_limit = request.GET.get('recipes_limit')
-        recipes = author.recipes.all()
-        if recipes_limit:
-            recipes = recipes[: int(recipes_limit)]
+        recipes_by_author = self.context.get('recipes_by_author')
+        if recipes_by_author is not None:
+            recipes = recipes_by_author.get(author.id, [])
+        else:
+            recipes_limit = get_recipes_limit(self.context.get('request'))
+            recipes = author.recipes.all()
+            if recipes_limit is not None:
+                recipes = recipes[:recipes_limit]
         serializer = RecipesShortSerializer(recipes, many=True)
         return serializer.data
 
     def get_recipes_count(self, author):
-        return author.recipes.count()
+        return author.recipes_count
 
 
 class TagsSerializer(serializers.ModelSerializer):
@@ -102,26 +130,100 @@ class UnitsSerializer(serializers.ModelSerializer):
 
 class IngredientsSerializer(serializers.ModelSerializer):
     """Сериализатор иингридиентов."""
-    measurement_unit = serializers.SlugRelatedField(
-        read_only=True, slug_field='name'
-    )
+    measurement_unit = serializers.SerializerMethodField()
 
     class Meta:
         model = Ingredient
         fields = ('id', 'name', 'measurement_unit')
 
+    def get_measurement_unit(self, ingredient):
+        return units_cache.get().get(ingredient.measurement_unit_id)
+
 
 class Base64ImageField(serializers.ImageField):
-    """Класс для преобразования картинки."""
+    """Класс для преобразования картинки.
+
+    Base64 декодируется по частям во временный файл с проверкой размера,
+    а у изображения проверяются только формат и размеры по заголовку:
+    полное декодирование выполняется при создании уменьшенных копий
+    вне запроса.
+    """
+    default_error_messages = {
+        'too_large': 'Размер изображения не должен превышать {max_size} байт.',
+        'too_big': (
+            'Ширина и высота изображения не должны превышать '
+            '{max_dimension} пикселей.'
+        ),
+    }
+    chunk_size = 64 * 1024
+
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
             format, imgstr = data.split(';base64,')
             ext = format.split('/')[-1]
-
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+            image_file = File(self._decode(imgstr), name='temp.' + ext)
+            self._validate_image(image_file)
+            # Полная проверка ImageField не нужна: заголовок уже проверен.
+            return serializers.FileField.to_internal_value(self, image_file)
 
         return super().to_internal_value(data)
 
+    def _decode(self, imgstr):
+        max_size = Images.MAX_UPLOAD_SIZE.value
+        if len(imgstr) * 3 // 4 > max_size:
+            self.fail('too_large', max_size=max_size)
+        decoded = SpooledTemporaryFile(max_size=1024 * 1024)
+        # Как и b64decode, символы вне алфавита (переводы строк в base64
+        # из MIME) пропускаются; хвост части, не кратный 4 символам,
+        # декодируется вместе со следующей частью.
+        leftover = ''
+        try:
+            for start in range(0, len(imgstr), self.chunk_size):
+                chunk = leftover + NON_BASE64.sub(
+                    '', imgstr[start:start + self.chunk_size]
+                )
+                whole = len(chunk) - len(chunk) % 4
+                decoded.write(base64.b64decode(chunk[:whole]))
+                leftover = chunk[whole:]
+                if decoded.tell() > max_size:
+                    self.fail('too_large', max_size=max_size)
+            if leftover:
+                decoded.write(base64.b64decode(leftover))
+        except binascii.Error:
+            self.fail('invalid_image')
+        decoded.seek(0)
+        return decoded
+
+    def _validate_image(self, image_file):
+        max_dimension = Images.MAX_DIMENSION.value
+        try:
+            with Image.open(image_file) as image:
+                image_format, size = image.format, image.size
+        except (OSError, Image.DecompressionBombError):
+            self.fail('invalid_image')
+        if image_format not in Images.FORMATS.value:
+            self.fail('invalid_image')
+        if max(size) > max_dimension:
+            self.fail('too_big', max_dimension=max_dimension)
+        image_file.seek(0)
+
+
+class ImageVariantsField(serializers.ReadOnlyField):
+    """Ссылки на уменьшенные копии изображения рецепта."""
+    def to_representation(self, variants):
+        request = self.context.get('request')
+        result = {}
+        for variant in Images.VARIANTS.value:
+            if variant not in variants:
+                continue
+            result[variant] = {}
+            for extension, name in variants[variant].items():
+                url = default_storage.url(name)
+                if request is not None:
+                    url = request.build_absolute_uri(url)
+                result[variant][extension] = url
+        return result
+
 
 class RecipesIngredientsReadSerializer(serializers.ModelSerializer):
     """Сериализатор иингридиентов рецепта."""
@@ -139,8 +241,12 @@ class RecipesIngredientsReadSerializer(serializers.ModelSerializer):
 
 
 class RecipesIngredientsWriteSerializer(serializers.ModelSerializer):
-    """Сериализатор записи иингридиентов."""
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    """Сериализатор записи иингридиентов.
+
+    Существование ингредиентов проверяется одним запросом сразу для всего
+    рецепта в RecipesWriteSerializer.validate_ingredients.
+    """
+    id = serializers.IntegerField()
 
     class Meta:
         model = RecipeIngredient
@@ -157,6 +263,7 @@ class RecipesReadSerializer(serializers.ModelSerializer):
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
     image = Base64ImageField()
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Recipe
@@ -169,21 +276,25 @@ class RecipesReadSerializer(serializers.ModelSerializer):
             'is_favorited',
             'is_in_shopping_cart',
             'image',
+            'image_variants',
             'text',
             'cooking_time',
         )
 
+    def to_representation(self, recipe):
+        if hasattr(recipe, 'is_author_subscribed'):
+            recipe.author.is_subscribed = recipe.is_author_subscribed
+        return super().to_representation(recipe)
+
     def get_is_favorited(self, recipe):
-        user = self.context['request'].user
-        if user.is_anonymous:
-            return False
-        return user.favorite.filter(recipe=recipe).exists()
+        if hasattr(recipe, 'is_favorited'):
+            return recipe.is_favorited
+        return recipe.id in get_membership(self, favorites_cache)
 
     def get_is_in_shopping_cart(self, recipe):
-        user = self.context['request'].user
-        if user.is_anonymous:
-            return False
-        return user.shoppingcart.filter(recipe=recipe).exists()
+        if hasattr(recipe, 'is_in_shopping_cart'):
+            return recipe.is_in_shopping_cart
+        return recipe.id in get_membership(self, shopping_cart_cache)
 
 
 class RecipesWriteSerializer(serializers.ModelSerializer):
@@ -192,9 +303,7 @@ class RecipesWriteSerializer(serializers.ModelSerializer):
         default=serializers.CurrentUserDefault(),
     )
     ingredients = RecipesIngredientsWriteSerializer(required=True, many=True)
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(), many=True
-    )
+    tags = serializers.ListField(child=serializers.IntegerField())
     image = Base64ImageField()
     cooking_time = serializers.IntegerField(
         min_value=RecipesModels.MIN_POS_INT.value,
@@ -223,19 +332,29 @@ class RecipesWriteSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError({'tags': 'Обязательное поле.'})
         return data
 
+    @staticmethod
+    def _check_exist(model, ids):
+        """Проверяет одним запросом, что все объекты с ids существуют."""
+        missing = set(ids) - set(
+            model.objects.filter(id__in=ids).values_list('id', flat=True)
+        )
+        if missing:
+            raise serializers.ValidationError(
+                'Недопустимые первичные ключи - объекты не существуют: '
+                f'{", ".join(map(str, sorted(missing)))}.'
+            )
+
     def validate_ingredients(self, value):
         if not value:
             raise serializers.ValidationError(
                 {'ingredients': 'Это поле не может быть пустым.'}
             )
-        ingredients_list = []
-        for item in value:
-            ingredient = item.get('id')
-            if ingredient in ingredients_list:
-                raise serializers.ValidationError(
-                    {'ingredients': 'Ингридиенты не должны повторяться.'}
-                )
-            ingredients_list.append(ingredient)
+        ingredient_ids = [item['id'] for item in value]
+        if len(ingredient_ids) != len(set(ingredient_ids)):
+            raise serializers.ValidationError(
+                {'ingredients': 'Ингридиенты не должны повторяться.'}
+            )
+        self._check_exist(Ingredient, ingredient_ids)
         return value
 
     def validate_tags(self, value):
@@ -248,15 +367,16 @@ class RecipesWriteSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 {'tags': 'Теги не должны повторяться.'}
             )
+        self._check_exist(Tag, value)
         return value
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
         instance = super().create(validated_data)
         self.create_recipe_ingredients(instance, ingredients)
         self.create_recipe_tags(instance, tags)
-        instance.save()
         return instance
 
     def create_recipe_ingredients(self, instance, ingredients):
@@ -264,8 +384,8 @@ class RecipesWriteSerializer(serializers.ModelSerializer):
             [
                 RecipeIngredient(
                     recipe=instance,
-                    ingredient=ingredient.get('id'),
-                    amount=ingredient.get('amount'),
+                    ingredient_id=ingredient['id'],
+                    amount=ingredient['amount'],
                 )
                 for ingredient in ingredients
             ]
@@ -273,26 +393,75 @@ class RecipesWriteSerializer(serializers.ModelSerializer):
 
     def create_recipe_tags(self, instance, tags):
         RecipeTag.objects.bulk_create(
+            [RecipeTag(recipe=instance, tag_id=tag_id) for tag_id in tags]
+        )
+
+    def update_recipe_ingredients(self, instance, ingredients):
+        """Удаляет, изменяет и добавляет только отличающиеся ингредиенты."""
+        amounts = {
+            ingredient['id']: ingredient['amount']
+            for ingredient in ingredients
+        }
+        current = {
+            recipe_ingredient.ingredient_id: recipe_ingredient
+            for recipe_ingredient in RecipeIngredient.objects.filter(
+                recipe=instance
+            ).order_by().only('id', 'ingredient_id', 'amount')
+        }
+        removed = current.keys() - amounts.keys()
+        if removed:
+            RecipeIngredient.objects.filter(
+                recipe=instance, ingredient_id__in=removed
+            ).delete()
+        changed = []
+        for ingredient_id in current.keys() & amounts.keys():
+            recipe_ingredient = current[ingredient_id]
+            if recipe_ingredient.amount != amounts[ingredient_id]:
+                recipe_ingredient.amount = amounts[ingredient_id]
+                changed.append(recipe_ingredient)
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ['amount'])
+        self.create_recipe_ingredients(
+            instance,
             [
-                RecipeTag(recipe=instance, tag=tag_instance)
-                for tag_instance in tags
-            ]
+                ingredient for ingredient in ingredients
+                if ingredient['id'] not in current
+            ],
         )
 
+    def update_recipe_tags(self, instance, tags):
+        """Удаляет и добавляет только изменившиеся теги."""
+        current = set(
+            RecipeTag.objects.filter(recipe=instance).values_list(
+                'tag_id', flat=True
+            )
+        )
+        removed = current - set(tags)
+        if removed:
+            RecipeTag.objects.filter(
+                recipe=instance, tag_id__in=removed
+            ).delete()
+        self.create_recipe_tags(
+            instance, [tag_id for tag_id in tags if tag_id not in current]
+        )
+
+    @transaction.atomic
     def update(self, instance, validated_data):
-        ingredients = validated_data.pop('ingredients')
-        tags = validated_data.pop('tags')
-        instance.ingredients.clear()
-        instance.tags.clear()
-        self._create_recipe_ingredients(instance, ingredients)
-        self._create_recipe_tags(instance, tags)
-        instance = super().update(instance, validated_data)
-        instance.save()
-        return instance
+        ingredients = validated_data.pop('ingredients', None)
+        tags = validated_data.pop('tags', None)
+        if ingredients is not None:
+            self.update_recipe_ingredients(instance, ingredients)
+        if tags is not None:
+            self.update_recipe_tags(instance, tags)
+        return super().update(instance, validated_data)
 
     def to_representation(self, instance):
+        request = self.context.get('request')
+        instance = Recipe.objects.for_read(flags_user(request)).get(
+            pk=instance.pk
+        )
         serializer = RecipesReadSerializer(
-            instance, context={'request': self.context.get('request')}
+            instance, context={'request': request}
         )
         return serializer.data
 
@@ -300,6 +469,7 @@ class RecipesWriteSerializer(serializers.ModelSerializer):
 class RecipesShortSerializer(serializers.ModelSerializer):
     """Сериализатор кратких рецептов."""
     image = Base64ImageField(read_only=True)
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Recipe
@@ -307,6 +477,7 @@ class RecipesShortSerializer(serializers.ModelSerializer):
             'id',
             'name',
             'image',
+            'image_variants',
             'cooking_time',
         )
         read_only_fields = (
@@ -314,55 +485,3 @@ class RecipesShortSerializer(serializers.ModelSerializer):
             'name',
             'cooking_time',
         )
-
-
-class FavoritesSerializer(RecipesShortSerializer):
-    """Сериализатор избранного."""
-    class Meta(RecipesShortSerializer.Meta):
-        fields = [*RecipesShortSerializer.Meta.fields]
-
-    def validate(self, data):
-        request = self.context['request']
-        user = request.user
-        if request.method == 'POST':
-            recipe = self.context['recipe']
-            if user.favorites.filter(recipe=recipe).exists():
-                raise serializers.ValidationError(
-                    detail='Рецепт уже в избранном.'
-                )
-        if request.method == 'DELETE':
-            recipe = self.instance
-            if not user.favorites.filter(recipe=recipe).exists():
-                raise serializers.ValidationError(
-                    detail='Рецепта нет в избранном.'
-                )
-        return data
-
-    def create(self, validated_data):
-        return Favorite.objects.create(**validated_data).recipe
-
-
-class ShoppingCartSerializer(RecipesShortSerializer):
-    """Сериализатор корзины покупок."""
-    class Meta(RecipesShortSerializer.Meta):
-        fields = [*RecipesShortSerializer.Meta.fields]
-
-    def validate(self, data):
-        request = self.context['request']
-        user = request.user
-        if request.method == 'POST':
-            recipe = self.context['recipe']
-            if user.favorites.filter(recipe=recipe).exists():
-                raise serializers.ValidationError(
-                    detail='Рецепт уже в списке покупок.'
-                )
-        if request.method == 'DELETE':
-            recipe = self.instance
-            if not user.favorites.filter(recipe=recipe).exists():
-                raise serializers.ValidationError(
-                    detail='Рецепта нет в списке покупок.'
-                )
-        return data
-
-    def create(self, validated_data):
-        return ShoppingCart.objects.create(**validated_data).recipe
@@ -0,0 +1,609 @@
+import base64
+import io
+import os
+import tempfile
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIClient, APIRequestFactory
+
+from api.authentication import CachedTokenAuthentication
+from api.filters import RecipesFilter
+from api.paginations import CustomCursorPagination
+from api.serializers import Base64ImageField
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            RecipeTag, ShoppingCart, Tag, Unit)
+from recipes.tests import create_recipe, create_user
+from users.models import Subscription
+
+
+def shared_cache(test_case, alias='default'):
+    """Общий для процессов кэш alias на время теста."""
+    directory = tempfile.TemporaryDirectory()
+    test_case.addCleanup(directory.cleanup)
+    return override_settings(CACHES={
+        **settings.CACHES,
+        alias: {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': directory.name,
+        },
+    })
+
+
+def clear_caches():
+    for cache in caches.all():
+        cache.clear()
+
+
+class RecipesFilterTests(TestCase):
+    """Фильтры рецептов по тегам и ингредиентам."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = create_user('author')
+        cls.breakfast = Tag.objects.create(
+            name='Завтрак', color='#E26C2D', slug='breakfast'
+        )
+        cls.dinner = Tag.objects.create(
+            name='Ужин', color='#49B64E', slug='dinner'
+        )
+        unit = Unit.objects.create(name='г')
+        cls.eggs, cls.milk, cls.rice = [
+            Ingredient.objects.create(name=name, measurement_unit=unit)
+            for name in ('яйца', 'молоко', 'рис')
+        ]
+        cls.omelette = cls._recipe(
+            author, 'Омлет', [cls.breakfast, cls.dinner],
+            [cls.eggs, cls.milk],
+        )
+        cls.boiled_eggs = cls._recipe(
+            author, 'Варёные яйца', [cls.breakfast], [cls.eggs]
+        )
+        cls.pilaf = cls._recipe(author, 'Плов', [cls.dinner], [cls.rice])
+
+    @staticmethod
+    def _recipe(author, name, tags, ingredients):
+        recipe = create_recipe(author, name=name)
+        RecipeTag.objects.bulk_create(
+            RecipeTag(recipe=recipe, tag=tag) for tag in tags
+        )
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=1)
+            for ingredient in ingredients
+        )
+        return recipe
+
+    def setUp(self):
+        clear_caches()
+
+    def _ids(self, query):
+        response = self.client.get(f'/api/recipes/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.json()['results']]
+
+    def _filtered(self, **params):
+        return RecipesFilter(params, queryset=Recipe.objects.all()).qs
+
+    def test_recipe_with_several_tags_is_returned_once(self):
+        self.assertEqual(
+            self._ids('tags=breakfast&tags=dinner'),
+            [self.pilaf.id, self.boiled_eggs.id, self.omelette.id],
+        )
+
+    def test_ingredients_requires_all(self):
+        self.assertEqual(
+            self._ids(f'ingredients={self.eggs.id},{self.milk.id}'),
+            [self.omelette.id],
+        )
+        self.assertEqual(
+            self._ids(f'ingredients={self.eggs.id}'),
+            [self.boiled_eggs.id, self.omelette.id],
+        )
+
+    def test_exclude_ingredients(self):
+        self.assertEqual(
+            self._ids(f'exclude_ingredients={self.milk.id},{self.rice.id}'),
+            [self.boiled_eggs.id],
+        )
+
+    @skipUnless(
+        connection.vendor == 'sqlite',
+        'На маленьких таблицах PostgreSQL выбирает полное сканирование.',
+    )
+    def test_filters_use_lookup_indexes(self):
+        plans = {
+            'recipes_recipetag_tag_idx': self._filtered(
+                tags=['breakfast', 'dinner']
+            ),
+            'recipes_recipeingr_ingr_idx': self._filtered(
+                ingredients=f'{self.eggs.id},{self.milk.id}'
+            ),
+        }
+        for index, queryset in plans.items():
+            with self.subTest(index=index):
+                plan = queryset.explain()
+                self.assertIn(f'COVERING INDEX {index}', plan)
+                self.assertNotIn('SCAN', plan)
+        plan = self._filtered(exclude_ingredients=str(self.milk.id)).explain()
+        self.assertIn('COVERING INDEX recipes_recipeingr_ingr_idx', plan)
+
+
+class RecipeUpdateTests(TestCase):
+    """PATCH рецепта изменяет только отличающиеся строки ингредиентов."""
+
+    def setUp(self):
+        clear_caches()
+        self.author = create_user('author')
+        self.tag = Tag.objects.create(
+            name='Завтрак', color='#E26C2D', slug='breakfast'
+        )
+        unit = Unit.objects.create(name='г')
+        self.eggs, self.milk, self.salt, self.rice = [
+            Ingredient.objects.create(name=name, measurement_unit=unit)
+            for name in ('яйца', 'молоко', 'соль', 'рис')
+        ]
+        self.recipe = create_recipe(self.author)
+        RecipeTag.objects.create(recipe=self.recipe, tag=self.tag)
+        self.rows = {
+            ingredient.id: RecipeIngredient.objects.create(
+                recipe=self.recipe, ingredient=ingredient, amount=2
+            )
+            for ingredient in (self.eggs, self.milk, self.salt)
+        }
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def test_unchanged_ingredients_are_kept(self):
+        response = self.client.patch(
+            f'/api/recipes/{self.recipe.pk}/',
+            {
+                'tags': [self.tag.id],
+                'ingredients': [
+                    {'id': self.eggs.id, 'amount': 2},
+                    {'id': self.milk.id, 'amount': 5},
+                    {'id': self.rice.id, 'amount': 1},
+                ],
+            },
+            format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+        rows = {
+            row.ingredient_id: row
+            for row in RecipeIngredient.objects.filter(recipe=self.recipe)
+        }
+        self.assertEqual(
+            set(rows), {self.eggs.id, self.milk.id, self.rice.id}
+        )
+        for ingredient, amount in ((self.eggs, 2), (self.milk, 5)):
+            with self.subTest(ingredient=ingredient.name):
+                row = rows[ingredient.id]
+                self.assertEqual(row.pk, self.rows[ingredient.id].pk)
+                self.assertEqual(row.amount, amount)
+        self.assertEqual(rows[self.rice.id].amount, 1)
+        self.assertEqual(
+            {
+                item['id']: item['amount']
+                for item in response.json()['ingredients']
+            },
+            {self.eggs.id: 2, self.milk.id: 5, self.rice.id: 1},
+        )
+
+    def test_same_ingredients_are_not_written(self):
+        ingredients = [
+            {'id': ingredient_id, 'amount': 2} for ingredient_id in self.rows
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(
+                f'/api/recipes/{self.recipe.pk}/',
+                {'tags': [self.tag.id], 'ingredients': ingredients},
+                format='json',
+            )
+        self.assertEqual(response.status_code, 200)
+        statements = [
+            query['sql'] for query in queries.captured_queries
+            if 'recipes_recipeingredient' in query['sql']
+            and not query['sql'].startswith('SELECT')
+        ]
+        self.assertEqual(statements, [])
+
+
+class Base64ImageFieldTests(TestCase):
+    """Декодирование изображений в base64 по частям."""
+
+    def test_mime_wrapped_payload_is_accepted(self):
+        # Шум плохо сжимается: base64 занимает несколько частей поля.
+        image = Image.frombytes('RGB', (300, 300), os.urandom(300 * 300 * 3))
+        buffer = io.BytesIO()
+        image.save(buffer, 'PNG')
+        content = buffer.getvalue()
+        payload = base64.encodebytes(content).decode()
+        self.assertGreater(len(payload), 2 * Base64ImageField.chunk_size)
+        image_file = Base64ImageField().to_internal_value(
+            f'data:image/png;base64,{payload}'
+        )
+        self.assertEqual(image_file.read(), content)
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    """Кэширование токенов только в общем для процессов кэше."""
+
+    def setUp(self):
+        clear_caches()
+        self.user = create_user('reader')
+        self.token = Token.objects.create(user=self.user)
+        self.request = APIRequestFactory().get(
+            '/api/users/me/', HTTP_AUTHORIZATION=f'Token {self.token.key}'
+        )
+
+    def _authenticate(self):
+        return CachedTokenAuthentication().authenticate(self.request)
+
+    def test_process_local_cache_is_not_used(self):
+        for _ in range(2):
+            with self.assertNumQueries(1):
+                self._authenticate()
+
+    def test_shared_cache_is_used_and_invalidated(self):
+        with shared_cache(self):
+            with self.assertNumQueries(1):
+                self._authenticate()
+            with self.assertNumQueries(0):
+                user, _ = self._authenticate()
+            self.assertEqual(user, self.user)
+            self.token.delete()
+            with self.assertRaises(AuthenticationFailed):
+                self._authenticate()
+
+    def test_deactivated_user_is_rejected(self):
+        with shared_cache(self):
+            self._authenticate()
+            with self.captureOnCommitCallbacks(execute=True):
+                self.user.is_active = False
+                self.user.save()
+            with self.assertRaises(AuthenticationFailed):
+                self._authenticate()
+
+
+class RecipesLimitTests(TestCase):
+    """Параметр recipes_limit в подписках."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        cls.author = create_user('author')
+        cls.other = create_user('other')
+        for name in ('Первый', 'Второй', 'Третий'):
+            create_recipe(cls.author, name=name)
+        Subscription.objects.add(user=cls.user, author=cls.author)
+
+    def setUp(self):
+        clear_caches()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_subscriptions_limits_recipes(self):
+        response = self.client.get(
+            '/api/users/subscriptions/', {'recipes_limit': 2}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results'][0]['recipes']), 2)
+
+    def test_invalid_limit_is_rejected(self):
+        for value in ('abc', '-1'):
+            with self.subTest(value=value):
+                response = self.client.get(
+                    '/api/users/subscriptions/', {'recipes_limit': value}
+                )
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('recipes_limit', response.data)
+
+    def test_subscribe_with_invalid_limit_does_not_subscribe(self):
+        response = self.client.post(
+            f'/api/users/{self.other.id}/subscribe/?recipes_limit=abc'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(
+            Subscription.objects.filter(
+                user=self.user, author=self.other
+            ).exists()
+        )
+
+    def test_subscribe_limits_recipes(self):
+        create_recipe(self.other, name='Четвёртый')
+        create_recipe(self.other, name='Пятый')
+        response = self.client.post(
+            f'/api/users/{self.other.id}/subscribe/?recipes_limit=1'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['recipes']), 1)
+
+
+class CursorPaginationTests(TestCase):
+    """Пагинация по курсору, в том числе при равных значениях сортировки."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = create_user('author')
+        image = 'recipes/images/test.png'
+        Recipe.objects.bulk_create(
+            Recipe(
+                author=author, name=f'Рецепт {number}', text='Описание',
+                image=image, image_variants={'source': image},
+                cooking_time=10, favorites_count=number % 7 // 5,
+            )
+            for number in range(40)
+        )
+        cls.expected = list(
+            Recipe.objects.order_by('-favorites_count', '-id')
+            .values_list('id', flat=True)
+        )
+
+    def setUp(self):
+        clear_caches()
+
+    def _walk(self, url, link):
+        ids = []
+        for _ in range(len(self.expected) + 1):
+            data = self.client.get(url).json()
+            page = [recipe['id'] for recipe in data['results']]
+            ids.extend(page if link == 'next' else reversed(page))
+            url = data[link]
+            if url is None:
+                return ids, data
+        self.fail('Обход страниц не завершился.')
+
+    @mock.patch.object(CustomCursorPagination, 'offset_cutoff', 3)
+    def test_popular_ordering_walks_every_recipe_once(self):
+        ids, last_page = self._walk(
+            '/api/recipes/?ordering=popular&cursor=&limit=4', 'next'
+        )
+        self.assertEqual(ids, self.expected)
+        self.assertIsNotNone(last_page['previous'])
+        ids, _ = self._walk(last_page['previous'], 'previous')
+        self.assertEqual(
+            ids, self.expected[-len(last_page['results']) - 1::-1]
+        )
+
+    def test_default_ordering(self):
+        ids, _ = self._walk('/api/recipes/?cursor=&limit=6', 'next')
+        self.assertEqual(ids, sorted(self.expected, reverse=True))
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/recipes/?cursor=cD1hYmM%3D')
+        self.assertEqual(response.status_code, 404)
+
+    def test_cursor_pages_skip_count_and_offset(self):
+        _, page = self._walk('/api/recipes/?cursor=&limit=6', 'next')
+        self.assertNotIn('count', page)
+        url = self.client.get('/api/recipes/?cursor=&limit=6').json()['next']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        for query in queries.captured_queries:
+            sql = query['sql'].upper()
+            self.assertNotIn('COUNT(', sql)
+            self.assertNotIn('OFFSET', sql)
+
+    def test_page_number_pagination_is_default(self):
+        data = self.client.get('/api/recipes/?limit=6&page=2').json()
+        self.assertEqual(data['count'], len(self.expected))
+        self.assertEqual(len(data['results']), 6)
+
+    def test_subscriptions_cursor(self):
+        user = create_user('reader')
+        authors = [create_user(f'author{number}') for number in range(5)]
+        for author in authors:
+            Subscription.objects.add(user=user, author=author)
+        client = APIClient()
+        client.force_authenticate(user)
+        ids = []
+        url = '/api/users/subscriptions/?cursor=&limit=2'
+        while url is not None:
+            data = client.get(url).json()
+            self.assertNotIn('count', data)
+            ids.extend(author['id'] for author in data['results'])
+            url = data['next']
+        self.assertEqual(
+            ids, sorted((author.id for author in authors), reverse=True)
+        )
+
+
+class AnonymousResponseCacheTests(TestCase):
+    """Кэш ответов о рецептах для анонимных пользователей."""
+
+    def setUp(self):
+        clear_caches()
+        self.author = create_user('author')
+        self.other = create_user('other')
+        self.tag = Tag.objects.create(
+            name='Завтрак', color='#E26C2D', slug='breakfast'
+        )
+        self.ingredient = Ingredient.objects.create(
+            name='соль', measurement_unit=Unit.objects.create(name='г')
+        )
+        self.recipe = create_recipe(self.author, name='Омлет')
+        self.other_recipe = create_recipe(self.other, name='Плов')
+        self.anonymous = APIClient()
+
+    def _get(self, url, client=None):
+        response = (client or self.anonymous).get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def _rename(self, recipe, name):
+        client = APIClient()
+        client.force_authenticate(recipe.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.patch(
+                f'/api/recipes/{recipe.pk}/',
+                {
+                    'name': name,
+                    'tags': [self.tag.id],
+                    'ingredients': [{'id': self.ingredient.id, 'amount': 1}],
+                },
+                format='json',
+            )
+        self.assertEqual(response.status_code, 200)
+
+    def test_repeated_request_is_served_from_cache(self):
+        for url in ('/api/recipes/', f'/api/recipes/{self.recipe.pk}/'):
+            with self.subTest(url=url):
+                first = self._get(url)
+                self.assertEqual(first['X-Cache'], 'MISS')
+                with self.assertNumQueries(0):
+                    second = self._get(url)
+                self.assertEqual(second['X-Cache'], 'HIT')
+                self.assertEqual(second.json(), first.json())
+
+    def test_recipe_edit_invalidates_cached_responses(self):
+        url = f'/api/recipes/{self.recipe.pk}/'
+        self._get('/api/recipes/')
+        self._get(url)
+        self._rename(self.recipe, 'Яичница')
+        response = self._get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['name'], 'Яичница')
+        response = self._get('/api/recipes/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertIn(
+            'Яичница',
+            [recipe['name'] for recipe in response.json()['results']],
+        )
+        self.assertEqual(self._get(url)['X-Cache'], 'HIT')
+
+    def test_author_list_is_kept_after_other_author_edit(self):
+        url = f'/api/recipes/?author={self.author.pk}'
+        self._get(url)
+        self._rename(self.other_recipe, 'Плов с курицей')
+        self.assertEqual(self._get(url)['X-Cache'], 'HIT')
+        self.assertEqual(self._get('/api/recipes/')['X-Cache'], 'MISS')
+
+    def test_authenticated_requests_bypass_cache(self):
+        Favorite.objects.create(user=self.other, recipe=self.recipe)
+        client = APIClient()
+        client.force_authenticate(self.other)
+        url = f'/api/recipes/{self.recipe.pk}/'
+        self._get(url)
+        for _ in range(2):
+            response = self._get(url, client)
+            self.assertNotIn('X-Cache', response)
+            self.assertTrue(response.json()['is_favorited'])
+        self.assertFalse(self._get(url).json()['is_favorited'])
+
+
+class ShoppingListDownloadTests(TestCase):
+    """Файл списка покупок кэшируется только в общем кэше."""
+
+    def setUp(self):
+        clear_caches()
+        self.user = create_user('reader')
+        recipe = create_recipe(self.user)
+        RecipeIngredient.objects.create(
+            recipe=recipe,
+            ingredient=Ingredient.objects.create(
+                name='соль', measurement_unit=Unit.objects.create(name='г')
+            ),
+            amount=5,
+        )
+        ShoppingCart.objects.create(user=self.user, recipe=recipe)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _download(self):
+        response = self.client.get('/api/recipes/download_shopping_cart/')
+        self.assertEqual(response.status_code, 200)
+        return response.getvalue().decode()
+
+    def _change_amount_elsewhere(self):
+        # Изменение без сигналов, как его увидел бы другой процесс.
+        RecipeIngredient.objects.update(amount=7)
+
+    def test_process_local_cache_is_not_used(self):
+        self.assertIn('5', self._download())
+        self._change_amount_elsewhere()
+        self.assertIn('7', self._download())
+
+    def test_shared_cache_is_used(self):
+        with shared_cache(self):
+            self.assertIn('5', self._download())
+            self._change_amount_elsewhere()
+            self.assertIn('5', self._download())
+
+
+class MembershipFlagsTests(TestCase):
+    """Флаги избранного, корзины и подписки в ответах о рецептах."""
+
+    def setUp(self):
+        clear_caches()
+        self.user = create_user('reader')
+        self.author = create_user('author')
+        self.recipe = create_recipe(self.author)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _flags(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        recipe = data['results'][0] if 'results' in data else data
+        return (
+            recipe['is_favorited'],
+            recipe['is_in_shopping_cart'],
+            recipe['author']['is_subscribed'],
+        )
+
+    def _change_elsewhere(self):
+        # bulk_create не отправляет сигналов, как запись другого процесса.
+        Favorite.objects.bulk_create(
+            [Favorite(user=self.user, recipe=self.recipe)]
+        )
+        ShoppingCart.objects.bulk_create(
+            [ShoppingCart(user=self.user, recipe=self.recipe)]
+        )
+        Subscription.objects.bulk_create(
+            [Subscription(user=self.user, author=self.author)]
+        )
+
+    def _favorited_ids(self):
+        response = self.client.get('/api/recipes/?is_favorited=1')
+        return [recipe['id'] for recipe in response.json()['results']]
+
+    def test_process_local_cache_is_not_used(self):
+        for url in ('/api/recipes/', f'/api/recipes/{self.recipe.pk}/'):
+            self.assertEqual(self._flags(url), (False, False, False))
+        self.assertEqual(self._favorited_ids(), [])
+        self._change_elsewhere()
+        for url in ('/api/recipes/', f'/api/recipes/{self.recipe.pk}/'):
+            self.assertEqual(self._flags(url), (True, True, True))
+        self.assertEqual(self._favorited_ids(), [self.recipe.pk])
+        response = self.client.get(f'/api/users/{self.author.pk}/')
+        self.assertTrue(response.json()['is_subscribed'])
+
+    def test_own_changes_are_seen_with_process_local_cache(self):
+        self.assertEqual(
+            self._flags('/api/recipes/'), (False, False, False)
+        )
+        response = self.client.post(
+            f'/api/recipes/{self.recipe.pk}/favorite/'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self._flags('/api/recipes/'), (True, False, False))
+
+    def test_shared_cache_is_used(self):
+        with shared_cache(self, settings.MEMBERSHIP_CACHE):
+            self.assertEqual(
+                self._flags('/api/recipes/'), (False, False, False)
+            )
+            self.assertEqual(self._favorited_ids(), [])
+            self._change_elsewhere()
+            self.assertEqual(
+                self._flags('/api/recipes/'), (False, False, False)
+            )
+            self.assertEqual(self._favorited_ids(), [])
@@ -1,8 +1,8 @@
-from django.urls import include, path
+from django.urls import include, path, re_path
 from rest_framework.routers import DefaultRouter
 
-from .views import (CustomUserViewSet, IngredientsViewSet, RecipesViewSet,
-                    TagsViewSet)
+from .views import (CustomUserViewSet, IngredientsViewSet, MetricsView,
+                    RecipesViewSet, TagsViewSet)
 
 app_name = "api"
 
@@ -16,4 +16,5 @@ v1_router.register('recipes', RecipesViewSet, basename='recipes')
 urlpatterns = [
     path("", include(v1_router.urls)),
     path('auth/', include('djoser.urls.authtoken')),
+    re_path(r'^metrics/?$', MetricsView.as_view(), name='metrics'),
 ]
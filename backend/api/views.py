@@ -1,30 +1,52 @@
 from django.contrib.auth import get_user_model
-from django.db.models import Sum
-from django.http import FileResponse
-from django.shortcuts import get_object_or_404
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import BooleanField, Sum, Value
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
 from rest_framework.permissions import (IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
 
+from foodgram import metrics
+from recipes.cache import (get_cart_version, get_shopping_list,
+                           set_shopping_list, shared_cache_configured,
+                           tags_cache)
+from recipes.constants import IngredientSearch
 from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
                             ShoppingCart, Tag)
+from recipes.search import ingredient_index, search_ingredients
 from users.models import Subscription
 
 from .filters import IngredientFilter, RecipesFilter
 from .paginations import CustomPageNumberPagination
-from .permissions import IsAuthenticatedAuthorOrReadOnly
-from .serializers import (CustomUserSerializer, FavoritesSerializer,
-                          IngredientsSerializer, RecipesReadSerializer,
-                          RecipesWriteSerializer, ShoppingCartSerializer,
-                          SubscriptionsSerializer, TagsSerializer)
+from .permissions import (IsAuthenticatedAuthorOrReadOnly,
+                          IsStaffOrMetricsToken)
+from .renderers import (SHOPPING_LIST_RENDERERS, ShoppingListRenderer,
+                        TxtShoppingListRenderer)
+from .response_cache import AnonymousResponseCacheMixin
+from .serializers import (CustomUserSerializer, IngredientsSerializer,
+                          RecipesReadSerializer, RecipesShortSerializer,
+                          RecipesWriteSerializer, SubscriptionsSerializer,
+                          TagsSerializer, flags_user, get_recipes_limit)
 
 User = get_user_model()
 
 
+def error_response(message):
+    return Response(
+        {api_settings.NON_FIELD_ERRORS_KEY: [message]},
+        status=status.HTTP_400_BAD_REQUEST,
+    )
+
+
 class CustomUserViewSet(UserViewSet):
     """ViewSet для работы с пользователями."""
     queryset = User.objects.all()
@@ -35,32 +57,48 @@ class CustomUserViewSet(UserViewSet):
     @action(['post'], detail=True, permission_classes=[IsAuthenticated])
     def subscribe(self, request, id=None):
         author = self.get_object()
+        if author == request.user:
+            return error_response('Нельзя подписаться на самого себя.')
+        recipes_limit = get_recipes_limit(request)
+        if not Subscription.objects.add(user=request.user, author=author):
+            return error_response('Вы уже подписаны на этого пользователя.')
         serializer = SubscriptionsSerializer(
-            data=request.data,
-            context={'request': request, 'author': author},
+            author,
+            context={
+                'request': request,
+                'recipes_by_author': Recipe.objects.latest_by_author(
+                    [author.id], recipes_limit
+                ),
+            },
         )
-        serializer.is_valid(raise_exception=True)
-        serializer.save(author=author, user=request.user)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     @subscribe.mapping.delete
     def delete_subscribe(self, request, id=None):
         author = self.get_object()
-        serializer = SubscriptionsSerializer(
-            author, data=request.data, context={'request': request}
-        )
-        serializer.is_valid(raise_exception=True)
-        get_object_or_404(
-            Subscription, author=author, user=request.user
-        ).delete()
+        if not Subscription.objects.remove(user=request.user, author=author):
+            return error_response('Вы не подписаны на этого пользователя.')
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(['get'], detail=False, permission_classes=[IsAuthenticated])
     def subscriptions(self, request):
-        queryset = User.objects.filter(subscribers__user=request.user)
+        queryset = (
+            User.objects.filter(subscribers__user=request.user)
+            .annotate(is_subscribed=Value(True, output_field=BooleanField()))
+            .order_by('-id')
+        )
+        recipes_limit = get_recipes_limit(request)
         pages = self.paginate_queryset(queryset)
+        recipes_by_author = Recipe.objects.latest_by_author(
+            [author.id for author in pages], recipes_limit
+        )
         serializer = SubscriptionsSerializer(
-            pages, many=True, context={'request': request}
+            pages,
+            many=True,
+            context={
+                'request': request,
+                'recipes_by_author': recipes_by_author,
+            },
         )
         return self.get_paginated_response(serializer.data)
 
@@ -71,6 +109,33 @@ class TagsViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = TagsSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
 
+    def list(self, request, *args, **kwargs):
+        tags = tags_cache.get()
+        return self._conditional_response(request, tags['tags'], tags['etag'])
+
+    def retrieve(self, request, *args, **kwargs):
+        tags = tags_cache.get()
+        tag = tags['by_id'].get(self._get_pk())
+        if tag is None:
+            raise NotFound
+        return self._conditional_response(request, tag, tags['etag'])
+
+    def _get_pk(self):
+        try:
+            return int(self.kwargs[self.lookup_field])
+        except ValueError:
+            raise NotFound
+
+    @staticmethod
+    def _conditional_response(request, data, etag):
+        """Отдаёт 304, если у клиента актуальная версия тегов."""
+        response = Response(data)
+        response['ETag'] = etag
+        patch_cache_control(response, no_cache=True)
+        return get_conditional_response(
+            request, etag=etag, response=response
+        )
+
 
 class IngredientsViewSet(viewsets.ReadOnlyModelViewSet):
     """ViewSet для ингредиентов."""
@@ -80,8 +145,21 @@ class IngredientsViewSet(viewsets.ReadOnlyModelViewSet):
     filter_backends = [DjangoFilterBackend]
     filterset_class = IngredientFilter
 
+    def list(self, request, *args, **kwargs):
+        query = request.query_params.get('search')
+        if query:
+            return Response(
+                search_ingredients(query, IngredientSearch.LIMIT.value)
+            )
+        name = request.query_params.get('name')
+        if name is not None:
+            return Response(
+                ingredient_index.search(name, IngredientSearch.LIMIT.value)
+            )
+        return super().list(request, *args, **kwargs)
 
-class RecipesViewSet(viewsets.ModelViewSet):
+
+class RecipesViewSet(AnonymousResponseCacheMixin, viewsets.ModelViewSet):
     """ViewSet для рецептов."""
     queryset = Recipe.objects.all()
     permission_classes = [IsAuthenticatedAuthorOrReadOnly]
@@ -89,6 +167,11 @@ class RecipesViewSet(viewsets.ModelViewSet):
     filter_backends = [DjangoFilterBackend]
     filterset_class = RecipesFilter
 
+    def get_queryset(self):
+        if self.action in ('list', 'retrieve'):
+            return Recipe.objects.for_read(flags_user(self.request))
+        return super().get_queryset()
+
     def get_serializer_class(self):
         if self.request.method == 'GET':
             return RecipesReadSerializer
@@ -99,73 +182,106 @@ class RecipesViewSet(viewsets.ModelViewSet):
 
     @action(["post"], detail=True, permission_classes=[IsAuthenticated])
     def favorite(self, request, pk=None):
-        recipe = self.get_object()
-        serializer = FavoritesSerializer(
-            data=request.data,
-            context={'request': request, 'recipe': recipe},
-        )
-        serializer.is_valid(raise_exception=True)
-        serializer.save(user=request.user, recipe=recipe)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return self._add_recipe(request, Favorite, 'Рецепт уже в избранном.')
 
     @favorite.mapping.delete
     def delete_favorite(self, request, pk=None):
-        recipe = self.get_object()
-        serializer = FavoritesSerializer(
-            recipe, data=request.data, context={'request': request}
+        return self._remove_recipe(
+            request, Favorite, 'Рецепта нет в избранном.'
         )
-        serializer.is_valid(raise_exception=True)
-        get_object_or_404(Favorite, user=request.user, recipe=recipe).delete()
-        return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(['post'], detail=True, permission_classes=[IsAuthenticated])
     def shopping_cart(self, request, pk=None):
-        recipe = self.get_object()
-        serializer = ShoppingCartSerializer(
-            data=request.data,
-            context={'request': request, 'recipe': recipe},
+        return self._add_recipe(
+            request, ShoppingCart, 'Рецепт уже в списке покупок.'
         )
-        serializer.is_valid(raise_exception=True)
-        serializer.save(user=request.user, recipe=recipe)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     @shopping_cart.mapping.delete
     def delete_shopping_cart(self, request, pk=None):
+        return self._remove_recipe(
+            request, ShoppingCart, 'Рецепта нет в списке покупок.'
+        )
+
+    def _add_recipe(self, request, model, error):
         recipe = self.get_object()
-        serializer = ShoppingCartSerializer(
-            recipe, data=request.data, context={'request': request}
+        if not model.objects.add(user=request.user, recipe=recipe):
+            return error_response(error)
+        serializer = RecipesShortSerializer(
+            recipe, context={'request': request}
         )
-        serializer.is_valid(raise_exception=True)
-        get_object_or_404(
-            ShoppingCart, user=request.user, recipe=recipe
-        ).delete()
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def _remove_recipe(self, request, model, error):
+        recipe = self.get_object()
+        if not model.objects.remove(user=request.user, recipe=recipe):
+            return error_response(error)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(methods=['get'], detail=False, url_path='download_shopping_cart',
-            permission_classes=[IsAuthenticated])
+            permission_classes=[IsAuthenticated],
+            renderer_classes=[JSONRenderer, *SHOPPING_LIST_RENDERERS])
     def download_shopping_cart(self, request):
         user = request.user
-        ingredients = (
-            RecipeIngredient.objects.filter(
-                recipe__shoppingcart__user=request.user
-            )
-            .order_by('ingredient__name')
-            .values('ingredient__name', 'ingredient__measurement_unit__name')
-            .annotate(amount=Sum('amount'))
+        renderer = request.accepted_renderer
+        if not isinstance(renderer, ShoppingListRenderer):
+            renderer = TxtShoppingListRenderer()
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type += f'; charset={renderer.charset}'
+        # Кэш в памяти процесса не узнает об изменении корзины,
+        # сделанном через другой процесс, поэтому файл кэшируется
+        # только в общем кэше.
+        version = (
+            get_cart_version(user.id) if shared_cache_configured() else None
         )
-        shopping_list = 'Список покупок\n\n'
-        shopping_list += '\n'.join(
-            [
-                (
-                    f'- {ingredient["ingredient__name"]} '
-                    f'({ingredient["ingredient__measurement_unit__name"]})'
-                    f' - {ingredient["amount"]}'
+        content = (
+            get_shopping_list(user.id, version, renderer.format)
+            if version is not None else None
+        )
+        if content is not None:
+            response = HttpResponse(content, content_type=content_type)
+        else:
+            # Файл кэшируется под текущей версией корзины, поэтому
+            # читается основная БД, а не отстающая реплика.
+            ingredients = (
+                RecipeIngredient.objects.using(DEFAULT_DB_ALIAS)
+                .filter(recipe__shoppingcart__user=user)
+                .order_by('ingredient__name')
+                .values(
+                    'ingredient__name', 'ingredient__measurement_unit__name'
+                )
+                .annotate(amount=Sum('amount'))
+                .iterator()
+            )
+            chunks = renderer.stream(ingredients)
+            if version is not None:
+                chunks = self._cache_shopping_list(
+                    chunks, user.id, version, renderer.format
                 )
-                for ingredient in ingredients
-            ]
+            response = StreamingHttpResponse(
+                chunks, content_type=content_type
+            )
+        response['Content-Disposition'] = (
+            f'attachment; '
+            f'filename={user.username}_shopping_list.{renderer.format}'
         )
-        response = FileResponse(shopping_list, content_type='txt')
-        response[
-            'Content-Disposition'
-        ] = f'attachment; filename={user.username}_shopping_list.txt'
         return response
+
+    @staticmethod
+    def _cache_shopping_list(chunks, user_id, version, file_format):
+        """Отдаёт файл по частям и кэширует его после полной отправки."""
+        content = []
+        for chunk in chunks:
+            content.append(chunk)
+            yield chunk
+        set_shopping_list(user_id, version, file_format, b''.join(content))
+
+
+class MetricsView(APIView):
+    """Метрики всех процессов в текстовом формате Prometheus."""
+    permission_classes = [IsStaffOrMetricsToken]
+
+    def get(self, request):
+        return HttpResponse(
+            metrics.registry.render(), content_type=metrics.CONTENT_TYPE
+        )
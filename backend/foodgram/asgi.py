@@ -14,3 +14,7 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
 
 application = get_asgi_application()
+
+from recipes.search import ingredient_index  # noqa: E402
+
+ingredient_index.warm_up()
@@ -0,0 +1,59 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+REPLICA = 'replica'
+# Таблицы, которые всегда читаются с основной БД: токен или сессия,
+# созданные только что, могут ещё не дойти до реплики.
+PRIMARY_ONLY_MODELS = frozenset({'authtoken.token', 'sessions.session'})
+
+# Устанавливается ReplicaRoutingMiddleware для безопасных запросов.
+# Вне HTTP-запросов (команды, фоновые потоки) все чтения идут на
+# основную БД.
+read_from_replica = ContextVar('read_from_replica', default=False)
+
+
+def replica_configured():
+    return REPLICA in settings.DATABASES
+
+
+@contextmanager
+def primary_reads():
+    """Направляет чтения внутри блока на основную БД.
+
+    Нужен, когда прочитанное сохраняется в кэш под текущей версией
+    данных: версию меняет запись в основную БД, а реплика может ещё
+    отдавать старые строки.
+    """
+    token = read_from_replica.set(False)
+    try:
+        yield
+    finally:
+        read_from_replica.reset(token)
+
+
+class ReplicaRouter:
+    """Направляет чтения безопасных запросов на реплику, запись - на default.
+
+    Реплика заполняется репликацией СУБД, поэтому миграции к ней
+    не применяются.
+    """
+
+    def db_for_read(self, model, **hints):
+        if (
+            read_from_replica.get()
+            and model._meta.label_lower not in PRIMARY_ONLY_MODELS
+            and replica_configured()
+        ):
+            return REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA
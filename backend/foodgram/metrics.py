@@ -0,0 +1,258 @@
+"""Реестр метрик процесса в формате Prometheus.
+
+Каждый процесс копит счётчики и гистограммы в памяти. Если задан
+METRICS_DIR, процесс не реже раза в METRICS_FLUSH_INTERVAL секунд
+сохраняет снимок своих значений в отдельный файл каталога, а при
+отдаче метрик снимки всех процессов (воркеров gunicorn) суммируются.
+Счётчики и гистограммы завершившихся процессов продолжают учитываться,
+чтобы суммы не уменьшались при перезапуске воркера, а их текущие
+значения (Gauge) отбрасываются. Каталог нужно очищать при перезапуске
+сервиса.
+"""
+import json
+import math
+import os
+import threading
+import time
+from pathlib import Path
+from uuid import uuid4
+
+from django.conf import settings
+
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+SIZE_BUCKETS = (
+    256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304,
+)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _label_key(labels):
+    return json.dumps(sorted(labels.items()), ensure_ascii=False)
+
+
+def _format_labels(items):
+    if not items:
+        return ''
+    labels = ','.join(
+        f'{name}="{_escape(value)}"' for name, value in items
+    )
+    return f'{{{labels}}}'
+
+
+def _escape(value):
+    return (
+        str(value).replace('\\', '\\\\').replace('\n', '\\n')
+        .replace('"', '\\"')
+    )
+
+
+def _process_alive(path):
+    """Жив ли процесс, записавший снимок: имя файла - <pid>-<uuid>.json."""
+    try:
+        pid = int(path.name.split('-', 1)[0])
+    except ValueError:
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+
+    def initial(self):
+        return [0.0]
+
+    def update(self, values, amount):
+        values[0] += amount
+
+    def render(self, items, values):
+        yield (
+            f'{self.name}{_format_labels(items)} {_format_value(values[0])}'
+        )
+
+
+class Gauge(Counter):
+    """Текущее значение; при сборе по процессам значения складываются."""
+    type = 'gauge'
+
+    def update(self, values, amount):
+        values[0] = amount
+
+
+class Histogram:
+    """Гистограмма: значения по корзинам, число наблюдений и их сумма."""
+    type = 'histogram'
+
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = (*buckets, math.inf)
+
+    def initial(self):
+        return [0.0] * (len(self.buckets) + 1)
+
+    def update(self, values, amount):
+        for index, bound in enumerate(self.buckets):
+            if amount <= bound:
+                values[index] += 1
+                break
+        values[-1] += amount
+
+    def render(self, items, values):
+        cumulative = 0
+        for bound, count in zip(self.buckets, values):
+            cumulative += count
+            labels = _format_labels([*items, ('le', _format_value(bound))])
+            yield f'{self.name}_bucket{labels} {_format_value(cumulative)}'
+        yield (
+            f'{self.name}_count{_format_labels(items)} '
+            f'{_format_value(cumulative)}'
+        )
+        yield (
+            f'{self.name}_sum{_format_labels(items)} '
+            f'{_format_value(values[-1])}'
+        )
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._file_name = f'{self._pid}-{uuid4().hex}.json'
+        self._samples = {}
+        self._flushed_at = time.monotonic()
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def record(self, metric, amount=1, **labels):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Процесс-потомок не должен отдавать значения родителя.
+                self._reset()
+            samples = self._samples.setdefault(metric.name, {})
+            key = _label_key(labels)
+            if key not in samples:
+                samples[key] = metric.initial()
+            metric.update(samples[key], amount)
+        self.flush()
+
+    def _snapshot(self):
+        with self._lock:
+            return {
+                name: {key: list(values) for key, values in samples.items()}
+                for name, samples in self._samples.items()
+            }
+
+    def flush(self, force=False):
+        directory = settings.METRICS_DIR
+        if not directory:
+            return
+        now = time.monotonic()
+        if not force and now - self._flushed_at < (
+            settings.METRICS_FLUSH_INTERVAL
+        ):
+            return
+        with self._flush_lock:
+            self._flushed_at = now
+            path = Path(directory) / self._file_name
+            temporary = path.with_suffix('.tmp')
+            temporary.write_text(json.dumps(self._snapshot()))
+            os.replace(temporary, path)
+
+    def collect(self):
+        """Значения всех процессов, если задан METRICS_DIR, иначе свои."""
+        if not settings.METRICS_DIR:
+            return self._snapshot()
+        self.flush(force=True)
+        merged = {}
+        for path in Path(settings.METRICS_DIR).glob('*.json'):
+            try:
+                snapshot = json.loads(path.read_text())
+            except (OSError, ValueError):
+                continue
+            alive = _process_alive(path)
+            for name, samples in snapshot.items():
+                metric = self.metrics.get(name)
+                if not alive and isinstance(metric, Gauge):
+                    continue
+                target = merged.setdefault(name, {})
+                for key, values in samples.items():
+                    if key in target:
+                        target[key] = [
+                            a + b for a, b in zip(target[key], values)
+                        ]
+                    else:
+                        target[key] = values
+        return merged
+
+    def render(self):
+        """Текстовый формат экспозиции Prometheus."""
+        samples = self.collect()
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.type}')
+            for key, values in sorted(samples.get(name, {}).items()):
+                lines.extend(
+                    metric.render([tuple(item) for item in json.loads(key)],
+                                  values)
+                )
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+request_latency = registry.register(Histogram(
+    'http_request_duration_seconds', 'Время обработки запроса.',
+    LATENCY_BUCKETS,
+))
+request_db_time = registry.register(Histogram(
+    'http_request_db_duration_seconds',
+    'Время SQL-запросов (по профилируемым запросам).',
+    LATENCY_BUCKETS,
+))
+response_size = registry.register(Histogram(
+    'http_response_size_bytes', 'Размер тела ответа.', SIZE_BUCKETS,
+))
+responses = registry.register(Counter(
+    'http_responses_total', 'Ответы по коду состояния.',
+))
+response_cache = registry.register(Counter(
+    'http_response_cache_total', 'Обращения к кэшу ответов.',
+))
+db_pool_connections = registry.register(Gauge(
+    'db_pool_connections',
+    'Соединения пула БД: занятые, свободные и предел пула.',
+))
+db_pool_wait = registry.register(Histogram(
+    'db_pool_wait_seconds', 'Ожидание соединения из пула БД.',
+    LATENCY_BUCKETS,
+))
+db_pool_timeouts = registry.register(Counter(
+    'db_pool_timeouts_total',
+    'Запросы, не дождавшиеся свободного соединения из пула БД.',
+))
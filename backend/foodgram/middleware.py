@@ -0,0 +1,306 @@
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from foodgram import metrics
+from foodgram.db_routers import read_from_replica, replica_configured
+
+IN_LIST = re.compile(r'\bIN\s*\(\s*%s(?:\s*,\s*%s)*\s*\)', re.IGNORECASE)
+MAX_SQL_LENGTH = 300
+
+logger = logging.getLogger(__name__)
+
+# Профиль текущего запроса. Контекст переносится sync_to_async в потоки,
+# где выполняются представления, поэтому запросы к БД учитываются и при
+# работе через ASGI.
+current_profile = ContextVar('sql_profile', default=None)
+
+
+def fingerprint(sql):
+    """Шаблон запроса: списки IN любой длины сводятся к одному виду."""
+    return IN_LIST.sub('IN (%s, ...)', sql)
+
+
+def view_name(request):
+    """Имя представления вида RecipesViewSet.list для журнала."""
+    match = request.resolver_match
+    if match is None:
+        return None
+    view = match.func
+    view_class = getattr(view, 'cls', None) or getattr(
+        view, 'view_class', None
+    )
+    if view_class is None:
+        return match.view_name or view.__qualname__
+    method = request.method.lower()
+    actions = getattr(view, 'actions', None)
+    return f'{view_class.__name__}.{(actions or {}).get(method, method)}'
+
+
+def metrics_view_label(request):
+    """Метка представления для метрик: имя маршрута, например recipes-list.
+
+    Пространство имён api опускается, у остальных сохраняется
+    (admin:login); запросы без маршрута объединяются в unmatched.
+    """
+    match = request.resolver_match
+    if match is None:
+        return 'unmatched'
+    if match.namespace == 'api':
+        return match.url_name
+    return match.view_name
+
+
+class SQLProfile:
+    """Счётчики SQL-запросов одного HTTP-запроса.
+
+    Работает без DEBUG и не сохраняет текст каждого запроса: хранятся
+    только число выполнений каждого шаблона.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def repeated(self, threshold):
+        """Шаблоны, выполненные не менее threshold раз (признак N+1)."""
+        return [
+            {'sql': sql[:MAX_SQL_LENGTH], 'count': count}
+            for sql, count in self.fingerprints.most_common()
+            if count >= threshold
+        ]
+
+
+def record_query(execute, sql, params, many, context):
+    profile = current_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    return profile(execute, sql, params, many, context)
+
+
+def install_query_recorder(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class HybridMiddleware:
+    """Основа middleware, работающего и в WSGI, и в ASGI без переходов.
+
+    Синхронный middleware в цепочке заставил бы Django выполнять
+    асинхронные представления через async_to_sync в общем потоке.
+    Наследники реализуют before() и after().
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        state = self.before(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            self.cleanup(state)
+        return self.after(request, response, state)
+
+    async def __acall__(self, request):
+        state = self.before(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            self.cleanup(state)
+        return self.after(request, response, state)
+
+    def before(self, request):
+        return None
+
+    def cleanup(self, state):
+        pass
+
+    def after(self, request, response, state):
+        return response
+
+
+class SQLProfilingMiddleware(HybridMiddleware):
+    """Профилирование SQL-запросов на уровне HTTP-запроса.
+
+    Для доли запросов SQL_PROFILING_SAMPLE_RATE считает число запросов
+    к БД, время в БД и повторяющиеся шаблоны, добавляет заголовок
+    Server-Timing и пишет в журнал запросы дольше
+    SQL_PROFILING_SLOW_REQUEST_MS. Профиль доступен представлениям
+    как request.sql_profile. Запросы, выполненные при отдаче потокового
+    ответа, не учитываются.
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        connection_created.connect(
+            install_query_recorder, dispatch_uid='sql_profiling'
+        )
+        for connection in connections.all():
+            install_query_recorder(connection)
+
+    def before(self, request):
+        if random.random() >= settings.SQL_PROFILING_SAMPLE_RATE:
+            return None
+        profile = request.sql_profile = SQLProfile()
+        return profile, current_profile.set(profile), time.perf_counter()
+
+    def cleanup(self, state):
+        if state is not None:
+            current_profile.reset(state[1])
+
+    def after(self, request, response, state):
+        if state is None:
+            return response
+        profile, _, started = state
+        duration = time.perf_counter() - started
+        response['Server-Timing'] = (
+            f'db;dur={profile.db_time * 1000:.2f};'
+            f'desc="{profile.queries} queries", '
+            f'total;dur={duration * 1000:.2f}'
+        )
+        if duration * 1000 >= settings.SQL_PROFILING_SLOW_REQUEST_MS:
+            self.log_slow_request(request, response, profile, duration)
+        return response
+
+    def log_slow_request(self, request, response, profile, duration):
+        logger.warning(
+            'Медленный запрос: %s',
+            json.dumps(
+                {
+                    'view': view_name(request),
+                    'method': request.method,
+                    'path': request.path,
+                    'status': response.status_code,
+                    'duration_ms': round(duration * 1000, 2),
+                    'db_time_ms': round(profile.db_time * 1000, 2),
+                    'queries': profile.queries,
+                    'repeated_queries': profile.repeated(
+                        settings.SQL_PROFILING_REPEATED_THRESHOLD
+                    ),
+                },
+                ensure_ascii=False,
+            ),
+        )
+
+
+class MetricsMiddleware(HybridMiddleware):
+    """Собирает метрики запросов в foodgram.metrics.registry.
+
+    Время обработки и размер ответа пишутся в гистограммы по меткам
+    представления, коды ответов и результаты кэша ответов (заголовок
+    X-Cache) - в счётчики. Время в БД известно только для запросов,
+    отобранных SQLProfilingMiddleware, поэтому она подключается после.
+    """
+
+    def before(self, request):
+        return time.perf_counter()
+
+    def after(self, request, response, started):
+        duration = time.perf_counter() - started
+        view = metrics_view_label(request)
+        metrics.registry.record(metrics.request_latency, duration, view=view)
+        metrics.registry.record(
+            metrics.responses, view=view, status=response.status_code
+        )
+        profile = getattr(request, 'sql_profile', None)
+        if profile is not None:
+            metrics.registry.record(
+                metrics.request_db_time, profile.db_time, view=view
+            )
+        size = self.response_size(response)
+        if size is not None:
+            metrics.registry.record(metrics.response_size, size, view=view)
+        cache_result = response.get('X-Cache')
+        if cache_result:
+            metrics.registry.record(
+                metrics.response_cache, view=view,
+                result=cache_result.lower(),
+            )
+        return response
+
+    @staticmethod
+    def response_size(response):
+        if not response.streaming:
+            return len(response.content)
+        length = response.get('Content-Length')
+        return int(length) if length else None
+
+
+def _client_key(request, response=None):
+    """Ключ клиента для привязки к основной БД: токен или сессия."""
+    credentials = request.headers.get('Authorization') or (
+        request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    )
+    if not credentials and response is not None:
+        cookie = response.cookies.get(settings.SESSION_COOKIE_NAME)
+        credentials = cookie.value if cookie else None
+    if not credentials:
+        return None
+    digest = hashlib.sha256(credentials.encode('utf-8')).hexdigest()
+    return f'replica:primary:{digest}'
+
+
+class ReplicaRoutingMiddleware(HybridMiddleware):
+    """Разрешает чтение с реплики для безопасных HTTP-методов.
+
+    После успешного изменяющего запроса клиент на
+    REPLICA_STICKY_SECONDS секунд читает только с основной БД, чтобы
+    видеть свои изменения, пока они доходят до реплики. Для нескольких
+    процессов отметка хранится в общем кэше.
+    """
+    SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+    def before(self, request):
+        if not replica_configured():
+            return None
+        if request.method not in self.SAFE_METHODS:
+            return None
+        key = _client_key(request)
+        if key and cache.get(key):
+            return None
+        return read_from_replica.set(True)
+
+    def cleanup(self, token):
+        if token is not None:
+            read_from_replica.reset(token)
+
+    def after(self, request, response, token):
+        if (
+            replica_configured()
+            and request.method not in self.SAFE_METHODS
+            and response.status_code < 400
+        ):
+            key = _client_key(request, response)
+            if key:
+                cache.set(key, True, settings.REPLICA_STICKY_SECONDS)
+        return response
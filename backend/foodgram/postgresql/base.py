@@ -0,0 +1,77 @@
+"""Бэкенд PostgreSQL с проверкой соединений и пулом.
+
+В Django 3.2 нет настроек CONN_HEALTH_CHECKS и пула соединений,
+поэтому бэкенд добавляет их поверх стандартного:
+
+- CONN_HEALTH_CHECKS: постоянное соединение (CONN_MAX_AGE) перед
+  первым использованием в новом запросе, а соединение из пула при
+  выдаче проверяются запросом SELECT 1 и при ошибке заменяются;
+- POOL: словарь min_size, max_size, timeout включает пул соединений
+  процесса; закрытие соединения возвращает его в пул.
+"""
+from functools import partial
+
+from django.db.backends.postgresql import base
+
+from .pool import get_pool
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    health_check_pending = False
+    pool = None
+
+    def get_new_connection(self, conn_params):
+        options = self.settings_dict.get('POOL')
+        if not options:
+            return super().get_new_connection(conn_params)
+        # Соединение создаёт обёртка текущего потока: стандартный
+        # get_new_connection запоминает в ней уровень изоляции.
+        connect = partial(super().get_new_connection, conn_params)
+        self.pool = get_pool(self.alias, connect, **options)
+        while True:
+            connection, reused = self.pool.acquire(connect)
+            if not reused:
+                return connection
+            if (
+                not self.settings_dict.get('CONN_HEALTH_CHECKS')
+                or self._is_alive(connection)
+            ):
+                self.isolation_level = self.settings_dict['OPTIONS'].get(
+                    'isolation_level', connection.isolation_level
+                )
+                return connection
+            # Закрытое соединение пул выбросит при возврате.
+            connection.close()
+            self.pool.release(connection)
+
+    @staticmethod
+    def _is_alive(connection):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            if not connection.autocommit:
+                connection.rollback()
+        except base.Database.Error:
+            return False
+        return True
+
+    def _close(self):
+        if self.pool is None or self.connection is None:
+            return super()._close()
+        self.pool.release(self.connection)
+
+    def close_if_unusable_or_obsolete(self):
+        super().close_if_unusable_or_obsolete()
+        self.health_check_pending = bool(
+            self.connection is not None
+            and self.settings_dict.get('CONN_HEALTH_CHECKS')
+        )
+
+    def _cursor(self, name=None):
+        # Постоянное соединение проверяется один раз за запрос,
+        # перед первым SQL-запросом.
+        if self.health_check_pending:
+            self.health_check_pending = False
+            if self.connection is not None and not self.is_usable():
+                self.close()
+        return super()._cursor(name)
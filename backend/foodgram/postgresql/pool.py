@@ -0,0 +1,134 @@
+import os
+import threading
+import time
+from collections import deque
+
+from django.db import OperationalError
+from psycopg2.extensions import (TRANSACTION_STATUS_IDLE,
+                                 TRANSACTION_STATUS_UNKNOWN)
+
+from foodgram import metrics
+
+
+class PoolTimeout(OperationalError):
+    """Свободное соединение не появилось за отведённое время."""
+
+
+class ConnectionPool:
+    """Пул соединений psycopg2 одного процесса.
+
+    Соединения создаются по мере надобности функцией connect того
+    потока, которому они нужны, но не более max_size; при исчерпании
+    пула поток ждёт освобождения соединения до timeout секунд.
+    Заполненность пула и время ожидания пишутся в метрики.
+    """
+
+    def __init__(self, alias, connect, min_size, max_size, timeout):
+        self.alias = alias
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = deque()
+        self._size = 0
+        self._in_use = 0
+        self._condition = threading.Condition()
+        for _ in range(min_size):
+            self._idle.append(connect())
+            self._size += 1
+        self._record_usage()
+
+    def acquire(self, connect):
+        """Возвращает пару (соединение, взято ли оно из пула).
+
+        Новое соединение создаётся вызовом connect().
+        """
+        started = time.monotonic()
+        with self._condition:
+            while not self._idle and self._size >= self.max_size:
+                remaining = self.timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    metrics.registry.record(
+                        metrics.db_pool_timeouts, alias=self.alias
+                    )
+                    raise PoolTimeout(
+                        f'Нет свободных соединений с БД {self.alias} '
+                        f'за {self.timeout} с.'
+                    )
+                self._condition.wait(remaining)
+            connection = self._idle.pop() if self._idle else None
+            if connection is None:
+                self._size += 1
+            self._in_use += 1
+        metrics.registry.record(
+            metrics.db_pool_wait, time.monotonic() - started,
+            alias=self.alias,
+        )
+        reused = connection is not None
+        if not reused:
+            try:
+                connection = connect()
+            except Exception:
+                with self._condition:
+                    self._size -= 1
+                    self._in_use -= 1
+                    self._condition.notify()
+                raise
+        self._record_usage()
+        return connection, reused
+
+    def release(self, connection):
+        """Возвращает соединение в пул, откатив незавершённую транзакцию.
+
+        Закрытые и сломанные соединения выбрасываются из пула.
+        """
+        usable = not connection.closed
+        if usable:
+            status = connection.info.transaction_status
+            if status == TRANSACTION_STATUS_UNKNOWN:
+                usable = False
+            elif status != TRANSACTION_STATUS_IDLE:
+                try:
+                    connection.rollback()
+                except Exception:
+                    usable = False
+        if not usable:
+            try:
+                connection.close()
+            except Exception:
+                pass
+        with self._condition:
+            self._in_use -= 1
+            if usable:
+                self._idle.append(connection)
+            else:
+                self._size -= 1
+            self._condition.notify()
+        self._record_usage()
+
+    def _record_usage(self):
+        for state, value in (
+            ('in_use', self._in_use),
+            ('idle', len(self._idle)),
+            ('max', self.max_size),
+        ):
+            metrics.registry.record(
+                metrics.db_pool_connections, value,
+                alias=self.alias, state=state,
+            )
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, connect, min_size, max_size, timeout):
+    """Пул соединений процесса для алиаса БД.
+
+    Пул, унаследованный после fork от родительского процесса, не
+    используется: его сокеты принадлежат родителю.
+    """
+    with _pools_lock:
+        pid, pool = _pools.get(alias, (None, None))
+        if pid != os.getpid():
+            pool = ConnectionPool(alias, connect, min_size, max_size, timeout)
+            _pools[alias] = (os.getpid(), pool)
+        return pool
@@ -24,6 +24,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'django_filters',
@@ -37,6 +38,9 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'foodgram.middleware.MetricsMiddleware',
+    'foodgram.middleware.SQLProfilingMiddleware',
+    'foodgram.middleware.ReplicaRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -74,6 +78,11 @@ if os.getenv('USE_SQLITE', '').lower() == 'true':
             'NAME': BASE_DIR / 'db.sqlite3',
         }
     }
+    if os.getenv('SQLITE_REPLICA_NAME'):
+        DATABASES['replica'] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('SQLITE_REPLICA_NAME'),
+        }
 else:
     DATABASES = {
         'default': {
@@ -85,6 +94,78 @@ else:
             'PORT': os.getenv('DB_PORT', '5432')
         }
     }
+    # Режим соединений: пустой - новое соединение на каждый запрос,
+    # persistent - постоянные соединения с проверкой перед
+    # использованием, pool - пул соединений каждого процесса.
+    DB_CONNECTION_MODE = os.getenv('DB_CONNECTION_MODE', '')
+    if DB_CONNECTION_MODE:
+        DATABASES['default']['ENGINE'] = 'foodgram.postgresql'
+        DATABASES['default']['CONN_HEALTH_CHECKS'] = (
+            os.getenv('DB_HEALTH_CHECKS', 'true').lower() == 'true'
+        )
+    if DB_CONNECTION_MODE == 'persistent':
+        DATABASES['default']['CONN_MAX_AGE'] = int(
+            os.getenv('DB_CONN_MAX_AGE', 60)
+        )
+    elif DB_CONNECTION_MODE == 'pool':
+        DATABASES['default']['POOL'] = {
+            'min_size': int(os.getenv('DB_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+            'timeout': float(os.getenv('DB_POOL_TIMEOUT', 5)),
+        }
+    # Необязательная реплика для чтения с теми же учётными данными.
+    if os.getenv('DB_REPLICA_HOST'):
+        DATABASES['replica'] = {
+            **DATABASES['default'],
+            'HOST': os.getenv('DB_REPLICA_HOST'),
+            'PORT': os.getenv('DB_REPLICA_PORT', DATABASES['default']['PORT']),
+        }
+
+for alias in DATABASES.keys() - {'default'}:
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+
+DATABASE_ROUTERS = ['foodgram.db_routers.ReplicaRouter']
+# Сколько секунд после изменения данных клиент читает с основной БД.
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', 5))
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'foodgram'),
+    },
+    'memberships': {
+        'BACKEND': os.getenv(
+            'MEMBERSHIP_CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache',
+        ),
+        'LOCATION': os.getenv('MEMBERSHIP_CACHE_LOCATION', 'memberships'),
+        'TIMEOUT': int(os.getenv('MEMBERSHIP_CACHE_TIMEOUT', 300)),
+    },
+}
+
+MEMBERSHIP_CACHE = 'memberships'
+
+AUTH_TOKEN_CACHE_TIMEOUT = int(os.getenv('AUTH_TOKEN_CACHE_TIMEOUT', 300))
+
+# Доля профилируемых запросов, порог медленного запроса и число
+# повторов одного SQL-шаблона, после которого он попадает в журнал.
+SQL_PROFILING_SAMPLE_RATE = float(
+    os.getenv('SQL_PROFILING_SAMPLE_RATE', 1.0 if DEBUG else 0.1)
+)
+SQL_PROFILING_SLOW_REQUEST_MS = int(
+    os.getenv('SQL_PROFILING_SLOW_REQUEST_MS', 500)
+)
+SQL_PROFILING_REPEATED_THRESHOLD = int(
+    os.getenv('SQL_PROFILING_REPEATED_THRESHOLD', 3)
+)
+
+# Каталог снимков метрик воркеров (пустой - метрики только процесса),
+# период записи снимка в секундах и токен доступа к /api/metrics.
+METRICS_DIR = os.getenv('METRICS_DIR', '')
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
 
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -130,7 +211,7 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
 }
 
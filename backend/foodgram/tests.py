@@ -0,0 +1,460 @@
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from unittest import skipUnless
+
+from django.core.cache import caches
+from django.db import connection, connections
+from django.test import (SimpleTestCase, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+
+from foodgram.db_routers import REPLICA, read_from_replica
+from foodgram import metrics
+from foodgram.metrics import Counter, Gauge, Histogram, Registry
+from foodgram.middleware import SQLProfile, fingerprint
+from foodgram.postgresql import pool
+from foodgram.postgresql.base import DatabaseWrapper
+from recipes.cache import tags_cache
+from recipes.models import Favorite, Recipe, Tag
+from recipes.tests import create_recipe, create_user
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Реплика - второй файл SQLite.')
+@override_settings(REPLICA_STICKY_SECONDS=1)
+class ReplicaRoutingTests(TransactionTestCase):
+    """Маршрутизация на реплику: две базы SQLite вместо двух серверов.
+
+    Реплика - копия основной базы на момент начала теста; после
+    копирования название рецепта меняется только в основной базе,
+    поэтому по ответу видно, из какой базы он прочитан.
+    """
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        self.user = create_user('reader')
+        self.token = Token.objects.create(user=self.user)
+        self.recipe = create_recipe(self.user, name='С реплики')
+        self.directory = Path(tempfile.mkdtemp())
+        path = self.directory / 'replica.sqlite3'
+        connections['default'].ensure_connection()
+        replica = sqlite3.connect(path)
+        connections['default'].connection.backup(replica)
+        replica.close()
+        Recipe.objects.filter(pk=self.recipe.pk).update(name='С основной')
+        connections.settings[REPLICA] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': str(path),
+        }
+        connections.ensure_defaults(REPLICA)
+        connections.prepare_test_settings(REPLICA)
+
+    def tearDown(self):
+        connections[REPLICA].close()
+        del connections[REPLICA]
+        del connections.settings[REPLICA]
+        shutil.rmtree(self.directory)
+
+    def _get(self, url, **headers):
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections[REPLICA]) as replica:
+            response = self.client.get(url, **headers)
+        self.assertEqual(response.status_code, 200)
+        return response, primary, replica
+
+    def _recipe_name(self, **headers):
+        response, _, _ = self._get(
+            f'/api/recipes/{self.recipe.pk}/', **headers
+        )
+        return response.json()['name']
+
+    def _authorization(self, token=None):
+        return {'HTTP_AUTHORIZATION': f'Token {(token or self.token).key}'}
+
+    def test_anonymous_get_reads_replica(self):
+        response, primary, replica = self._get('/api/users/')
+        self.assertEqual(response.json()['results'][0]['id'], self.user.id)
+        self.assertTrue(replica.captured_queries)
+        self.assertFalse(primary.captured_queries)
+
+    def test_cached_response_is_built_from_primary(self):
+        response, _, replica = self._get('/api/recipes/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['results'][0]['name'], 'С основной')
+        self.assertFalse(replica.captured_queries)
+
+    def test_reference_cache_is_loaded_from_primary(self):
+        self._get('/api/tags/')
+        # Версия тегов меняется сразу: транзакции здесь не откатываются.
+        Tag.objects.create(name='Ужин', color='#49B64E', slug='dinner')
+        response, _, _ = self._get('/api/tags/')
+        self.assertEqual(
+            [tag['slug'] for tag in response.json()], ['dinner']
+        )
+        self.assertEqual(tags_cache.get()['tags'][0]['slug'], 'dinner')
+
+    def test_token_is_read_from_primary(self):
+        _, primary, replica = self._get(
+            '/api/recipes/', **self._authorization()
+        )
+        self.assertIn(
+            'authtoken_token',
+            ' '.join(query['sql'] for query in primary.captured_queries),
+        )
+        self.assertNotIn(
+            'authtoken_token',
+            ' '.join(query['sql'] for query in replica.captured_queries),
+        )
+        self.assertTrue(replica.captured_queries)
+
+    def test_unsafe_method_uses_primary(self):
+        with CaptureQueriesContext(connections[REPLICA]) as replica:
+            response = self.client.post(
+                f'/api/recipes/{self.recipe.pk}/favorite/',
+                **self._authorization(),
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['name'], 'С основной')
+        self.assertFalse(replica.captured_queries)
+
+    def test_relation_writes_use_primary(self):
+        token = read_from_replica.set(True)
+        try:
+            with CaptureQueriesContext(connections[REPLICA]) as replica:
+                Favorite.objects.add(user=self.user, recipe=self.recipe)
+                Favorite.objects.remove(user=self.user, recipe=self.recipe)
+                Favorite.objects.add(user=self.user, recipe=self.recipe)
+        finally:
+            read_from_replica.reset(token)
+        self.assertFalse(replica.captured_queries)
+        self.assertTrue(
+            Favorite.objects.using('default').filter(
+                user=self.user, recipe=self.recipe
+            ).exists()
+        )
+
+    def test_client_sticks_to_primary_after_write(self):
+        self.assertEqual(
+            self._recipe_name(**self._authorization()), 'С реплики'
+        )
+        response = self.client.post(
+            f'/api/recipes/{self.recipe.pk}/favorite/',
+            **self._authorization(),
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            self._recipe_name(**self._authorization()), 'С основной'
+        )
+        # Другие клиенты продолжают читать с реплики.
+        other = Token.objects.create(user=create_user('other'))
+        self.assertEqual(
+            self._recipe_name(**self._authorization(other)), 'С реплики'
+        )
+        time.sleep(1.1)
+        self.assertEqual(
+            self._recipe_name(**self._authorization()), 'С реплики'
+        )
+
+
+class SQLProfilingMiddlewareTests(TestCase):
+    """Заголовок Server-Timing и журнал медленных запросов."""
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        create_recipe(create_user('author'))
+
+    def _get(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries.captured_queries)
+
+    @override_settings(
+        SQL_PROFILING_SAMPLE_RATE=1, SQL_PROFILING_SLOW_REQUEST_MS=60000
+    )
+    def test_server_timing_counts_queries(self):
+        with self.assertNoLogs('foodgram.middleware'):
+            response, queries = self._get()
+        self.assertRegex(
+            response['Server-Timing'],
+            rf'^db;dur=[\d.]+;desc="{queries} queries", total;dur=[\d.]+$',
+        )
+
+    @override_settings(SQL_PROFILING_SAMPLE_RATE=0)
+    def test_unsampled_request_is_not_profiled(self):
+        response, _ = self._get()
+        self.assertNotIn('Server-Timing', response)
+
+    @override_settings(
+        SQL_PROFILING_SAMPLE_RATE=1,
+        SQL_PROFILING_SLOW_REQUEST_MS=0,
+        SQL_PROFILING_REPEATED_THRESHOLD=1,
+    )
+    def test_slow_request_is_logged(self):
+        with self.assertLogs('foodgram.middleware', 'WARNING') as logs:
+            _, queries = self._get()
+        record = json.loads(logs.records[0].args[0])
+        self.assertEqual(record['view'], 'RecipesViewSet.list')
+        self.assertEqual(record['status'], 200)
+        self.assertEqual(record['queries'], queries)
+        self.assertEqual(
+            sum(query['count'] for query in record['repeated_queries']),
+            queries,
+        )
+
+    def test_repeated_queries_are_grouped_by_fingerprint(self):
+        profile = SQLProfile()
+        for params in ([1], [1, 2], [1, 2, 3]):
+            sql = (
+                'SELECT * FROM recipes_tag WHERE id IN '
+                f'({", ".join(["%s"] * len(params))})'
+            )
+            profile(lambda *args: None, sql, params, False, {})
+        profile(lambda *args: None, 'SELECT 1', [], False, {})
+        self.assertEqual(profile.queries, 4)
+        self.assertEqual(
+            profile.repeated(3),
+            [{'sql': fingerprint(sql), 'count': 3}],
+        )
+        self.assertEqual(profile.repeated(5), [])
+
+
+class MetricsCollectTests(SimpleTestCase):
+    """Сбор метрик из снимков процессов в METRICS_DIR."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        self.registry = Registry()
+        self.gauge = self.registry.register(Gauge('test_in_use', 'Занято.'))
+        self.counter = self.registry.register(
+            Counter('test_total', 'Всего.')
+        )
+
+    def _dead_process_snapshot(self):
+        # Процесс завершён и его pid освобождён, как у перезапущенного
+        # воркера gunicorn.
+        process = subprocess.Popen([sys.executable, '-c', ''])
+        process.wait()
+        key = json.dumps([])
+        (self.directory / f'{process.pid}-dead.json').write_text(json.dumps({
+            'test_in_use': {key: [5.0]},
+            'test_total': {key: [7.0]},
+        }))
+
+    def test_dead_process_gauges_are_ignored(self):
+        with override_settings(METRICS_DIR=str(self.directory)):
+            self._dead_process_snapshot()
+            self.registry.record(self.gauge, 2)
+            self.registry.record(self.counter, 3)
+            samples = self.registry.collect()
+        key = json.dumps([])
+        self.assertEqual(samples['test_in_use'][key], [2.0])
+        self.assertEqual(samples['test_total'][key], [10.0])
+
+    def test_live_processes_are_summed(self):
+        key = json.dumps([['view', 'recipes-list']])
+        # Снимок родительского процесса, как у соседнего воркера.
+        (self.directory / f'{os.getppid()}-live.json').write_text(
+            json.dumps({
+                'test_in_use': {key: [5.0]},
+                'test_total': {key: [7.0]},
+            })
+        )
+        with override_settings(METRICS_DIR=str(self.directory)):
+            self.registry.record(self.gauge, 2, view='recipes-list')
+            self.registry.record(self.counter, 3, view='recipes-list')
+            samples = self.registry.collect()
+        self.assertEqual(samples['test_in_use'][key], [7.0])
+        self.assertEqual(samples['test_total'][key], [10.0])
+
+    def test_histogram_is_rendered_cumulatively(self):
+        histogram = self.registry.register(
+            Histogram('test_seconds', 'Время.', (0.1, 1.0))
+        )
+        for value in (0.05, 0.5, 0.7, 3.0):
+            self.registry.record(histogram, value, view='recipes-list')
+        with override_settings(METRICS_DIR=''):
+            lines = self.registry.render().splitlines()
+        self.assertIn('# TYPE test_seconds histogram', lines)
+        labels = 'view="recipes-list"'
+        for line in (
+            f'test_seconds_bucket{{{labels},le="0.1"}} 1.0',
+            f'test_seconds_bucket{{{labels},le="1.0"}} 3.0',
+            f'test_seconds_bucket{{{labels},le="+Inf"}} 4.0',
+            f'test_seconds_count{{{labels}}} 4.0',
+            f'test_seconds_sum{{{labels}}} 4.25',
+        ):
+            with self.subTest(line=line):
+                self.assertIn(line, lines)
+
+
+@override_settings(METRICS_DIR='', METRICS_TOKEN='secret')
+class MetricsEndpointTests(TestCase):
+    """Эндпоинт /api/metrics и метрики представлений."""
+
+    def _value(self, line_start):
+        text = metrics.registry.render()
+        for line in text.splitlines():
+            if line.startswith(line_start):
+                return float(line.rsplit(' ', 1)[1])
+        return 0.0
+
+    def test_access_requires_staff_or_token(self):
+        self.assertIn(
+            self.client.get('/api/metrics').status_code, (401, 403)
+        )
+        response = self.client.get(
+            '/api/metrics', HTTP_AUTHORIZATION='Bearer wrong'
+        )
+        self.assertIn(response.status_code, (401, 403))
+        response = self.client.get(
+            '/api/metrics', HTTP_AUTHORIZATION='Bearer secret'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+
+    def test_requests_are_counted_per_view(self):
+        for cache in caches.all():
+            cache.clear()
+        lines = (
+            'http_responses_total{status="200",view="recipes-list"} ',
+            'http_response_cache_total{result="hit",view="recipes-list"} ',
+            'http_request_duration_seconds_count{view="recipes-list"} ',
+        )
+        before = [self._value(line) for line in lines]
+        for _ in range(2):
+            response = self.client.get('/api/recipes/')
+            self.assertEqual(response.status_code, 200)
+        after = [self._value(line) for line in lines]
+        self.assertEqual(
+            [b - a for a, b in zip(before, after)], [2.0, 1.0, 2.0]
+        )
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Нужен PostgreSQL.')
+class PostgresConnectionTests(TestCase):
+    """Пул соединений и проверка соединений бэкенда foodgram.postgresql."""
+
+    alias = 'pool-test'
+
+    def setUp(self):
+        self.wrappers = []
+        # Обработчики connection_created ищут соединение по алиасу.
+        connections.settings[self.alias] = dict(connection.settings_dict)
+
+    def tearDown(self):
+        for wrapper in self.wrappers:
+            wrapper.close()
+        _, test_pool = pool._pools.pop(self.alias, (None, None))
+        if test_pool is not None:
+            for raw_connection in test_pool._idle:
+                raw_connection.close()
+        connections[self.alias].close()
+        del connections[self.alias]
+        del connections.settings[self.alias]
+
+    def _wrapper(self, **settings):
+        wrapper = DatabaseWrapper(
+            {**connection.settings_dict, 'CONN_HEALTH_CHECKS': True,
+             **settings},
+            self.alias,
+        )
+        self.wrappers.append(wrapper)
+        return wrapper
+
+    def _pooled(self, max_size=2, timeout=1):
+        return self._wrapper(
+            POOL={'min_size': 0, 'max_size': max_size, 'timeout': timeout}
+        )
+
+    def _terminate(self, raw_connection):
+        pid = raw_connection.get_backend_pid()
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_terminate_backend(%s)', [pid])
+            for _ in range(200):
+                cursor.execute(
+                    'SELECT 1 FROM pg_stat_activity WHERE pid = %s', [pid]
+                )
+                if cursor.fetchone() is None:
+                    return
+                time.sleep(0.01)
+        self.fail('Соединение не закрылось.')
+
+    def _backend_pid(self, wrapper):
+        with wrapper.cursor() as cursor:
+            cursor.execute('SELECT pg_backend_pid()')
+            return cursor.fetchone()[0]
+
+    def test_connection_is_returned_and_reused(self):
+        wrapper = self._pooled()
+        pid = self._backend_pid(wrapper)
+        wrapper.set_autocommit(False)
+        with wrapper.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        raw_connection = wrapper.connection
+        wrapper.close()
+        self.assertIsNone(wrapper.connection)
+        self.assertFalse(raw_connection.closed)
+        self.assertEqual(list(wrapper.pool._idle), [raw_connection])
+        # Незавершённая транзакция откатывается при возврате в пул.
+        self.assertEqual(
+            raw_connection.info.transaction_status,
+            pool.TRANSACTION_STATUS_IDLE,
+        )
+        self.assertEqual(self._backend_pid(wrapper), pid)
+        self.assertTrue(wrapper.get_autocommit())
+
+    def test_wrappers_of_other_threads_open_connections(self):
+        # Обёртки разных потоков делят пул процесса.
+        first, second = self._pooled(), self._pooled()
+        first.ensure_connection()
+        second.ensure_connection()
+        self.assertIsNot(first.connection, second.connection)
+        self.assertEqual(first.pool._in_use, 2)
+        raw_connection = second.connection
+        second.close()
+        second.ensure_connection()
+        self.assertIs(second.connection, raw_connection)
+        self.assertEqual(
+            second.isolation_level, raw_connection.isolation_level
+        )
+
+    def test_broken_connection_is_replaced(self):
+        wrapper = self._pooled()
+        pid = self._backend_pid(wrapper)
+        raw_connection = wrapper.connection
+        wrapper.close()
+        self._terminate(raw_connection)
+        self.assertNotEqual(self._backend_pid(wrapper), pid)
+        self.assertTrue(raw_connection.closed)
+        self.assertEqual(wrapper.pool._size, 1)
+
+    def test_exhausted_pool_times_out(self):
+        first = self._pooled(max_size=1, timeout=0.1)
+        second = self._pooled(max_size=1, timeout=0.1)
+        first.ensure_connection()
+        with self.assertRaises(pool.PoolTimeout):
+            second.ensure_connection()
+        first.close()
+        second.ensure_connection()
+        self.assertEqual(second.pool._size, 1)
+
+    def test_persistent_connection_is_checked_once_per_request(self):
+        wrapper = self._wrapper(CONN_MAX_AGE=60)
+        pid = self._backend_pid(wrapper)
+        self._terminate(wrapper.connection)
+        # Так начинается каждый запрос (сигнал request_started).
+        wrapper.close_if_unusable_or_obsolete()
+        self.assertNotEqual(self._backend_pid(wrapper), pid)
+        self.assertFalse(wrapper.health_check_pending)
@@ -1,12 +1,22 @@
-import csv
-
 from django import forms
-from django.contrib import admin
-from django.shortcuts import redirect, render
+from django.contrib import admin, messages
+from django.contrib.admin.views.main import SEARCH_VAR
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Exists, OuterRef
+from django.db.models.functions import Lower
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import path
+from django.utils.functional import cached_property
 
-from .models import (Favorite, Ingredient, Recipe, RecipeIngredient, RecipeTag,
-                     ShoppingCart, Tag, Unit)
+from .cache import tags_cache
+from .constants import IngredientImports, Pagination
+from .importers import (create_import, detect_format, run_import,
+                        schedule_import)
+from .models import (Favorite, Ingredient, IngredientImport, Recipe,
+                     RecipeIngredient, RecipeTag, ShoppingCart, Tag, Unit)
 
 
 class TagAdmin(admin.ModelAdmin):
@@ -20,12 +30,11 @@ class UnitAdmin(admin.ModelAdmin):
 
 
 class CsvImportForm(forms.Form):
-    csv_file = forms.FileField()
-
-
-def decode_utf8(input_iterator):
-    for i in input_iterator:
-        yield i.decode('utf-8')
+    csv_file = forms.FileField(label='Файл CSV или JSON')
+    force = forms.BooleanField(
+        label='Импортировать повторно', required=False,
+        help_text='Загрузить файл, даже если он уже был импортирован.',
+    )
 
 
 class IngredientAdmin(admin.ModelAdmin):
@@ -37,31 +46,193 @@ class IngredientAdmin(admin.ModelAdmin):
     def get_urls(self):
         urls = super().get_urls()
         my_urls = [
-            path('import-csv/', self.import_csv),
+            path(
+                'import-csv/',
+                self.admin_site.admin_view(self.import_csv),
+                name='recipes_ingredient_import',
+            ),
+            path(
+                'import-csv/<int:pk>/',
+                self.admin_site.admin_view(self.import_progress),
+                name='recipes_ingredient_import_progress',
+            ),
+            path(
+                'import-csv/<int:pk>/status/',
+                self.admin_site.admin_view(self.import_status),
+                name='recipes_ingredient_import_status',
+            ),
         ]
         return my_urls + urls
 
     def import_csv(self, request):
-        if request.method == 'POST':
-            csv_file = request.FILES['csv_file']
-            reader = csv.reader(decode_utf8(csv_file), delimiter=';')
-            for i, row in enumerate(reader):
-                if i == 0:
-                    continue
-                name = row[0]
-                measurement_unit_name = row[1]
-                unit, _ = Unit.objects.get_or_create(
-                    name=measurement_unit_name)
-                Ingredient.objects.get_or_create(
-                    name=name, measurement_unit=unit)
-            self.message_user(request, 'Ваш csv фаил импортирован')
-            return redirect('..')
-        form = CsvImportForm()
-        payload = {'form': form}
+        """Загружает файл: небольшой сразу, крупный в фоновом режиме."""
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+        form = CsvImportForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            csv_file = form.cleaned_data['csv_file']
+            ingredient_import = create_import(
+                csv_file, csv_file.name, form.cleaned_data['force']
+            )
+            if ingredient_import.status == IngredientImport.Status.SKIPPED:
+                self.message_user(
+                    request, 'Этот файл уже был импортирован', messages.WARNING
+                )
+                return redirect('..')
+            if csv_file.size <= IngredientImports.SYNC_MAX_SIZE.value:
+                run_import(
+                    ingredient_import, csv_file, detect_format(csv_file.name)
+                )
+            else:
+                schedule_import(ingredient_import, csv_file)
+            return redirect(
+                'admin:recipes_ingredient_import_progress',
+                ingredient_import.pk,
+            )
+        payload = {
+            **self.admin_site.each_context(request),
+            'form': form,
+            'opts': self.model._meta,
+        }
         return render(
             request, "recipes/import_form.html", payload
         )
 
+    def import_progress(self, request, pk):
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+        payload = {
+            **self.admin_site.each_context(request),
+            'ingredient_import': get_object_or_404(IngredientImport, pk=pk),
+            'opts': self.model._meta,
+        }
+        return render(request, "recipes/import_progress.html", payload)
+
+    def import_status(self, request, pk):
+        """Состояние импорта для опроса со страницы прогресса."""
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+        ingredient_import = get_object_or_404(IngredientImport, pk=pk)
+        return JsonResponse({
+            'status': ingredient_import.status,
+            'status_display': ingredient_import.get_status_display(),
+            'rows_processed': ingredient_import.rows_processed,
+            'rows_created': ingredient_import.rows_created,
+            'rows_per_second': round(ingredient_import.rows_per_second),
+            'errors': ingredient_import.errors,
+        })
+
+
+class IngredientImportAdmin(admin.ModelAdmin):
+    list_display = [
+        'id',
+        'source',
+        'status',
+        'rows_processed',
+        'rows_created',
+        'started_at',
+        'finished_at',
+    ]
+    list_filter = ['status']
+    readonly_fields = [
+        'source',
+        'content_hash',
+        'status',
+        'rows_processed',
+        'rows_created',
+        'errors',
+        'started_at',
+        'finished_at',
+    ]
+
+    def has_add_permission(self, request):
+        return False
+
+
+class EstimatedCountPaginator(Paginator):
+    """Пагинатор, не считающий строки полной таблицы рецептов.
+
+    Для запроса без фильтров на PostgreSQL берёт оценку количества строк
+    из статистики pg_class вместо COUNT(*) по всей таблице. Оценка
+    устаревает до следующего ANALYZE, поэтому строки считаются и точно,
+    но не больше ADMIN_EXACT_COUNT_LIMIT: небольшая таблица показывается
+    полностью, даже если статистика собрана, когда она была пустой.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql' or queryset.query.where:
+            return super().count
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                [connection.ops.quote_name(queryset.model._meta.db_table)],
+            )
+            row = cursor.fetchone()
+        if not row or row[0] < 0:
+            return super().count
+        limit = Pagination.ADMIN_EXACT_COUNT_LIMIT.value
+        return max(int(row[0]), queryset[:limit + 1].count())
+
+
+class TagFilter(admin.SimpleListFilter):
+    """Фильтр по тегу через EXISTS, без JOIN и DISTINCT."""
+    title = 'Тег'
+    parameter_name = 'tag'
+
+    def lookups(self, request, model_admin):
+        return [(tag['slug'], tag['name']) for tag in tags_cache.get()['tags']]
+
+    def queryset(self, request, queryset):
+        if not self.value():
+            return queryset
+        return queryset.filter(
+            Exists(
+                RecipeTag.objects.filter(
+                    recipe=OuterRef('pk'), tag__slug=self.value()
+                )
+            )
+        )
+
+
+class IngredientFilter(admin.SimpleListFilter):
+    """Фильтр по началу названия ингредиента с полем ввода.
+
+    Вместо списка всех ингредиентов выводит строку поиска; префикс
+    ищется по lower(name), что позволяет использовать индекс
+    recipes_ingredient_name_lower_idx.
+    """
+    title = 'Ингредиент'
+    parameter_name = 'ingredient'
+    template = 'recipes/input_filter.html'
+
+    def lookups(self, request, model_admin):
+        # Непустой список нужен, чтобы Django показал фильтр.
+        return [('', '')]
+
+    def choices(self, changelist):
+        query_params = changelist.get_filters_params()
+        query_params.pop(self.parameter_name, None)
+        if changelist.query:
+            query_params[SEARCH_VAR] = changelist.query
+        yield {'query_params': query_params, 'value': self.value() or ''}
+
+    def queryset(self, request, queryset):
+        if not self.value():
+            return queryset
+        ingredients = Ingredient.objects.annotate(
+            search_name=Lower('name')
+        ).filter(search_name__startswith=self.value().lower())
+        return queryset.filter(
+            Exists(
+                RecipeIngredient.objects.filter(
+                    recipe=OuterRef('pk'), ingredient__in=ingredients
+                )
+            )
+        )
+
 
 class RecipeAdmin(admin.ModelAdmin):
     list_display = [
@@ -71,14 +242,19 @@ class RecipeAdmin(admin.ModelAdmin):
         'cooking_time',
         'favorite_added',
     ]
-    search_fields = ['author', 'name', 'text']
-    list_filter = ['tags__name', 'ingredients__name']
+    list_select_related = ['author']
+    search_fields = ['name', 'author__username', 'author__email']
+    list_filter = [TagFilter, IngredientFilter]
     readonly_fields = ['favorite_added']
+    autocomplete_fields = ['author']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
     def favorite_added(self, obj):
-        return obj.favorite.all().count()
+        return obj.favorites_count
 
     favorite_added.short_description = "Количество добавлений в избранное"
+    favorite_added.admin_order_field = 'favorites_count'
 
 
 class RecipeTagAdmin(admin.ModelAdmin):
@@ -105,6 +281,7 @@ class ShoppingCartAdmin(admin.ModelAdmin):
 admin.site.register(Tag, TagAdmin)
 admin.site.register(Unit, UnitAdmin)
 admin.site.register(Ingredient, IngredientAdmin)
+admin.site.register(IngredientImport, IngredientImportAdmin)
 admin.site.register(Recipe, RecipeAdmin)
 admin.site.register(RecipeTag, RecipeTagAdmin)
 admin.site.register(RecipeIngredient, RecipeIngredientAdmin)
@@ -0,0 +1,281 @@
+import hashlib
+import json
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils.http import quote_etag
+
+from recipes.constants import DataVersions, ShoppingList
+from recipes.models import Favorite, ShoppingCart, Tag, Unit
+from users.models import Subscription
+
+INGREDIENTS_VERSION_KEY = 'ingredients:version'
+RECIPES_VERSION_KEY = 'recipes:version'
+TAGS_VERSION_KEY = 'tags:version'
+UNITS_VERSION_KEY = 'units:version'
+
+PROCESS_LOCAL_CACHE_WARNING = (
+    'Кэш по умолчанию хранится в памяти процесса (CACHE_BACKEND): '
+    'запущенные процессы приложения увидят изменения с задержкой до '
+    f'{DataVersions.LOCAL_TIMEOUT.value} с.'
+)
+
+
+def shared_cache_configured(alias=DEFAULT_CACHE_ALIAS):
+    """Видят ли кэш alias все процессы приложения."""
+    return not isinstance(caches[alias], LocMemCache)
+
+
+def _version_timeout():
+    # Версию в памяти процесса не меняют записи других процессов,
+    # поэтому она живёт ограниченное время: после её истечения данные
+    # перечитываются, и чужие изменения видны не позже чем через
+    # LOCAL_TIMEOUT секунд. Общий кэш хранит версии бессрочно.
+    if shared_cache_configured():
+        return None
+    return DataVersions.LOCAL_TIMEOUT.value
+
+
+def _get_version(key):
+    return cache.get_or_set(key, lambda: uuid4().hex, _version_timeout())
+
+
+def _get_versions(keys):
+    versions = cache.get_many(keys)
+    missing = {key: uuid4().hex for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, _version_timeout())
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def _bump_versions(keys):
+    cache.set_many(
+        {key: uuid4().hex for key in keys}, _version_timeout()
+    )
+
+
+def _cart_version_key(user_id):
+    return f'shopping_cart:version:{user_id}'
+
+
+def get_cart_version(user_id):
+    """Возвращает версию списка покупок пользователя.
+
+    В версию входит версия справочника ингредиентов: названия
+    ингредиентов и единиц попадают в файл списка покупок.
+    """
+    return ':'.join(
+        _get_versions([_cart_version_key(user_id), INGREDIENTS_VERSION_KEY])
+    )
+
+
+def bump_cart_versions(user_ids):
+    """Делает недействительными сохранённые списки покупок."""
+    _bump_versions(_cart_version_key(user_id) for user_id in user_ids)
+
+
+def bump_cart_versions_on_commit(user_ids):
+    user_ids = list(user_ids)
+    transaction.on_commit(lambda: bump_cart_versions(user_ids))
+
+
+def bump_recipe_cart_versions_on_commit(recipe_id):
+    """После фиксации сбрасывает списки покупок с этим рецептом."""
+    transaction.on_commit(lambda: bump_cart_versions(
+        ShoppingCart.objects.filter(recipe_id=recipe_id).values_list(
+            'user_id', flat=True
+        )
+    ))
+
+
+def get_ingredients_version():
+    """Возвращает текущую версию справочника ингредиентов."""
+    return _get_version(INGREDIENTS_VERSION_KEY)
+
+
+def bump_ingredients_version():
+    """Делает недействительными индексы ингредиентов во всех процессах."""
+    _bump_versions([INGREDIENTS_VERSION_KEY])
+
+
+def bump_ingredients_version_on_commit():
+    transaction.on_commit(bump_ingredients_version)
+
+
+def _author_recipes_version_key(author_id):
+    return f'recipes:version:author:{author_id}'
+
+
+def get_recipes_versions(author_id=None):
+    """Возвращает версии данных, из которых собираются ответы о рецептах.
+
+    Для списка рецептов одного автора вместо общей версии рецептов
+    берётся версия этого автора, поэтому такие страницы не сбрасываются
+    при изменении чужих рецептов. Справочники тегов и ингредиентов
+    входят в представление рецепта и учитываются всегда.
+    """
+    recipes_key = (
+        RECIPES_VERSION_KEY if author_id is None
+        else _author_recipes_version_key(author_id)
+    )
+    return _get_versions(
+        [recipes_key, TAGS_VERSION_KEY, INGREDIENTS_VERSION_KEY]
+    )
+
+
+def bump_recipes_versions(author_id):
+    """Делает недействительными сохранённые ответы о рецептах автора."""
+    _bump_versions(
+        [RECIPES_VERSION_KEY, _author_recipes_version_key(author_id)]
+    )
+
+
+def bump_recipes_versions_on_commit(author_id):
+    transaction.on_commit(lambda: bump_recipes_versions(author_id))
+
+
+def _shopping_list_key(user_id, version, file_format):
+    return f'shopping_cart:file:{user_id}:{version}:{file_format}'
+
+
+def get_shopping_list(user_id, version, file_format):
+    return cache.get(_shopping_list_key(user_id, version, file_format))
+
+
+def set_shopping_list(user_id, version, file_format, content):
+    cache.set(
+        _shopping_list_key(user_id, version, file_format),
+        content,
+        ShoppingList.CACHE_TIMEOUT.value,
+    )
+
+
+class ProcessCache:
+    """Справочник, закэшированный в памяти процесса.
+
+    Данные загружаются loader() и хранятся до тех пор, пока не
+    изменится версия справочника в кэше (в кэше процесса версия
+    истекает через DataVersions.LOCAL_TIMEOUT секунд). Версию меняют
+    сигналы моделей (после фиксации транзакции) и команды импорта.
+    Загрузчики читают основную БД: с отстающей реплики под новую
+    версию попали бы старые строки.
+    """
+
+    def __init__(self, version_key, loader):
+        self.version_key = version_key
+        self.loader = loader
+        self._cached = None
+
+    def get(self):
+        version = _get_version(self.version_key)
+        cached = self._cached
+        if cached is None or cached[0] != version:
+            cached = self._cached = (version, self.loader())
+        return cached[1]
+
+    def invalidate(self):
+        _bump_versions([self.version_key])
+
+    def invalidate_on_commit(self):
+        # До фиксации другой процесс перечитал бы старые строки
+        # под новой версией и хранил бы их до следующего изменения.
+        transaction.on_commit(self.invalidate)
+
+
+def _load_tags():
+    tags = list(
+        Tag.objects.using(DEFAULT_DB_ALIAS).values(
+            'id', 'name', 'color', 'slug'
+        )
+    )
+    content = json.dumps(tags, ensure_ascii=False, sort_keys=True)
+    etag = quote_etag(hashlib.md5(content.encode('utf-8')).hexdigest())
+    return {'tags': tags, 'by_id': {tag['id']: tag for tag in tags},
+            'etag': etag}
+
+
+def _load_units():
+    return dict(
+        Unit.objects.using(DEFAULT_DB_ALIAS).values_list('id', 'name')
+    )
+
+
+tags_cache = ProcessCache(TAGS_VERSION_KEY, _load_tags)
+units_cache = ProcessCache(UNITS_VERSION_KEY, _load_units)
+
+
+def memberships_shared():
+    """Хранится ли кэш принадлежности в общем для процессов кэше."""
+    return shared_cache_configured(settings.MEMBERSHIP_CACHE)
+
+
+class MembershipCache:
+    """Множество id объектов, связанных с пользователем.
+
+    Хранится в кэше settings.MEMBERSHIP_CACHE, если он общий для всех
+    процессов (например Redis или Memcached). После каждой записи
+    сигналы перечитывают множество из БД, когда транзакция
+    зафиксирована. Кэш в памяти процесса не видит записей других
+    воркеров, и пользователь мог бы увидеть своё изменение отменённым,
+    поэтому без общего кэша множество читается из БД при каждом
+    обращении, а флаги рецептов вычисляются в запросе
+    (RecipeQuerySet.with_user_flags).
+    """
+
+    def __init__(self, name, model, field):
+        self.name = name
+        self.model = model
+        self.field = field
+
+    @property
+    def backend(self):
+        return caches[settings.MEMBERSHIP_CACHE]
+
+    def _key(self, user_id):
+        return f'memberships:{self.name}:{user_id}'
+
+    def _load(self, user_id):
+        return frozenset(
+            self.model.objects.using(DEFAULT_DB_ALIAS)
+            .filter(user_id=user_id)
+            .values_list(self.field, flat=True)
+        )
+
+    def get(self, user_id):
+        if not memberships_shared():
+            return self._load(user_id)
+        ids = self.backend.get(self._key(user_id))
+        if ids is None:
+            ids = self._load(user_id)
+            self.backend.set(self._key(user_id), ids)
+        return ids
+
+    def refresh(self, user_id):
+        self.backend.set(self._key(user_id), self._load(user_id))
+
+    def refresh_on_commit(self, user_id):
+        if memberships_shared():
+            transaction.on_commit(lambda: self.refresh(user_id))
+
+    def filter(self, queryset, user_id):
+        """Оставляет в queryset объекты, связанные с пользователем."""
+        if memberships_shared():
+            ids = self.get(user_id)
+        else:
+            ids = self.model.objects.filter(user_id=user_id).values(
+                self.field
+            )
+        return queryset.filter(pk__in=ids)
+
+
+favorites_cache = MembershipCache('favorites', Favorite, 'recipe_id')
+shopping_cart_cache = MembershipCache(
+    'shopping_cart', ShoppingCart, 'recipe_id'
+)
+subscriptions_cache = MembershipCache(
+    'subscriptions', Subscription, 'author_id'
+)
@@ -3,6 +3,51 @@ from enum import Enum
 
 class Pagination(Enum):
     PAGE_SIZE = 6
+    ADMIN_EXACT_COUNT_LIMIT = 1000
+
+
+class IngredientSearch(Enum):
+    LIMIT = 50
+    SIMILARITY_THRESHOLD = 0.3
+
+
+class Images(Enum):
+    MAX_UPLOAD_SIZE = 5 * 1024 * 1024
+    MAX_DIMENSION = 6000
+    FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
+    VARIANTS = {'card': 480, 'detail': 960, 'retina': 1920}
+    VARIANT_FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+    VARIANT_QUALITY = 82
+    WORKERS = 2
+
+
+class IngredientImports(Enum):
+    BATCH_SIZE = 1000
+    MAX_ERRORS = 100
+    MAX_LEN_SOURCE = 255
+    SYNC_MAX_SIZE = 1024 * 1024
+    UPLOAD_DIR = 'imports/ingredients'
+    WORKERS = 1
+
+
+class RecipeSearch(Enum):
+    CONFIG = 'russian'
+
+
+class RecipesOrdering(Enum):
+    POPULAR = ('-favorites_count', '-id')
+
+
+class ResponseCache(Enum):
+    TIMEOUT = 60
+
+
+class DataVersions(Enum):
+    LOCAL_TIMEOUT = 30
+
+
+class ShoppingList(Enum):
+    CACHE_TIMEOUT = 60 * 60 * 24
 
 
 class RecipesModels(Enum):
@@ -0,0 +1,65 @@
+"""Денормализованные счётчики популярности рецептов и авторов.
+
+Счётчики меняются атомарным UPDATE с F() при каждой записи (см.
+recipes/signals.py), а reconcile() пересчитывает их по связанным
+таблицам, исправляя расхождения, например после bulk_create.
+"""
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from recipes.models import Favorite, Recipe, ShoppingCart
+from users.models import Subscription, User
+
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'shopping_cart_count', ShoppingCart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'subscribers_count', Subscription, 'author'),
+)
+BATCH_SIZE = 10000
+
+
+def change_counter(model, pk, field, delta):
+    """Атомарно меняет счётчик field объекта pk на delta."""
+    model.objects.filter(pk=pk).update(
+        **{field: Greatest(F(field) + delta, 0)}
+    )
+
+
+def actual_count(related_model, fk):
+    return Coalesce(
+        Subquery(
+            related_model.objects.filter(**{fk: OuterRef('pk')})
+            .order_by()
+            .values(fk)
+            .annotate(total=Count('pk'))
+            .values('total')
+        ),
+        0,
+    )
+
+
+def reconcile(batch_size=BATCH_SIZE, dry_run=False):
+    """Пересчитывает счётчики пачками по диапазонам первичных ключей.
+
+    Возвращает словарь {(модель, поле): количество исправленных строк}.
+    """
+    fixed = {}
+    for model, field, related_model, fk in COUNTERS:
+        key = (model._meta.label, field)
+        fixed[key] = 0
+        last = model.objects.order_by('-pk').values_list('pk', flat=True)
+        last = last.first() or 0
+        for start in range(0, last + 1, batch_size):
+            drifted = model.objects.filter(
+                pk__gte=start, pk__lt=start + batch_size
+            ).alias(actual=actual_count(related_model, fk)).exclude(
+                **{field: F('actual')}
+            )
+            if dry_run:
+                fixed[key] += drifted.count()
+            else:
+                fixed[key] += drifted.update(
+                    **{field: actual_count(related_model, fk)}
+                )
+    return fixed
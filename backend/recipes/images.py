@@ -0,0 +1,86 @@
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import PurePosixPath
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from PIL import Image, ImageOps
+
+from recipes.cache import bump_recipes_versions
+from recipes.constants import Images
+from recipes.models import Recipe
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(
+    max_workers=Images.WORKERS.value, thread_name_prefix='recipe-images'
+)
+
+
+def variant_name(source, variant, extension):
+    path = PurePosixPath(source)
+    return str(path.parent / 'variants' / f'{path.stem}_{variant}.{extension}')
+
+
+def _render(image, width, image_format):
+    variant = image.copy()
+    if variant.width > width:
+        variant.thumbnail((width, variant.height))
+    if image_format == 'JPEG' and variant.mode != 'RGB':
+        variant = variant.convert('RGB')
+    buffer = io.BytesIO()
+    variant.save(
+        buffer, image_format, quality=Images.VARIANT_QUALITY.value,
+        optimize=True,
+    )
+    return buffer.getvalue()
+
+
+def generate_variants(recipe_id, source, author_id):
+    """Создаёт уменьшенные копии изображения рецепта в форматах WebP и JPEG.
+
+    Выполняется в пуле потоков; по завершении сохраняет пути копий
+    в Recipe.image_variants, если изображение рецепта не сменилось.
+    """
+    try:
+        with default_storage.open(source) as file:
+            image = ImageOps.exif_transpose(Image.open(file))
+            image.load()
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands()
+                                  else 'RGB')
+        variants = {'source': source}
+        for variant, width in Images.VARIANTS.value.items():
+            variants[variant] = {}
+            for extension, image_format in (
+                Images.VARIANT_FORMATS.value.items()
+            ):
+                name = variant_name(source, variant, extension)
+                if default_storage.exists(name):
+                    default_storage.delete(name)
+                variants[variant][extension] = default_storage.save(
+                    name, ContentFile(_render(image, width, image_format))
+                )
+        if Recipe.objects.filter(pk=recipe_id, image=source).update(
+            image_variants=variants
+        ):
+            bump_recipes_versions(author_id)
+    except Exception:
+        logger.exception(
+            'Не удалось создать копии изображения рецепта %s', recipe_id
+        )
+    finally:
+        connection.close()
+
+
+def schedule_variants(recipe):
+    """Ставит генерацию копий в очередь после фиксации транзакции."""
+    recipe_id, source = recipe.pk, recipe.image.name
+    author_id = recipe.author_id
+    transaction.on_commit(
+        lambda: executor.submit(
+            generate_variants, recipe_id, source, author_id
+        )
+    )
@@ -0,0 +1,293 @@
+import csv
+import hashlib
+import io
+import json
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils import timezone
+
+from recipes.cache import bump_ingredients_version, units_cache
+from recipes.constants import IngredientImports, RecipesModels
+from recipes.models import Ingredient, IngredientImport, Unit
+
+FORMATS = ('csv', 'json')
+READ_CHUNK_SIZE = 64 * 1024
+JSON_SEPARATORS = re.compile(r'[\s,]*')
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(
+    max_workers=IngredientImports.WORKERS.value,
+    thread_name_prefix='ingredient-imports',
+)
+
+
+def detect_format(file_name):
+    extension = file_name.rsplit('.', 1)[-1].lower()
+    return extension if extension in FORMATS else 'csv'
+
+
+def content_hash(binary_file):
+    """Считает SHA-256 содержимого файла, читая его по частям."""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: binary_file.read(READ_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    binary_file.seek(0)
+    return digest.hexdigest()
+
+
+def read_csv(text_file):
+    """Построчно читает CSV: с заголовком name/measurement_unit или без.
+
+    Разделитель (запятая, точка с запятой или табуляция) определяется
+    по началу файла. Отдаёт кортежи (номер строки, название, единица).
+    """
+    sample = text_file.read(READ_CHUNK_SIZE)
+    text_file.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.reader(text_file, dialect)
+    columns = (0, 1)
+    for row in reader:
+        header = [column.strip().lower() for column in row]
+        if not any(header):
+            continue
+        if 'name' in header and 'measurement_unit' in header:
+            columns = (header.index('name'), header.index('measurement_unit'))
+        else:
+            yield (reader.line_num, *_get_columns(row, columns))
+        break
+    for row in reader:
+        if any(row):
+            yield (reader.line_num, *_get_columns(row, columns))
+
+
+def _get_columns(row, columns):
+    return [row[column].strip() if column < len(row) else ''
+            for column in columns]
+
+
+def read_json(text_file):
+    """Потоково читает JSON-массив объектов name/measurement_unit.
+
+    Объекты разбираются по одному из буфера, который дочитывается
+    частями, поэтому файл не загружается в память целиком.
+    """
+    decoder = json.JSONDecoder()
+    buffer = text_file.read(READ_CHUNK_SIZE).lstrip()
+    if not buffer.startswith('['):
+        raise ValueError('Ожидается JSON-массив объектов.')
+    position, number, eof = 1, 0, False
+    while True:
+        position = JSON_SEPARATORS.match(buffer, position).end()
+        if buffer.startswith(']', position):
+            return
+        try:
+            item, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            chunk = text_file.read(READ_CHUNK_SIZE)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        number += 1
+        if not isinstance(item, dict):
+            yield number, '', ''
+            continue
+        yield (
+            number,
+            str(item.get('name', '')).strip(),
+            str(item.get('measurement_unit', '')).strip(),
+        )
+
+
+READERS = {'csv': read_csv, 'json': read_json}
+
+
+class IngredientImporter:
+    """Пакетная загрузка ингредиентов с идемпотентной вставкой.
+
+    Единицы измерения создаются одним запросом на пакет, ингредиенты
+    вставляются bulk_create с пропуском конфликтов по уникальной паре
+    (название, единица), поэтому повторный импорт того же файла ничего
+    не дублирует. Ход импорта сохраняется в IngredientImport.
+    """
+
+    def __init__(self, ingredient_import,
+                 batch_size=IngredientImports.BATCH_SIZE.value,
+                 progress=None):
+        self.ingredient_import = ingredient_import
+        self.batch_size = batch_size
+        self.progress = progress
+        self.units = {}
+
+    def run(self, rows):
+        ingredient_import = self.ingredient_import
+        ingredient_import.status = IngredientImport.Status.RUNNING
+        ingredient_import.started_at = timezone.now()
+        ingredient_import.save(update_fields=['status', 'started_at'])
+        ingredients_before = Ingredient.objects.count()
+        self.units = dict(Unit.objects.values_list('name', 'id'))
+        batch = []
+        try:
+            for number, name, unit in rows:
+                ingredient_import.rows_processed += 1
+                error = self._validate(name, unit)
+                if error:
+                    self._add_error(number, error)
+                    continue
+                batch.append((name, unit))
+                if len(batch) >= self.batch_size:
+                    self._flush(batch)
+                    batch = []
+            self._flush(batch)
+        except (ValueError, UnicodeDecodeError, csv.Error) as error:
+            ingredient_import.status = IngredientImport.Status.FAILED
+            self._add_error(ingredient_import.rows_processed + 1, str(error))
+        else:
+            ingredient_import.status = IngredientImport.Status.DONE
+        finally:
+            ingredient_import.rows_created = max(
+                Ingredient.objects.count() - ingredients_before, 0
+            )
+            ingredient_import.finished_at = timezone.now()
+            ingredient_import.save()
+            bump_ingredients_version()
+            units_cache.invalidate()
+        return ingredient_import
+
+    def _validate(self, name, unit):
+        if not name or not unit:
+            return 'Не указано название или единица измерения.'
+        if len(name) > RecipesModels.MAX_LEN_INGREDIENT_NAME.value:
+            return 'Слишком длинное название.'
+        if len(unit) > RecipesModels.MAX_LEN_UNIT_NAME.value:
+            return 'Слишком длинная единица измерения.'
+        return None
+
+    def _add_error(self, number, message):
+        errors = self.ingredient_import.errors
+        if len(errors) < IngredientImports.MAX_ERRORS.value:
+            errors.append({'row': number, 'error': message})
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        missing_units = {unit for _, unit in batch} - self.units.keys()
+        if missing_units:
+            Unit.objects.bulk_create(
+                [Unit(name=unit) for unit in missing_units],
+                ignore_conflicts=True,
+            )
+            self.units.update(
+                Unit.objects.filter(name__in=missing_units).values_list(
+                    'name', 'id'
+                )
+            )
+        Ingredient.objects.bulk_create(
+            [
+                Ingredient(name=name, measurement_unit_id=self.units[unit])
+                for name, unit in batch
+            ],
+            batch_size=self.batch_size,
+            ignore_conflicts=True,
+        )
+        IngredientImport.objects.filter(pk=self.ingredient_import.pk).update(
+            rows_processed=self.ingredient_import.rows_processed
+        )
+        if self.progress:
+            self.progress(self.ingredient_import)
+
+
+def find_previous_import(digest):
+    return IngredientImport.objects.filter(
+        content_hash=digest, status=IngredientImport.Status.DONE
+    ).first()
+
+
+def create_import(binary_file, source, force=False):
+    """Регистрирует импорт файла и проверяет, не загружался ли он уже.
+
+    Если файл с тем же содержимым уже был успешно импортирован,
+    импорт сразу помечается пропущенным, пока не передан force=True.
+    """
+    digest = content_hash(binary_file)
+    ingredient_import = IngredientImport.objects.create(
+        source=source[:IngredientImports.MAX_LEN_SOURCE.value],
+        content_hash=digest,
+    )
+    if not force and find_previous_import(digest):
+        ingredient_import.status = IngredientImport.Status.SKIPPED
+        ingredient_import.finished_at = timezone.now()
+        ingredient_import.save()
+    return ingredient_import
+
+
+def import_ingredients(binary_file, source, file_format=None, force=False,
+                       batch_size=IngredientImports.BATCH_SIZE.value,
+                       progress=None):
+    """Импортирует ингредиенты из открытого в двоичном режиме файла."""
+    ingredient_import = create_import(binary_file, source, force)
+    if ingredient_import.status == IngredientImport.Status.SKIPPED:
+        return ingredient_import
+    return run_import(
+        ingredient_import, binary_file, file_format or detect_format(source),
+        batch_size, progress,
+    )
+
+
+def run_import(ingredient_import, binary_file, file_format,
+               batch_size=IngredientImports.BATCH_SIZE.value, progress=None):
+    """Выполняет уже созданный импорт ingredient_import."""
+    text_file = io.TextIOWrapper(
+        binary_file, encoding='utf-8-sig', newline=''
+    )
+    try:
+        return IngredientImporter(
+            ingredient_import, batch_size, progress
+        ).run(READERS[file_format](text_file))
+    finally:
+        text_file.detach()
+
+
+def run_stored_import(import_id, path, file_format):
+    """Выполняет импорт файла, сохранённого в хранилище, и удаляет файл.
+
+    Выполняется в пуле потоков, поэтому сам закрывает соединение с БД.
+    """
+    try:
+        ingredient_import = IngredientImport.objects.get(pk=import_id)
+        with default_storage.open(path) as file:
+            run_import(ingredient_import, file, file_format)
+    except Exception:
+        logger.exception('Не удалось импортировать ингредиенты %s', path)
+        IngredientImport.objects.filter(pk=import_id).update(
+            status=IngredientImport.Status.FAILED,
+            finished_at=timezone.now(),
+        )
+    finally:
+        default_storage.delete(path)
+        connection.close()
+
+
+def schedule_import(ingredient_import, uploaded_file, file_format=None):
+    """Сохраняет загруженный файл и ставит импорт в фоновую очередь."""
+    path = default_storage.save(
+        f'{IngredientImports.UPLOAD_DIR.value}/{uploaded_file.name}',
+        uploaded_file,
+    )
+    import_id = ingredient_import.pk
+    file_format = file_format or detect_format(uploaded_file.name)
+    transaction.on_commit(
+        lambda: executor.submit(
+            run_stored_import, import_id, path, file_format
+        )
+    )
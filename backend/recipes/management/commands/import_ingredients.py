@@ -1,12 +1,17 @@
-import csv
+from django.core.management.base import BaseCommand, CommandError
 
-from django.core.management.base import BaseCommand
-
-from recipes.models import Ingredient, Unit
+from recipes.cache import (PROCESS_LOCAL_CACHE_WARNING,
+                           shared_cache_configured)
+from recipes.constants import IngredientImports
+from recipes.importers import FORMATS, import_ingredients
+from recipes.models import IngredientImport
 
 
 class Command(BaseCommand):
-    help = "Импорт ингридиентов"
+    help = (
+        "Импорт ингридиентов из CSV или JSON. Повторный импорт того же "
+        "файла пропускается, существующие ингридиенты не дублируются."
+    )
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -16,29 +21,65 @@ class Command(BaseCommand):
             required=True,
             help="Путь к файлу с ингридиентами",
         )
+        parser.add_argument(
+            "-f",
+            "--format",
+            choices=FORMATS,
+            help="Формат файла, по умолчанию определяется по расширению",
+        )
+        parser.add_argument(
+            "-b",
+            "--batch-size",
+            type=int,
+            default=IngredientImports.BATCH_SIZE.value,
+            help="Количество строк в одной пачке",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Импортировать файл, даже если он уже был загружен",
+        )
 
     def handle(self, *args, **options):
-        with open(options["path"], encoding="utf8") as csv_file:
-            reader = list(csv.reader(csv_file))
-            Unit.objects.bulk_create(
-                [
-                    Unit(name=unit_name)
-                    for unit_name in {unit_name for _, unit_name in reader}
-                ],
-                ignore_conflicts=True,
+        if options["batch_size"] < 1:
+            raise CommandError("Размер пачки должен быть положительным.")
+        try:
+            with open(options["path"], "rb") as file:
+                ingredient_import = import_ingredients(
+                    file,
+                    source=options["path"],
+                    file_format=options["format"],
+                    force=options["force"],
+                    batch_size=options["batch_size"],
+                    progress=self.progress,
+                )
+        except OSError as error:
+            raise CommandError(error)
+
+        for error in ingredient_import.errors:
+            self.stderr.write(f"Строка {error['row']}: {error['error']}")
+        if ingredient_import.status == IngredientImport.Status.SKIPPED:
+            self.stdout.write(
+                self.style.WARNING(
+                    "Файл уже был импортирован, используйте --force."
+                )
             )
-            unit_instances = Unit.objects.all()
-            unit_name_id = {unit.name: unit for unit in unit_instances}
-            Ingredient.objects.bulk_create(
-                [
-                    Ingredient(
-                        name=ingredient_name,
-                        measurement_unit=unit_name_id[unit_name],
-                    )
-                    for ingredient_name, unit_name in reader
-                ]
+            return
+        if not shared_cache_configured():
+            self.stderr.write(self.style.WARNING(PROCESS_LOCAL_CACHE_WARNING))
+        if ingredient_import.status == IngredientImport.Status.FAILED:
+            raise CommandError("Импорт прерван из-за ошибки в файле.")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Ингридиенты успешно добавлены: "
+                f"{ingredient_import.rows_created} новых из "
+                f"{ingredient_import.rows_processed} строк "
+                f"({ingredient_import.rows_per_second:.0f} строк/с)."
             )
+        )
 
+    def progress(self, ingredient_import):
         self.stdout.write(
-            self.style.SUCCESS("Ингридиенты успешно добавлены.")
+            f"Обработано строк: {ingredient_import.rows_processed} "
+            f"({ingredient_import.rows_per_second:.0f} строк/с)"
         )
@@ -2,6 +2,8 @@ import csv
 
 from django.core.management.base import BaseCommand
 
+from recipes.cache import (PROCESS_LOCAL_CACHE_WARNING,
+                           shared_cache_configured, tags_cache)
 from recipes.models import Tag
 
 
@@ -30,5 +32,8 @@ class Command(BaseCommand):
                     for name, color, slug in reader
                 ]
             )
+        tags_cache.invalidate()
+        if not shared_cache_configured():
+            self.stderr.write(self.style.WARNING(PROCESS_LOCAL_CACHE_WARNING))
 
         self.stdout.write(self.style.SUCCESS("Теги успешно добавлены."))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from recipes.counters import BATCH_SIZE, reconcile
+
+
+class Command(BaseCommand):
+    help = (
+        "Пересчёт счётчиков избранного, корзины, рецептов и подписчиков "
+        "по связанным таблицам."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-b",
+            "--batch-size",
+            type=int,
+            default=BATCH_SIZE,
+            help="Количество строк в одной пачке",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Только показать количество расхождений",
+        )
+
+    def handle(self, *args, **options):
+        fixed = reconcile(options["batch_size"], options["dry_run"])
+        for (model, field), count in fixed.items():
+            self.stdout.write(f"{model}.{field}: {count}")
+        message = (
+            "Найдено расхождений" if options["dry_run"]
+            else "Исправлено счётчиков"
+        )
+        self.stdout.write(
+            self.style.SUCCESS(f"{message}: {sum(fixed.values())}.")
+        )
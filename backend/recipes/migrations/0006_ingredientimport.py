@@ -0,0 +1,30 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_recipe_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngredientImport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=255, verbose_name='Источник')),
+                ('content_hash', models.CharField(db_index=True, max_length=64, verbose_name='Хеш содержимого')),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('done', 'Завершён'), ('skipped', 'Пропущен'), ('failed', 'Ошибка')], default='pending', max_length=16, verbose_name='Статус')),
+                ('rows_processed', models.PositiveIntegerField(default=0, verbose_name='Обработано строк')),
+                ('rows_created', models.PositiveIntegerField(default=0, verbose_name='Добавлено ингредиентов')),
+                ('errors', models.JSONField(blank=True, default=list, verbose_name='Ошибки')),
+                ('started_at', models.DateTimeField(auto_now_add=True, verbose_name='Начало')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Окончание')),
+            ],
+            options={
+                'verbose_name': 'Импорт ингредиентов',
+                'verbose_name_plural': 'Импорты ингредиентов',
+                'ordering': ['-id'],
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+COUNTERS = (
+    ('recipes', 'Recipe', 'favorites_count', 'recipes', 'Favorite', 'recipe'),
+    ('recipes', 'Recipe', 'shopping_cart_count',
+     'recipes', 'ShoppingCart', 'recipe'),
+    ('users', 'User', 'recipes_count', 'recipes', 'Recipe', 'author'),
+    ('users', 'User', 'subscribers_count', 'users', 'Subscription', 'author'),
+)
+
+
+def fill_counters(apps, schema_editor):
+    for app, model, field, related_app, related_model, fk in COUNTERS:
+        related = apps.get_model(related_app, related_model)
+        total = related.objects.filter(
+            **{fk: OuterRef('pk')}
+        ).order_by().values(fk).annotate(total=Count('pk')).values('total')
+        apps.get_model(app, model).objects.update(
+            **{field: Coalesce(Subquery(total), 0)}
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_ingredientimport'),
+        ('users', '0003_user_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Добавлений в избранное'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='shopping_cart_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Добавлений в корзину'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-favorites_count', '-id'], name='recipes_recipe_popular_idx'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+import django.contrib.postgres.search
+from django.db import migrations
+
+POSTGRES_FORWARD = (
+    '''
+    CREATE OR REPLACE FUNCTION recipes_recipe_search_vector_update()
+    RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('russian', coalesce(NEW.name, '')), 'A')
+            || setweight(to_tsvector('russian', coalesce(NEW.text, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    ''',
+    '''
+    CREATE TRIGGER recipes_recipe_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF name, text ON recipes_recipe
+    FOR EACH ROW EXECUTE FUNCTION recipes_recipe_search_vector_update()
+    ''',
+    '''
+    UPDATE recipes_recipe SET search_vector =
+        setweight(to_tsvector('russian', coalesce(name, '')), 'A')
+        || setweight(to_tsvector('russian', coalesce(text, '')), 'B')
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS recipes_recipe_search_vector_idx
+    ON recipes_recipe USING gin (search_vector)
+    ''',
+)
+POSTGRES_BACKWARD = (
+    'DROP INDEX IF EXISTS recipes_recipe_search_vector_idx',
+    'DROP TRIGGER IF EXISTS recipes_recipe_search_vector_trigger '
+    'ON recipes_recipe',
+    'DROP FUNCTION IF EXISTS recipes_recipe_search_vector_update()',
+)
+def run(statements):
+    # Полнотекстовый индекс SQLite создаётся по сигналу post_migrate,
+    # см. recipes.search.setup_sqlite_fts.
+    def operation(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_popularity_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.RunPython(run(POSTGRES_FORWARD), run(POSTGRES_BACKWARD)),
+    ]
@@ -1,9 +1,15 @@
 from colorfield.fields import ColorField
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
+from django.db import connections, models
+from django.db.models import (BooleanField, Exists, F, OuterRef, Prefetch,
+                              Value, Window)
+from django.db.models.functions import RowNumber
+from django.utils import timezone
 
-from recipes.constants import RecipesModels
-from users.models import User
+from recipes.constants import IngredientImports, RecipesModels
+from users.models import (CountersMixin, Subscription, User,
+                          UserRelationQuerySet)
 
 
 class Tag(models.Model):
@@ -75,8 +81,148 @@ class Ingredient(models.Model):
         return self.name
 
 
-class Recipe(models.Model):
+class RecipeQuerySet(models.QuerySet):
+    """QuerySet рецептов."""
+
+    def with_user_flags(self, user):
+        """Аннотирует флаги избранного, корзины и подписки на автора."""
+        if user.is_anonymous:
+            false = Value(False, output_field=BooleanField())
+            return self.annotate(
+                is_favorited=false,
+                is_in_shopping_cart=false,
+                is_author_subscribed=false,
+            )
+        return self.annotate(
+            is_favorited=Exists(
+                Favorite.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+            is_in_shopping_cart=Exists(
+                ShoppingCart.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+            is_author_subscribed=Exists(
+                Subscription.objects.filter(
+                    user=user, author=OuterRef('author')
+                )
+            ),
+        )
+
+    def for_read(self, user=None):
+        """Подготавливает рецепты к сериализации без N+1 запросов.
+
+        Если передан user, флаги избранного, корзины и подписки
+        вычисляются в том же запросе (with_user_flags), иначе
+        сериализаторы берут их из кэша принадлежности
+        (recipes.cache.MembershipCache).
+        """
+        queryset = self if user is None else self.with_user_flags(user)
+        return queryset.select_related('author').defer(
+            'search_vector'
+        ).prefetch_related(
+            'tags',
+            Prefetch(
+                'recipe_ingredients',
+                queryset=RecipeIngredient.objects.select_related(
+                    'ingredient__measurement_unit'
+                ),
+            ),
+        )
+
+    def latest_by_author(self, author_ids, limit=None):
+        """Возвращает словарь {id автора: последние limit рецептов}.
+
+        Превью для всей страницы подписок выбираются одним запросом
+        с ROW_NUMBER() по автору; если СУБД не поддерживает оконные
+        функции, выполняется отдельный запрос на каждого автора.
+        """
+        recipes_by_author = {author_id: [] for author_id in author_ids}
+        if not recipes_by_author:
+            return recipes_by_author
+        queryset = self.filter(author__in=recipes_by_author).order_by('-id')
+        if limit is None:
+            recipes = queryset
+        elif connections[self.db].features.supports_over_clause:
+            windowed = queryset.annotate(
+                row_number=Window(
+                    expression=RowNumber(),
+                    partition_by=[F('author')],
+                    order_by=F('id').desc(),
+                )
+            )
+            sql, params = windowed.query.sql_with_params()
+            recipes = self.model.objects.raw(
+                f'SELECT * FROM ({sql}) AS windowed '
+                'WHERE windowed.row_number <= %s ORDER BY windowed.id DESC',
+                (*params, limit),
+            )
+        else:
+            recipes = [
+                recipe
+                for author_id in recipes_by_author
+                for recipe in queryset.filter(author=author_id)[:limit]
+            ]
+        for recipe in recipes:
+            recipes_by_author[recipe.author_id].append(recipe)
+        return recipes_by_author
+
+
+class IngredientImport(models.Model):
+    """Модель импорта ингредиентов из файла."""
+
+    class Status(models.TextChoices):
+        PENDING = "pending", "В очереди"
+        RUNNING = "running", "Выполняется"
+        DONE = "done", "Завершён"
+        SKIPPED = "skipped", "Пропущен"
+        FAILED = "failed", "Ошибка"
+
+    source = models.CharField(
+        max_length=IngredientImports.MAX_LEN_SOURCE.value,
+        verbose_name="Источник",
+    )
+    content_hash = models.CharField(
+        max_length=64, db_index=True, verbose_name="Хеш содержимого"
+    )
+    status = models.CharField(
+        max_length=16,
+        choices=Status.choices,
+        default=Status.PENDING,
+        verbose_name="Статус",
+    )
+    rows_processed = models.PositiveIntegerField(
+        default=0, verbose_name="Обработано строк"
+    )
+    rows_created = models.PositiveIntegerField(
+        default=0, verbose_name="Добавлено ингредиентов"
+    )
+    errors = models.JSONField(
+        default=list, blank=True, verbose_name="Ошибки"
+    )
+    started_at = models.DateTimeField(
+        auto_now_add=True, verbose_name="Начало"
+    )
+    finished_at = models.DateTimeField(
+        null=True, blank=True, verbose_name="Окончание"
+    )
+
+    class Meta:
+        ordering = ["-id"]
+        verbose_name = "Импорт ингредиентов"
+        verbose_name_plural = "Импорты ингредиентов"
+
+    def __str__(self):
+        return f"{self.source} ({self.get_status_display()})"
+
+    @property
+    def rows_per_second(self):
+        end = self.finished_at or timezone.now()
+        elapsed = (end - self.started_at).total_seconds()
+        return self.rows_processed / elapsed if elapsed > 0 else 0
+
+
+class Recipe(CountersMixin, models.Model):
     """Модель рецета."""
+    counter_fields = ("favorites_count", "shopping_cart_count")
 
     tags = models.ManyToManyField(Tag, through="RecipeTag",
                                   verbose_name="Теги")
@@ -95,7 +241,23 @@ class Recipe(models.Model):
     )
     image = models.ImageField(upload_to="recipes/images/",
                               verbose_name="Изображение")
+    image_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name="Уменьшенные копии изображения",
+    )
     text = models.TextField(verbose_name="Описание")
+    favorites_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name="Добавлений в избранное"
+    )
+    shopping_cart_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name="Добавлений в корзину"
+    )
+    # Заполняется триггером PostgreSQL, см. recipes.search.search_recipes.
+    search_vector = SearchVectorField(
+        null=True, editable=False, verbose_name="Поисковый вектор"
+    )
     cooking_time = models.PositiveSmallIntegerField(
         validators=[
             MinValueValidator(
@@ -116,8 +278,20 @@ class Recipe(models.Model):
         verbose_name="Время приготовления, мин.",
     )
 
+    objects = RecipeQuerySet.as_manager()
+
     class Meta:
         ordering = ["-id"]
+        indexes = [
+            models.Index(
+                fields=["-favorites_count", "-id"],
+                name="recipes_recipe_popular_idx",
+            ),
+            models.Index(
+                fields=["cooking_time", "-id"],
+                name="recipes_recipe_cooking_idx",
+            ),
+        ]
         verbose_name = "Рецепт"
         verbose_name_plural = "Рецепты"
 
@@ -137,6 +311,12 @@ class RecipeTag(models.Model):
             models.UniqueConstraint(fields=["recipe", "tag"],
                                     name="unique_recipe_tag")
         ]
+        # Уникальный индекс начинается с recipe, а фильтр по тегам
+        # ищет рецепты по tag.
+        indexes = [
+            models.Index(fields=["tag", "recipe"],
+                         name="recipes_recipetag_tag_idx")
+        ]
         verbose_name = "Тег рецепта"
         verbose_name_plural = "Теги рецепта"
 
@@ -176,6 +356,12 @@ class RecipeIngredient(models.Model):
                 name="unique_recipe_ingredient",
             )
         ]
+        indexes = [
+            models.Index(
+                fields=["ingredient", "recipe"],
+                name="recipes_recipeingr_ingr_idx",
+            )
+        ]
         ordering = ["recipe"]
         verbose_name = "Ингредиент рецепта"
         verbose_name_plural = "Ингредиенты рецепта"
@@ -198,6 +384,8 @@ class UserRecipe(models.Model):
         verbose_name="Рецепт",
     )
 
+    objects = UserRelationQuerySet.as_manager()
+
     class Meta:
         abstract = True
         default_related_name = "%(model_name)s"
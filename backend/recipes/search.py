@@ -0,0 +1,282 @@
+import heapq
+import re
+import threading
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            TrigramSimilarity)
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.db.models.functions import Lower
+
+from recipes.cache import get_ingredients_version
+from recipes.constants import IngredientSearch, RecipeSearch
+from recipes.models import Ingredient
+
+PREFIX_MATCH = 2
+SUBSTRING_MATCH = 1
+SIMILAR_MATCH = 0
+
+
+def normalize(text):
+    """Приводит название к виду для поиска: без регистра и без «ё»."""
+    return text.casefold().replace('ё', 'е')
+
+
+def trigrams(text):
+    """Возвращает множество триграмм текста по правилам pg_trgm."""
+    result = set()
+    for word in re.findall(r'\w+', text):
+        padded = f'  {word} '
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+class IngredientIndex:
+    """Индекс названий ингредиентов в памяти процесса.
+
+    Хранит отсортированный массив нормализованных названий и отвечает
+    на запросы по префиксу двоичным поиском без обращения к базе.
+    Индекс перестраивается по основной БД, когда меняется версия
+    справочника ингредиентов в кэше.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._entries = ([], [])
+        self._trigrams = None
+
+    def build(self):
+        version = get_ingredients_version()
+        rows = sorted(
+            (normalize(name), name, pk, unit)
+            for pk, name, unit in Ingredient.objects.using(
+                DEFAULT_DB_ALIAS
+            ).values_list('id', 'name', 'measurement_unit__name')
+        )
+        self._entries = (
+            [key for key, *_ in rows],
+            [
+                {'id': pk, 'name': name, 'measurement_unit': unit}
+                for _, name, pk, unit in rows
+            ],
+        )
+        self._trigrams = None
+        self._version = version
+
+    def warm_up(self):
+        """Строит индекс при старте воркера, если база доступна."""
+        try:
+            self.build()
+        except DatabaseError:
+            self._version = None
+
+    def refresh(self):
+        if self._version == get_ingredients_version():
+            return
+        with self._lock:
+            if self._version != get_ingredients_version():
+                self.build()
+
+    def search(self, prefix, limit):
+        self.refresh()
+        keys, items = self._entries
+        prefix = normalize(prefix)
+        start = bisect_left(keys, prefix)
+        result = []
+        for key, item in zip(keys[start:start + limit],
+                             items[start:start + limit]):
+            if not key.startswith(prefix):
+                break
+            result.append(item)
+        return result
+
+    def _trigram_index(self, keys):
+        """Строит обратный индекс триграмм: триграмма -> позиции названий."""
+        index = self._trigrams
+        if index is not None and index[0] is keys:
+            return index
+        postings = defaultdict(list)
+        sizes = []
+        for position, key in enumerate(keys):
+            key_trigrams = trigrams(key)
+            sizes.append(len(key_trigrams))
+            for trigram in key_trigrams:
+                postings[trigram].append(position)
+        index = self._trigrams = (keys, postings, sizes)
+        return index
+
+    def fuzzy_search(self, query, limit):
+        """Ранжированный поиск: префикс, подстрока, похожие названия."""
+        self.refresh()
+        keys, items = self._entries
+        _, postings, sizes = self._trigram_index(keys)
+        query = normalize(query)
+        query_trigrams = trigrams(query)
+        common = Counter()
+        for trigram in query_trigrams:
+            common.update(postings.get(trigram, ()))
+        if len(query) < 3:
+            # Короткий запрос может не иметь общих триграмм с подстрокой.
+            common.update(
+                position for position, key in enumerate(keys)
+                if query in key and position not in common
+            )
+        threshold = IngredientSearch.SIMILARITY_THRESHOLD.value
+        ranked = []
+        for position, shared in common.items():
+            key = keys[position]
+            score = shared / (len(query_trigrams) + sizes[position] - shared)
+            if key.startswith(query):
+                rank = PREFIX_MATCH
+            elif query in key:
+                rank = SUBSTRING_MATCH
+            elif score >= threshold:
+                rank = SIMILAR_MATCH
+            else:
+                continue
+            ranked.append((-rank, -score, position))
+        return [items[position]
+                for *_, position in heapq.nsmallest(limit, ranked)]
+
+
+ingredient_index = IngredientIndex()
+
+
+def _search_postgres(query, limit):
+    query = query.lower()
+    ingredients = (
+        Ingredient.objects.annotate(search_name=Lower('name'))
+        .filter(
+            Q(search_name__startswith=query)
+            | Q(search_name__contains=query)
+            | Q(search_name__trigram_similar=query)
+        )
+        .annotate(
+            rank=Case(
+                When(
+                    search_name__startswith=query, then=Value(PREFIX_MATCH)
+                ),
+                When(
+                    search_name__contains=query, then=Value(SUBSTRING_MATCH)
+                ),
+                default=Value(SIMILAR_MATCH),
+                output_field=IntegerField(),
+            ),
+            similarity=TrigramSimilarity('search_name', query),
+        )
+        .order_by('-rank', '-similarity', 'name')
+        .values_list('id', 'name', 'measurement_unit__name')[:limit]
+    )
+    return [
+        {'id': pk, 'name': name, 'measurement_unit': unit}
+        for pk, name, unit in ingredients
+    ]
+
+
+def search_ingredients(query, limit):
+    """Ищет ингредиенты с учётом опечаток.
+
+    На PostgreSQL использует индексы pg_trgm и lower(name), на других
+    СУБД ранжирует названия из индекса в памяти процесса.
+    """
+    if connections[Ingredient.objects.db].vendor == 'postgresql':
+        return _search_postgres(query, limit)
+    return ingredient_index.fuzzy_search(query, limit)
+
+
+SQLITE_FTS_TABLE = 'recipes_recipe_fts'
+SQLITE_FTS_TRIGGERS = (
+    '''
+    CREATE TRIGGER IF NOT EXISTS recipes_recipe_fts_insert
+    AFTER INSERT ON recipes_recipe BEGIN
+        INSERT INTO recipes_recipe_fts (rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS recipes_recipe_fts_delete
+    AFTER DELETE ON recipes_recipe BEGIN
+        INSERT INTO recipes_recipe_fts (recipes_recipe_fts, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS recipes_recipe_fts_update
+    AFTER UPDATE OF name, text ON recipes_recipe BEGIN
+        INSERT INTO recipes_recipe_fts (recipes_recipe_fts, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+        INSERT INTO recipes_recipe_fts (rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END
+    ''',
+)
+
+
+def setup_sqlite_fts(using='default', **kwargs):
+    """Создаёт таблицу FTS5 и триггеры для поиска рецептов в SQLite.
+
+    Вызывается после каждой миграции: SQLite пересоздаёт таблицу
+    рецептов при изменении схемы, и её триггеры при этом пропадают.
+    """
+    db = connections[using]
+    if db.vendor != 'sqlite':
+        return
+    with db.cursor() as cursor:
+        tables = db.introspection.table_names(cursor)
+        if 'recipes_recipe' not in tables:
+            return
+        if SQLITE_FTS_TABLE not in tables:
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE {SQLITE_FTS_TABLE} USING fts5('
+                "name, text, content='recipes_recipe', content_rowid='id', "
+                "tokenize='unicode61 remove_diacritics 2')"
+            )
+            cursor.execute(
+                f'INSERT INTO {SQLITE_FTS_TABLE} ({SQLITE_FTS_TABLE}) '
+                "VALUES ('rebuild')"
+            )
+        for statement in SQLITE_FTS_TRIGGERS:
+            cursor.execute(statement)
+
+
+def _fts5_query(query):
+    words = re.findall(r'\w+', query.lower())
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def _search_recipes_sqlite(queryset, query):
+    match = _fts5_query(query)
+    if not match:
+        return queryset.none()
+    # Таблица FTS5 присоединяется в том же запросе: bm25() доступна только
+    # рядом с MATCH, а у таблицы нет модели для обычного JOIN.
+    return queryset.extra(
+        select={'rank': f'bm25({SQLITE_FTS_TABLE}, 10.0, 1.0)'},
+        tables=[SQLITE_FTS_TABLE],
+        where=[
+            f'{SQLITE_FTS_TABLE} MATCH %s',
+            f'{SQLITE_FTS_TABLE}.rowid = {queryset.model._meta.db_table}.id',
+        ],
+        params=[match],
+    ).order_by('rank', '-id')
+
+
+def search_recipes(queryset, query):
+    """Полнотекстовый поиск рецептов по названию и описанию.
+
+    На PostgreSQL ищет по столбцу search_vector (русская конфигурация,
+    название весомее описания), который поддерживается триггером и
+    покрыт GIN-индексом; результаты упорядочены по ts_rank. Локально на
+    SQLite использует таблицу FTS5 и ранжирование bm25.
+    """
+    if connections[queryset.db].vendor != 'postgresql':
+        return _search_recipes_sqlite(queryset, query)
+    search_query = SearchQuery(
+        query, config=RecipeSearch.CONFIG.value, search_type='websearch'
+    )
+    return queryset.filter(search_vector=search_query).annotate(
+        rank=SearchRank(F('search_vector'), search_query)
+    ).order_by('-rank', '-id')
@@ -0,0 +1,102 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from recipes.cache import (bump_cart_versions_on_commit,
+                           bump_ingredients_version_on_commit,
+                           bump_recipe_cart_versions_on_commit,
+                           bump_recipes_versions_on_commit, favorites_cache,
+                           shopping_cart_cache, subscriptions_cache,
+                           tags_cache, units_cache)
+from recipes.counters import change_counter
+from recipes.images import schedule_variants
+from recipes.models import (Favorite, Ingredient, Recipe, ShoppingCart, Tag,
+                            Unit)
+from users.models import Subscription, User
+
+MEMBERSHIPS = {
+    Favorite: favorites_cache,
+    ShoppingCart: shopping_cart_cache,
+    Subscription: subscriptions_cache,
+}
+COUNTED_RELATIONS = {
+    Favorite: (Recipe, 'recipe_id', 'favorites_count'),
+    ShoppingCart: (Recipe, 'recipe_id', 'shopping_cart_count'),
+    Recipe: (User, 'author_id', 'recipes_count'),
+    Subscription: (User, 'author_id', 'subscribers_count'),
+}
+
+
+@receiver((post_save, post_delete), sender=ShoppingCart)
+def shopping_cart_changed(sender, instance, **kwargs):
+    bump_cart_versions_on_commit([instance.user_id])
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_image_changed(sender, instance, **kwargs):
+    if (
+        instance.image
+        and instance.image_variants.get('source') != instance.image.name
+    ):
+        schedule_variants(instance)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_changed(sender, instance, created, **kwargs):
+    if created:
+        return
+    bump_recipe_cart_versions_on_commit(instance.pk)
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def recipe_written(sender, instance, **kwargs):
+    bump_recipes_versions_on_commit(instance.author_id)
+
+
+@receiver(post_save, sender=User)
+def author_changed(sender, instance, update_fields=None, **kwargs):
+    # Вход в систему сохраняет только last_login, он в рецептах не виден.
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    bump_recipes_versions_on_commit(instance.pk)
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+@receiver((post_save, post_delete), sender=Unit)
+def ingredients_changed(sender, **kwargs):
+    bump_ingredients_version_on_commit()
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def tags_changed(sender, **kwargs):
+    tags_cache.invalidate_on_commit()
+
+
+@receiver((post_save, post_delete), sender=Unit)
+def units_changed(sender, **kwargs):
+    units_cache.invalidate_on_commit()
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Subscription)
+def counted_relation_created(sender, instance, created, **kwargs):
+    if created:
+        model, fk, field = COUNTED_RELATIONS[sender]
+        change_counter(model, getattr(instance, fk), field, 1)
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Subscription)
+def counted_relation_deleted(sender, instance, **kwargs):
+    model, fk, field = COUNTED_RELATIONS[sender]
+    change_counter(model, getattr(instance, fk), field, -1)
+
+
+@receiver((post_save, post_delete), sender=Favorite)
+@receiver((post_save, post_delete), sender=ShoppingCart)
+@receiver((post_save, post_delete), sender=Subscription)
+def membership_changed(sender, instance, **kwargs):
+    MEMBERSHIPS[sender].refresh_on_commit(instance.user_id)
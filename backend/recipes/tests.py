@@ -0,0 +1,322 @@
+import io
+import os
+import tempfile
+import time
+from unittest import mock, skipUnless
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import TestCase
+
+from recipes.admin import EstimatedCountPaginator
+from recipes.cache import get_cart_version, tags_cache
+from recipes.constants import DataVersions
+from recipes.importers import READ_CHUNK_SIZE, read_csv, read_json
+from recipes.models import (Favorite, Ingredient, IngredientImport, Recipe,
+                            RecipeIngredient, ShoppingCart, Tag, Unit)
+from recipes.search import ingredient_index, search_recipes
+from users.models import Subscription, User
+
+
+def create_user(username):
+    return User.objects.create_user(
+        username=username,
+        email=f'{username}@example.com',
+        password='password',
+        first_name=username,
+        last_name=username,
+    )
+
+
+def create_recipe(author, **fields):
+    # Копии изображения уже «созданы», иначе их генерация искала бы файл.
+    image = 'recipes/images/test.png'
+    return Recipe.objects.create(
+        author=author,
+        name=fields.pop('name', 'Рецепт'),
+        text=fields.pop('text', 'Описание'),
+        image=image,
+        image_variants={'source': image},
+        cooking_time=fields.pop('cooking_time', 10),
+        **fields,
+    )
+
+
+class CountersTests(TestCase):
+    """Счётчики не перезаписываются устаревшими значениями при save()."""
+
+    def setUp(self):
+        self.author = create_user('author')
+        self.recipe = create_recipe(self.author)
+
+    def test_stale_recipe_save_keeps_favorites_count(self):
+        Favorite.objects.add(user=create_user('first'), recipe=self.recipe)
+        stale = Recipe.objects.get(pk=self.recipe.pk)
+        Favorite.objects.add(user=create_user('second'), recipe=self.recipe)
+        stale.name = 'Новое название'
+        stale.save()
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.name, 'Новое название')
+        self.assertEqual(self.recipe.favorites_count, 2)
+        self.assertEqual(
+            Favorite.objects.filter(recipe=self.recipe).count(), 2
+        )
+
+    def test_stale_user_save_keeps_counters(self):
+        stale = User.objects.get(pk=self.author.pk)
+        Subscription.objects.add(user=create_user('reader'), author=stale)
+        create_recipe(self.author, name='Второй рецепт')
+        stale.first_name = 'Автор'
+        stale.save()
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.first_name, 'Автор')
+        self.assertEqual(self.author.recipes_count, 2)
+        self.assertEqual(self.author.subscribers_count, 1)
+
+
+class UserRelationsTests(TestCase):
+    """Повторные add() и remove() не меняют счётчики повторно."""
+
+    def setUp(self):
+        self.user = create_user('reader')
+        self.author = create_user('author')
+        self.recipe = create_recipe(self.author)
+
+    def _check_twice(self):
+        relations = (
+            (Favorite, {'user': self.user, 'recipe': self.recipe},
+             self.recipe, 'favorites_count'),
+            (ShoppingCart, {'user': self.user, 'recipe': self.recipe},
+             self.recipe, 'shopping_cart_count'),
+            (Subscription, {'user': self.user, 'author': self.author},
+             self.author, 'subscribers_count'),
+        )
+        for model, fields, counted, counter in relations:
+            with self.subTest(model=model.__name__):
+                self.assertIsNotNone(model.objects.add(**fields))
+                self.assertIsNone(model.objects.add(**fields))
+                counted.refresh_from_db()
+                self.assertEqual(getattr(counted, counter), 1)
+                self.assertEqual(model.objects.filter(**fields).count(), 1)
+                self.assertIsNotNone(model.objects.remove(**fields))
+                self.assertIsNone(model.objects.remove(**fields))
+                counted.refresh_from_db()
+                self.assertEqual(getattr(counted, counter), 0)
+                self.assertFalse(model.objects.filter(**fields).exists())
+
+    def test_add_and_remove_twice(self):
+        self._check_twice()
+
+    def test_add_and_remove_twice_without_returning(self):
+        with mock.patch(
+            'users.models.supports_returning', return_value=False
+        ):
+            self._check_twice()
+
+
+class SearchRecipesTests(TestCase):
+    """Полнотекстовый поиск рецептов."""
+
+    def test_name_matches_rank_above_text_matches(self):
+        author = create_user('author')
+        in_text = create_recipe(author, name='Обед', text='Горячий борщ')
+        in_name = create_recipe(author, name='Борщ', text='Суп')
+        create_recipe(author, name='Каша', text='Овсянка')
+        self.assertEqual(
+            list(search_recipes(Recipe.objects.all(), 'борщ')),
+            [in_name, in_text],
+        )
+
+    def test_backend_of_queryset_database_is_used(self):
+        alias, vendors = 'search-test', {
+            'sqlite': 'django.db.backends.postgresql',
+            'postgresql': 'django.db.backends.sqlite3',
+        }
+        connections.settings[alias] = {
+            **connection.settings_dict, 'ENGINE': vendors[connection.vendor]
+        }
+        self.addCleanup(connections.settings.__delitem__, alias)
+        self.addCleanup(connections.__delitem__, alias)
+        result = search_recipes(Recipe.objects.using(alias), 'борщ')
+        # Запрос только строится: к базе alias он не обращается.
+        postgresql = connections[alias].vendor == 'postgresql'
+        self.assertEqual('rank' in result.query.annotations, postgresql)
+        self.assertEqual(bool(result.query.extra_tables), not postgresql)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Нужен PostgreSQL.')
+class EstimatedCountPaginatorTests(TestCase):
+    """Количество рецептов в админке по статистике pg_class."""
+
+    def _analyze(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE recipes_recipe')
+
+    def _count(self, queryset):
+        return EstimatedCountPaginator(queryset, 10).count
+
+    def setUp(self):
+        self.author = create_user('author')
+
+    def test_outdated_estimate_of_small_table_is_corrected(self):
+        self._analyze()
+        for _ in range(3):
+            create_recipe(self.author)
+        self.assertEqual(self._count(Recipe.objects.all()), 3)
+
+    def test_estimate_is_used_without_filters(self):
+        recipes = [create_recipe(self.author) for _ in range(3)]
+        self._analyze()
+        recipes[0].delete()
+        self.assertEqual(self._count(Recipe.objects.all()), 3)
+        self.assertEqual(
+            self._count(Recipe.objects.filter(author=self.author)), 2
+        )
+
+
+class ReferenceCacheTests(TestCase):
+    """Справочники в памяти процесса сбрасываются после фиксации."""
+
+    def test_tags_cache_is_invalidated_on_commit(self):
+        cache.clear()
+        self.assertEqual(tags_cache.get()['tags'], [])
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(name='Ужин', color='#49B64E', slug='dinner')
+            # Версия не сменилась: читатели не берут незафиксированные
+            # строки под новой версией.
+            self.assertEqual(tags_cache.get()['tags'], [])
+        self.assertEqual(
+            [tag['slug'] for tag in tags_cache.get()['tags']], ['dinner']
+        )
+
+    def _after_local_timeout(self):
+        return mock.patch(
+            'time.time',
+            return_value=time.time() + DataVersions.LOCAL_TIMEOUT.value + 1,
+        )
+
+    def test_changes_from_other_processes_are_seen_after_timeout(self):
+        # Записи без сигналов: так кэш процесса видит изменения,
+        # сделанные другим процессом.
+        cache.clear()
+        Tag.objects.bulk_create(
+            [Tag(name='Ужин', color='#49B64E', slug='dinner')]
+        )
+        unit = Unit.objects.create(name='г')
+        self.assertEqual(ingredient_index.search('со', 10), [])
+        tags = tags_cache.get()['tags']
+        Tag.objects.update(slug='supper')
+        Ingredient.objects.bulk_create(
+            [Ingredient(name='соль', measurement_unit=unit)]
+        )
+        self.assertEqual(tags_cache.get()['tags'], tags)
+        with self._after_local_timeout():
+            self.assertEqual(
+                [tag['slug'] for tag in tags_cache.get()['tags']],
+                ['supper'],
+            )
+            self.assertEqual(
+                [item['name'] for item in ingredient_index.search('со', 10)],
+                ['соль'],
+            )
+
+
+class ShoppingListVersionTests(TestCase):
+    """Версия сохранённого списка покупок."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('buyer')
+        self.recipe = create_recipe(create_user('author'))
+        self.ingredient = Ingredient.objects.create(
+            name='мука', measurement_unit=Unit.objects.create(name='г')
+        )
+        RecipeIngredient.objects.create(
+            recipe=self.recipe, ingredient=self.ingredient, amount=100
+        )
+        ShoppingCart.objects.add(user=self.user, recipe=self.recipe)
+
+    def test_recipe_update_changes_version_after_commit(self):
+        version = get_cart_version(self.user.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.save()
+            self.assertEqual(get_cart_version(self.user.id), version)
+        self.assertNotEqual(get_cart_version(self.user.id), version)
+
+    def test_ingredient_rename_changes_version(self):
+        version = get_cart_version(self.user.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ingredient.name = 'мука пшеничная'
+            self.ingredient.save()
+        self.assertNotEqual(get_cart_version(self.user.id), version)
+
+
+class ReadersTests(TestCase):
+    """Потоковое чтение файлов ингредиентов."""
+
+    def test_json_object_split_across_chunks(self):
+        # Первый объект начинается в конце первой порции и дочитывается.
+        padding = ' ' * (READ_CHUNK_SIZE - 10)
+        text = (
+            f'[{padding}{{"name": "Соль", "measurement_unit": "г"}},\n'
+            '{"name": "Вода", "measurement_unit": "мл"}]'
+        )
+        self.assertEqual(
+            list(read_json(io.StringIO(text))),
+            [(1, 'Соль', 'г'), (2, 'Вода', 'мл')],
+        )
+
+    def test_csv_with_header(self):
+        text = 'measurement_unit;name\nг;Соль\n\nмл;Вода\n'
+        self.assertEqual(
+            list(read_csv(io.StringIO(text))),
+            [(2, 'Соль', 'г'), (4, 'Вода', 'мл')],
+        )
+
+    def test_csv_without_header(self):
+        text = 'Соль,г\nВода,мл\n'
+        self.assertEqual(
+            list(read_csv(io.StringIO(text))),
+            [(1, 'Соль', 'г'), (2, 'Вода', 'мл')],
+        )
+
+
+class ImportIngredientsCommandTests(TestCase):
+    """Повторный импорт файла командой import_ingredients."""
+
+    def setUp(self):
+        file = tempfile.NamedTemporaryFile(
+            'w', suffix='.csv', encoding='utf-8', delete=False
+        )
+        with file:
+            file.write('name,measurement_unit\nСоль,г\nВода,мл\n')
+        self.addCleanup(os.remove, file.name)
+        self.path = file.name
+
+    def _import(self, **options):
+        call_command(
+            'import_ingredients', path=self.path,
+            stdout=io.StringIO(), stderr=io.StringIO(), **options,
+        )
+        return IngredientImport.objects.latest('pk')
+
+    def test_second_run_is_skipped(self):
+        self.assertEqual(
+            self._import().status, IngredientImport.Status.DONE
+        )
+        self.assertEqual(
+            self._import().status, IngredientImport.Status.SKIPPED
+        )
+        self.assertEqual(Ingredient.objects.count(), 2)
+
+    def test_forced_run_creates_no_duplicates(self):
+        self._import()
+        ingredient_import = self._import(force=True)
+        self.assertEqual(
+            ingredient_import.status, IngredientImport.Status.DONE
+        )
+        self.assertEqual(ingredient_import.rows_processed, 2)
+        self.assertEqual(ingredient_import.rows_created, 0)
+        self.assertEqual(Ingredient.objects.count(), 2)
+        self.assertEqual(Unit.objects.count(), 2)
@@ -1,12 +1,132 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models.signals import post_delete, post_save
 from django.utils.translation import gettext_lazy as _
 
 from recipes.constants import UsersModels
 
 
-class User(AbstractUser):
+def supports_returning(connection):
+    """Поддерживает ли СУБД INSERT/DELETE ... RETURNING."""
+    if connection.vendor == 'postgresql':
+        return True
+    return (
+        connection.vendor == 'sqlite'
+        and connection.Database.sqlite_version_info >= (3, 35)
+    )
+
+
+class UserRelationQuerySet(models.QuerySet):
+    """QuerySet связей пользователя: избранного, корзины, подписок.
+
+    add() и remove() выполняют изменение одним запросом и сообщают,
+    изменилось ли что-нибудь, поэтому повторный или одновременный
+    запрос не приводит к ошибке уникальности. Сигналы post_save и
+    post_delete отправляются вручную, чтобы обработчики (счётчики,
+    кэши) срабатывали так же, как при save() и delete(). Как и у
+    create() или delete(), запросы идут в БД для записи.
+    """
+
+    def _columns(self, fields):
+        obj = self.model(**fields)
+        connection = connections[self.db]
+        columns, values = [], []
+        for name in fields:
+            field = self.model._meta.get_field(name)
+            columns.append(connection.ops.quote_name(field.column))
+            values.append(
+                field.get_db_prep_save(getattr(obj, field.attname), connection)
+            )
+        return obj, connection, columns, values
+
+    def _send(self, signal, obj, **kwargs):
+        obj._state.adding = False
+        obj._state.db = self.db
+        signal.send(sender=self.model, instance=obj, using=self.db, **kwargs)
+
+    def add(self, **fields):
+        """Создаёт связь, если её нет; возвращает объект или None."""
+        self._for_write = True
+        obj, connection, columns, values = self._columns(fields)
+        if not supports_returning(connection):
+            try:
+                with transaction.atomic(using=self.db):
+                    obj.save(force_insert=True, using=self.db)
+            except IntegrityError:
+                return None
+            return obj
+        opts = self.model._meta
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {connection.ops.quote_name(opts.db_table)} '
+                f'({", ".join(columns)}) '
+                f'VALUES ({", ".join(["%s"] * len(values))}) '
+                f'ON CONFLICT DO NOTHING '
+                f'RETURNING {connection.ops.quote_name(opts.pk.column)}',
+                values,
+            )
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        obj.pk = row[0]
+        self._send(
+            post_save, obj, created=True, update_fields=None, raw=False
+        )
+        return obj
+
+    def remove(self, **fields):
+        """Удаляет связь, если она есть; возвращает объект или None."""
+        self._for_write = True
+        obj, connection, columns, values = self._columns(fields)
+        if not supports_returning(connection):
+            obj = self.filter(**fields).first()
+            if obj is not None:
+                obj.delete()
+            return obj
+        opts = self.model._meta
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {connection.ops.quote_name(opts.db_table)} '
+                f'WHERE {" AND ".join(f"{c} = %s" for c in columns)} '
+                f'RETURNING {connection.ops.quote_name(opts.pk.column)}',
+                values,
+            )
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        obj.pk = row[0]
+        self._send(post_delete, obj)
+        return obj
+
+
+class CountersMixin:
+    """Не перезаписывает счётчики при сохранении загруженного объекта.
+
+    Счётчики меняются только атомарным UPDATE (recipes.counters), а
+    значения в загруженном объекте к моменту save() могут устареть.
+    """
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if (
+            not self._state.adding
+            and not kwargs.get('force_insert')
+            and kwargs.get('update_fields') is None
+        ):
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.attname not in deferred
+                and field.name not in self.counter_fields
+            ]
+        super().save(*args, **kwargs)
+
+
+class User(CountersMixin, AbstractUser):
     """Модель пользователя."""
+    counter_fields = ('recipes_count', 'subscribers_count')
+
     first_name = models.CharField(
         _('first name'), max_length=UsersModels.MAX_LEN_USER_FIRST_NAME.value
     )
@@ -14,6 +134,12 @@ class User(AbstractUser):
         _('last name'), max_length=UsersModels.MAX_LEN_USER_LAST_NAME.value
     )
     email = models.EmailField(_('email address'), unique=True)
+    recipes_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='Количество рецептов'
+    )
+    subscribers_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='Количество подписчиков'
+    )
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']
@@ -42,6 +168,8 @@ class Subscription(models.Model):
         verbose_name='Подписчик',
     )
 
+    objects = UserRelationQuerySet.as_manager()
+
     class Meta:
         constraints = [
             models.UniqueConstraint(